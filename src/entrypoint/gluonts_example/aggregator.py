@@ -0,0 +1,135 @@
+"""Constant-memory aggregation and output of item metrics.
+
+Evaluator.get_aggregate_metrics() aggregates a DataFrame of all item metrics, hence memory grows with the number of
+timeseries. MetricsAggregator instead keeps a running sum and count per aggregated metric, and ItemMetricsWriter
+appends item metrics to their output file as soon as they are computed, so nothing is lost when a job dies late.
+"""
+import os
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Sequence
+
+import numpy as np
+import pandas as pd
+from gluonts.model.forecast import Quantile
+
+
+def base_agg_funs(quantiles: Sequence[Quantile]) -> Dict[str, str]:
+    """Aggregation of each item metric, the same as gluonts.evaluation.Evaluator.get_aggregate_metrics()."""
+    funs = {
+        "MSE": "mean",
+        "abs_error": "sum",
+        "abs_target_sum": "sum",
+        "abs_target_mean": "mean",
+        "seasonal_error": "mean",
+        "MASE": "mean",
+        "MAPE": "mean",
+        "sMAPE": "mean",
+        "OWA": "mean",
+        "MSIS": "mean",
+    }
+    for quantile in quantiles:
+        funs[quantile.loss_name] = "sum"
+        funs[quantile.coverage_name] = "mean"
+    return funs
+
+
+class MetricsAggregator:
+    """Running sums and counts of item metrics.
+
+    Like pandas, NaN (and None, or masked) values are skipped, i.e., the sum of no values is 0 and their mean is NaN.
+
+    Args:
+        agg_funs (Dict[str, str]): "sum" or "mean" of each item metric.
+    """
+
+    def __init__(self, agg_funs: Dict[str, str]):
+        self.agg_funs = agg_funs
+        self.sums = dict.fromkeys(agg_funs, 0.0)
+        self.counts = dict.fromkeys(agg_funs, 0)
+        self.num_series = 0
+
+    def update(self, rows: List[Dict[str, Any]]) -> None:
+        """Add the item metrics of some timeseries."""
+        self.num_series += len(rows)
+        for key in self.agg_funs:
+            values = np.array([row[key] for row in rows], dtype=np.float64)
+            valid = ~np.isnan(values)
+            self.sums[key] += values[valid].sum()
+            self.counts[key] += int(valid.sum())
+
+    def state_dict(self) -> Dict[str, Any]:
+        return {"sums": dict(self.sums), "counts": dict(self.counts), "num_series": self.num_series}
+
+    def load_state_dict(self, state: Dict[str, Any]) -> None:
+        self.sums.update(state["sums"])
+        self.counts.update(state["counts"])
+        self.num_series = state["num_series"]
+
+    def summary(self) -> pd.DataFrame:
+        """A single-row DataFrame of item metrics, which aggregates (as per agg_funs) to the running aggregates.
+
+        Passing it to Evaluator.get_aggregate_metrics() computes the derived metrics (e.g., RMSE, ND, wQuantileLoss)
+        exactly as for the DataFrame of all item metrics.
+        """
+        row = {
+            key: self.sums[key] if fun == "sum" else (self.sums[key] / self.counts[key] if self.counts[key] else np.nan)
+            for key, fun in self.agg_funs.items()
+        }
+        return pd.DataFrame([row], dtype=np.float64)
+
+
+class ItemMetricsWriter:
+    """Append item metrics to a .csv or .parquet file, one batch of timeseries at a time.
+
+    Args:
+        path (os.PathLike): output file, whose suffix selects the format.
+        columns (Optional[Dict[str, str]], optional): item metrics to write, and their column names. Defaults to None,
+            i.e., all item metrics as-is.
+    """
+
+    def __init__(self, path: os.PathLike, columns: Optional[Dict[str, str]] = None):
+        self.path = Path(path)
+        self.columns = columns
+        if self.path.suffix not in (".csv", ".parquet"):
+            raise ValueError(f"Unknown item metrics format: {self.path}")
+        self.f: Any = None
+        self.parquet_writer: Any = None
+
+    def write(self, rows: Iterable[Dict[str, Any]]) -> None:
+        # See Evaluator.__call__() on why dtype=np.float64.
+        df = pd.DataFrame(list(rows), dtype=np.float64)
+        if self.columns is not None:
+            df = df[list(self.columns)].rename(self.columns, axis=1)
+
+        if self.path.suffix == ".csv":
+            header = self.f is None
+            if self.f is None:
+                self.f = self.path.open("w")
+            df.to_csv(self.f, index=False, header=header)
+            self.f.flush()
+            return
+
+        import pyarrow as pa  # Optional dependency, needed only by parquet outputs.
+        import pyarrow.parquet as pq
+
+        if self.parquet_writer is None:
+            table = pa.Table.from_pandas(df, preserve_index=False)
+            self.parquet_writer = pq.ParquetWriter(str(self.path), table.schema)
+        else:
+            table = pa.Table.from_pandas(df, schema=self.parquet_writer.schema, preserve_index=False)
+        self.parquet_writer.write_table(table)
+
+    def resume(self) -> None:
+        """Append to the existing file (if any), e.g., truncated as of a checkpoint. Only for .csv."""
+        if self.path.suffix != ".csv":
+            raise ValueError(f"Cannot append item metrics to: {self.path}")
+        if self.path.exists() and self.path.stat().st_size > 0:
+            self.f = self.path.open("a")
+
+    def close(self) -> None:
+        if self.f is not None:
+            self.f.close()
+        elif self.path.suffix == ".csv":
+            self.path.touch()
+        if self.parquet_writer is not None:
+            self.parquet_writer.close()
@@ -0,0 +1,155 @@
+"""Single-file model artifact, which the inference entrypoint loads faster than a serialized predictor directory.
+
+Predictor.deserialize() of the directory that the train script saves rebuilds the network's whole object graph from
+its gluonts.core.serde JSON, then loads its parameters. Instead, the artifact stores the hybridized network as an
+exported MXNet symbol plus parameters (i.e., a SymbolBlockPredictor), its transformation chain, and the y-transform,
+all in one zip file with a versioned manifest.json.
+
+load_artifact() reads just the manifest, and returns a LazyPredictor whose network is imported on first use.
+"""
+import json
+import logging
+import os
+import tempfile
+import threading
+import zipfile
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, Dict, Union
+
+if TYPE_CHECKING:
+    # Imported on first use otherwise, so that load_artifact() reads the manifest without loading gluonts.
+    from gluonts.model.predictor import GluonPredictor, Predictor
+
+logger = logging.getLogger(__name__)
+
+# File name of the artifact under model_dir.
+ARTIFACT = "model.gluonts.zip"
+
+# Identifies the artifact layout; bump VERSION on any incompatible change.
+FORMAT = "gluonts-entrypoint-model"
+VERSION = 1
+MANIFEST = "manifest.json"
+
+# Custom fields of a LazyPredictor that the loaded predictor needs too, i.e., which its predict() reads.
+_FORWARDED = ("output_transform",)
+
+
+def export_artifact(predictor: "Predictor", path: Union[str, Path], y_transform: Dict[str, str]) -> None:
+    """Save a predictor and its y-transform (i.e., the content of y_transform.json) to a single file.
+
+    A gluon predictor is converted to a SymbolBlockPredictor first, by hybridizing its network on a synthetic batch.
+    Other predictors (e.g., NPTS) are stored as they serialize.
+    """
+    import gluonts
+    from gluonts.core.serde import fqname_for
+    from gluonts.model.predictor import GluonPredictor
+
+    if isinstance(predictor, GluonPredictor):
+        predictor = predictor.as_symbol_block_predictor(_synthetic_batch(predictor))
+
+    manifest = {
+        "format": FORMAT,
+        "version": VERSION,
+        "gluonts": gluonts.__version__,
+        "predictor": fqname_for(predictor.__class__),
+        "freq": predictor.freq,
+        "prediction_length": predictor.prediction_length,
+        "y_transform": y_transform,
+    }
+
+    # Write-then-rename, so that a model_fn() never loads a partially written artifact.
+    tmp = f"{path}.tmp"
+    with tempfile.TemporaryDirectory(prefix="gluonts-artifact-") as serialized_dir:
+        predictor.serialize(Path(serialized_dir))
+        # Stored uncompressed: the parameters hardly compress, and are then read without inflating.
+        with zipfile.ZipFile(tmp, "w", compression=zipfile.ZIP_STORED) as zf:
+            zf.writestr(MANIFEST, json.dumps(manifest))
+            for fname in sorted(os.listdir(serialized_dir)):
+                zf.write(os.path.join(serialized_dir, fname), fname)
+    os.replace(tmp, path)
+    logger.info("export_artifact: saved %s to %s", manifest["predictor"], path)
+
+
+def load_artifact(path: Union[str, Path]) -> "LazyPredictor":
+    """Read the manifest of an artifact, and return a predictor that loads the network on first use."""
+    with zipfile.ZipFile(path) as zf:
+        manifest = json.loads(zf.read(MANIFEST))
+    if manifest.get("format") != FORMAT or manifest.get("version") != VERSION:
+        raise ValueError(
+            f"Unsupported model artifact: {path} (format={manifest.get('format')}, version={manifest.get('version')})"
+        )
+    return LazyPredictor(path, manifest)
+
+
+class LazyPredictor:
+    """Proxy of the predictor of an artifact, which deserializes the predictor on first access to any attribute that
+    the manifest lacks, e.g., predict() or batch_size.
+
+    Attributes set on the proxy (e.g., the custom fields that serving.load_predictor() adds) stay on the proxy, and
+    those of _FORWARDED are also set on the loaded predictor.
+    """
+
+    def __init__(self, path: Union[str, Path], manifest: Dict[str, Any]):
+        self.__dict__.update(
+            path=str(path),
+            manifest=manifest,
+            freq=manifest["freq"],
+            prediction_length=manifest["prediction_length"],
+            _predictor=None,
+            _lock=threading.Lock(),
+        )
+
+    def __getattr__(self, name: str) -> Any:
+        # Private and special attributes (e.g., those that copy or pickle probe) never trigger loading.
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return getattr(self.load(), name)
+
+    def __setattr__(self, name: str, value: Any) -> None:
+        self.__dict__[name] = value
+        if name in _FORWARDED and self._predictor is not None:
+            setattr(self._predictor, name, value)
+
+    def __repr__(self) -> str:
+        return f"LazyPredictor({self.manifest['predictor']}, path={self.path}, loaded={self._predictor is not None})"
+
+    def load(self) -> "Predictor":
+        """Deserialize the predictor (only once), and return it."""
+        with self._lock:
+            if self._predictor is None:
+                predictor = _deserialize(self.path)
+                for name in _FORWARDED:
+                    if name in self.__dict__:
+                        setattr(predictor, name, self.__dict__[name])
+                self.__dict__["_predictor"] = predictor
+        return self._predictor
+
+
+def _deserialize(path: str) -> "Predictor":
+    from gluonts.model.predictor import Predictor
+
+    with tempfile.TemporaryDirectory(prefix="gluonts-artifact-") as serialized_dir:
+        with zipfile.ZipFile(path) as zf:
+            members = [name for name in zf.namelist() if name != MANIFEST]
+            zf.extractall(serialized_dir, members)
+        predictor = Predictor.deserialize(Path(serialized_dir))
+    logger.info("LazyPredictor: loaded %s", predictor)
+    return predictor
+
+
+def _synthetic_batch(predictor: "GluonPredictor") -> Dict[str, Any]:
+    """One batch of the predictor's input transformation, e.g., to hybridize its network."""
+    from gluonts.dataset.common import ListDataset
+    from gluonts.dataset.loader import InferenceDataLoader
+
+    from .serving import synthetic_request  # Circular import: serving loads artifacts.
+
+    dataset = ListDataset(synthetic_request(predictor, predictor.batch_size), freq=predictor.freq)
+    loader = InferenceDataLoader(
+        dataset,
+        transform=predictor.input_transform,
+        batch_size=predictor.batch_size,
+        ctx=predictor.ctx,
+        dtype=predictor.dtype,
+    )
+    return next(iter(loader))
@@ -0,0 +1,160 @@
+"""Vectorized backtest metrics over a batch of timeseries.
+
+Evaluator.get_metrics_per_ts() computes the metrics of one timeseries at a time. MetricsBatch instead stacks the
+ground truths and forecast quantiles of many timeseries into (num_series, prediction_length) masked arrays, so that
+each metric is one NumPy reduction along the horizon for the whole batch. The metrics are the same as those of
+Evaluator.get_metrics_per_ts() (up to floating-point rounding), hence Evaluator.get_aggregate_metrics() applies as-is.
+"""
+from typing import Any, Dict, List, Sequence, Tuple, Union
+
+import numpy as np
+import pandas as pd
+from gluonts.evaluation import Evaluator, get_seasonality
+from gluonts.model.forecast import Forecast, Quantile
+
+from .forecast import quantile_table
+
+
+class MetricsBatch:
+    """Ground truths and forecasts of a batch of timeseries, stacked as (num_series, prediction_length) arrays.
+
+    All forecasts must have the same prediction length.
+
+    Args:
+        evaluator (Evaluator): provides the quantiles, seasonality, alpha, and calculate_owa of the metrics.
+        pairs (Sequence[Tuple[Union[pd.Series, pd.DataFrame], Forecast]]): (ground truth, forecast) of each
+            timeseries.
+        levels (Sequence[str], optional): quantile levels to tabulate in addition to those needed by the metrics,
+            e.g., for the output file. Defaults to ().
+    """
+
+    def __init__(
+        self,
+        evaluator: Evaluator,
+        pairs: Sequence[Tuple[Union[pd.Series, pd.DataFrame], Forecast]],
+        levels: Sequence[str] = (),
+    ):
+        self.evaluator = evaluator
+        self.forecasts = [forecast for _, forecast in pairs]
+        self.target = np.ma.masked_invalid(
+            np.stack([np.array(evaluator.extract_pred_target(ts, forecast)) for ts, forecast in pairs])
+        )
+        self.past_data = [
+            np.ma.masked_invalid(np.array(evaluator.extract_past_data(ts, forecast))) for ts, forecast in pairs
+        ]
+
+        # For MSIS: alpha/2 quantile may not exist. Find the closest (same as Evaluator.get_metrics_per_ts()).
+        self.lower_q = min(evaluator.quantiles, key=lambda q: abs(q.value - evaluator.alpha / 2))
+        self.upper_q = min(reversed(evaluator.quantiles), key=lambda q: abs(q.value - (1 - evaluator.alpha / 2)))
+
+        names = [q.name for q in evaluator.quantiles] + ["0.5"] + [Quantile.parse(level).name for level in levels]
+        names = list(dict.fromkeys(names))
+        try:
+            self.table = quantile_table(self.forecasts, names)
+        except (AttributeError, NotImplementedError):
+            # Forecasts without mean, hence MSE will be None.
+            self.table = quantile_table(self.forecasts, names, mean=False)
+        self._index = {name: i for i, name in enumerate(self.table.levels)}
+
+    def __len__(self) -> int:
+        return len(self.forecasts)
+
+    def quantile(self, q: Union[float, str, Quantile]) -> np.ndarray:
+        """Forecast quantile of every timeseries, as a (num_series, prediction_length) array."""
+        name = q.name if isinstance(q, Quantile) else Quantile.parse(q).name
+        return self.table.quantiles[:, self._index[name], :]
+
+    def seasonal_error(self) -> np.ndarray:
+        """Same as Evaluator.seasonal_error() of every timeseries, over the NaN-padded past data of the batch."""
+        lengths = np.array([len(past_data) for past_data in self.past_data])
+        seasonality = np.array(
+            [self.evaluator.seasonality or get_seasonality(forecast.freq) for forecast in self.forecasts]
+        )
+        # Edge case: the seasonal freq is larger than the length of ts, hence revert to freq=1.
+        lags = np.where(seasonality < lengths, seasonality, 1)
+
+        # Past data are right-aligned, so that the padding only pairs with (hence masks) the padding.
+        dtype = np.result_type(np.float32, *(past_data.dtype for past_data in self.past_data))
+        padded = np.full((len(self), lengths.max(initial=0)), np.nan, dtype=dtype)
+        for i, past_data in enumerate(self.past_data):
+            if len(past_data) > 0:
+                padded[i, -len(past_data) :] = past_data.astype(dtype).filled(np.nan)
+
+        seasonal_error = np.full(len(self), np.nan)
+        for lag in np.unique(lags):
+            rows = lags == lag
+            abs_diff = np.ma.masked_invalid(np.abs(padded[rows, :-lag] - padded[rows, lag:]))
+            seasonal_error[rows] = np.ma.mean(abs_diff, axis=1).filled(np.nan)
+        return seasonal_error
+
+    def metrics(self) -> Dict[str, Any]:
+        """Metrics of Evaluator.get_metrics_per_ts() (except item_id), each a (num_series,) array (or None)."""
+        ev = self.evaluator
+        target = self.target
+        median_fcst = self.quantile(0.5)
+        seasonal_error = self.seasonal_error()
+        abs_error = np.abs(target - median_fcst)
+        abs_target = np.abs(target)
+
+        se_flag = seasonal_error == 0
+        mape_flag = abs_target == 0
+        smape_denominator = abs_target + np.abs(median_fcst)
+        smape_flag = smape_denominator == 0
+
+        lower, upper = self.quantile(self.lower_q), self.quantile(self.upper_q)
+        msis_numerator = np.ma.mean(
+            upper
+            - lower
+            + 2.0 / ev.alpha * (lower - target) * (target < lower)
+            + 2.0 / ev.alpha * (target - upper) * (target > upper),
+            axis=1,
+        )
+
+        metrics = {
+            "MSE": np.ma.mean(np.square(target - self.table.mean), axis=1) if self.table.mean is not None else None,
+            "abs_error": np.ma.sum(abs_error, axis=1),
+            "abs_target_sum": np.ma.sum(abs_target, axis=1),
+            "abs_target_mean": np.ma.mean(abs_target, axis=1),
+            "seasonal_error": seasonal_error,
+            "MASE": (np.ma.mean(abs_error, axis=1) * (1 - se_flag)) / (seasonal_error + se_flag),
+            "MAPE": np.ma.mean((abs_error * (1 - mape_flag)) / (abs_target + mape_flag), axis=1),
+            "sMAPE": 2 * np.ma.mean((abs_error * (1 - smape_flag)) / (smape_denominator + smape_flag), axis=1),
+            "OWA": np.nan,  # by default not calculated
+            "MSIS": (msis_numerator * (1 - se_flag)) / (seasonal_error + se_flag),
+        }
+
+        if ev.calculate_owa:
+            # Needs the naive-2 forecast of each timeseries, hence not vectorized.
+            metrics["OWA"] = np.array(
+                [
+                    ev.owa(target[i], median_fcst[i], self.past_data[i], seasonal_error[i], forecast.start_date)
+                    for i, forecast in enumerate(self.forecasts)
+                ]
+            )
+
+        for quantile in ev.quantiles:
+            forecast_quantile = self.quantile(quantile)
+            metrics[quantile.loss_name] = 2.0 * np.ma.sum(
+                np.abs((forecast_quantile - target) * ((target <= forecast_quantile) - quantile.value)), axis=1
+            )
+            metrics[quantile.coverage_name] = np.ma.mean(target < forecast_quantile, axis=1)
+
+        return metrics
+
+    def rows(self, metrics: Dict[str, Any]) -> List[Dict[str, Any]]:
+        """Convert (num_series,) metric arrays to one dict per timeseries, as Evaluator.get_metrics_per_ts() does.
+
+        Masked values, i.e., metrics of timeseries whose ground truths are all NaN, become NaN.
+        """
+        n = len(self)
+        columns = {key: _tolist(value, n) for key, value in metrics.items()}
+        return [
+            {"item_id": forecast.item_id, **{key: column[i] for key, column in columns.items()}}
+            for i, forecast in enumerate(self.forecasts)
+        ]
+
+
+def _tolist(value: Any, n: int) -> List[Any]:
+    if value is None:
+        return [None] * n
+    return np.broadcast_to(np.ma.asarray(value, dtype=np.float64).filled(np.nan), (n,)).tolist()
@@ -0,0 +1,153 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+
+from .forecast import QuantileTable
+
+logger = logging.getLogger(__name__)
+
+# Quantiles (num_levels, prediction_length) and mean (prediction_length) of one timeseries.
+CachedForecast = Tuple[np.ndarray, Optional[np.ndarray]]
+
+
+class ForecastCache:
+    """Memoize the forecast quantiles (and mean) of timeseries, keyed by the content of each timeseries.
+
+    A size-bounded LRU lives in memory. Optionally, entries are also written to (and read back from) cache_dir, so
+    they survive process restarts and can be shared by processes on the same host. Hits and misses are counted.
+
+    Keys are derived by key(), and cover everything that changes a forecast: the model artifacts, every field of the
+    timeseries except item_id, the number of sample paths, the random seed, and what is requested.
+    """
+
+    def __init__(self, max_size: int = 100000, cache_dir: Union[None, str, os.PathLike] = None):
+        self.max_size = max_size
+        self.cache_dir = Path(cache_dir) if cache_dir else None
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._lru: "OrderedDict[str, CachedForecast]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(
+        fingerprint: str, entry: Dict[str, Any], num_samples: int, levels: Sequence[str], mean: bool, seed=None
+    ) -> str:
+        h = hashlib.sha1()
+        h.update(f"{fingerprint}|{num_samples}|{seed}|{','.join(levels)}|{mean}".encode())
+        for field in sorted(entry):
+            if field == "item_id":
+                continue
+            h.update(f"|{field}=".encode())
+            h.update(_field_bytes(entry[field]))
+        return h.hexdigest()
+
+    def get(self, key: str) -> Optional[CachedForecast]:
+        with self._lock:
+            value = self._lru.get(key)
+            if value is not None:
+                self._lru.move_to_end(key)
+                self.hits += 1
+                return value
+
+        value = self._load(key)
+        with self._lock:
+            if value is None:
+                self.misses += 1
+            else:
+                self.disk_hits += 1
+                self._put(key, value)
+        return value
+
+    def put(self, key: str, value: CachedForecast) -> None:
+        with self._lock:
+            self._put(key, value)
+        self._save(key, value)
+
+    def merge(self, keys: List[str], found: List[Optional[CachedForecast]], table: QuantileTable) -> QuantileTable:
+        """Merge cached forecasts and the table of the cache misses, in input order, and cache the misses.
+
+        Args:
+            keys (List[str]): key of each timeseries.
+            found (List[Optional[CachedForecast]]): cached forecast of each timeseries, None for cache misses.
+            table (QuantileTable): forecasts of the cache misses only, in input order.
+
+        Returns:
+            QuantileTable: forecasts of all timeseries.
+        """
+        if all(v is None for v in found):
+            for i, key in enumerate(keys):
+                self.put(key, _row(table, i))
+            return table
+
+        quantiles, means = [], []
+        misses = iter(range(len(table)))
+        for key, value in zip(keys, found):
+            if value is None:
+                value = _row(table, next(misses))
+                self.put(key, value)
+            quantiles.append(value[0])
+            means.append(value[1])
+
+        mean = np.stack(means) if table.mean is not None else None
+        return QuantileTable(table.levels, np.stack(quantiles), mean)
+
+    def stats(self) -> Dict[str, int]:
+        return {"hits": self.hits, "disk_hits": self.disk_hits, "misses": self.misses, "size": len(self._lru)}
+
+    def _put(self, key: str, value: CachedForecast) -> None:
+        self._lru[key] = value
+        self._lru.move_to_end(key)
+        while len(self._lru) > self.max_size:
+            self._lru.popitem(last=False)
+
+    def _path(self, key: str) -> Path:
+        return self.cache_dir / key[:2] / f"{key}.npz"  # type: ignore
+
+    def _load(self, key: str) -> Optional[CachedForecast]:
+        if self.cache_dir is None:
+            return None
+        try:
+            with np.load(self._path(key)) as npz:
+                return npz["quantiles"], (npz["mean"] if "mean" in npz.files else None)
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def _save(self, key: str, value: CachedForecast) -> None:
+        if self.cache_dir is None:
+            return
+        path = self._path(key)
+        tmp = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+        arrays = {"quantiles": value[0]}
+        if value[1] is not None:
+            arrays["mean"] = value[1]
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            with tmp.open("wb") as f:
+                np.savez(f, **arrays)
+            os.replace(tmp, path)
+        except OSError:
+            logger.warning("ForecastCache: failed to write %s", path, exc_info=True)
+
+
+def _row(table: QuantileTable, i: int) -> CachedForecast:
+    # Copy, so that a cached row does not pin the whole batch array in memory.
+    return table.quantiles[i].copy(), (table.mean[i].copy() if table.mean is not None else None)
+
+
+def _field_bytes(value: Any) -> bytes:
+    """Numbers as float32 (what the predictor sees), so a JSON list and an .npz array of the same target match."""
+    if not isinstance(value, str):
+        try:
+            arr = np.asarray(value, dtype=np.float32)
+            return f"{arr.shape}".encode() + arr.tobytes()
+        except (TypeError, ValueError):
+            pass
+    return json.dumps(value, sort_keys=True, default=str).encode()
@@ -0,0 +1,121 @@
+"""Checkpoint of a backtest, so that an interrupted evaluation (e.g., of a managed spot training) resumes where it
+stopped instead of starting over.
+
+A checkpointed evaluation writes all its outputs (results, item metrics, plots) under the checkpoint directory, plus:
+
+- item_ids.txt: item_id of each evaluated timeseries, in order.
+- plots.pkl: plots submitted to the renderer so far, to replay them (hence rebuild the montage pages) on resume.
+- state.pkl: the running aggregates, the plot selection, and the size of every appended file, as of the checkpoint.
+
+state.pkl is atomically rewritten at most every interval seconds, and after the last timeseries. On resume, appended
+files are truncated to their checkpointed sizes, i.e., whatever was written after the last checkpoint is evaluated
+again. Hence, the outputs of a resumed evaluation are the same as those of an uninterrupted one.
+"""
+import os
+import pickle
+import shutil
+import time
+from pathlib import Path
+from typing import Any, Dict, Iterable, Iterator, List
+
+from gluonts.dataset.common import DataEntry
+
+from .util import mkdir
+
+# Bookkeeping files, i.e., not outputs of the evaluation.
+ITEM_IDS = "item_ids.txt"
+PLOTS = "plots.pkl"
+STATE = "state.pkl"
+
+
+class EvalCheckpoint:
+    """Checkpoint directory of an evaluation.
+
+    Args:
+        path (os.PathLike): checkpoint directory, which is also the output directory of the evaluation.
+        interval (float, optional): minimum seconds between two checkpoints. Defaults to 60.0.
+    """
+
+    def __init__(self, path: os.PathLike, interval: float = 60.0):
+        self.path = mkdir(path)
+        self.interval = interval
+        self.last_saved = time.monotonic()
+        self.state: Dict[str, Any] = {}
+        if (self.path / STATE).exists():
+            with (self.path / STATE).open("rb") as f:
+                self.state = pickle.load(f)
+
+    @property
+    def num_series(self) -> int:
+        """Number of timeseries evaluated as of the checkpoint."""
+        return self.state.get("num_series", 0)
+
+    def truncate(self, name: str) -> int:
+        """Truncate an appended file to its checkpointed size (or delete it when not checkpointed), then return the
+        size."""
+        size = self.state.get("sizes", {}).get(name, 0)
+        path = self.path / name
+        if size > 0:
+            with path.open("r+b") as f:
+                f.truncate(size)
+        elif path.exists():
+            path.unlink()
+        return size
+
+    def item_ids(self) -> List[str]:
+        self.truncate(ITEM_IDS)
+        if not (self.path / ITEM_IDS).exists():
+            return []
+        return (self.path / ITEM_IDS).read_text().splitlines()
+
+    def skip_evaluated(self, dataset: Iterable[DataEntry]) -> "SkippedDataset":
+        """The dataset without the timeseries evaluated as of the checkpoint."""
+        return SkippedDataset(dataset, self.item_ids())
+
+    def due(self) -> bool:
+        return time.monotonic() - self.last_saved >= self.interval
+
+    def save(self, state: Dict[str, Any], files: Iterable[str]) -> None:
+        """Atomically save state, with the current size of each appended file (which must have been flushed)."""
+        sizes = {}
+        for name in files:
+            # Synced first, so that the checkpointed sizes never exceed what survives a crash.
+            with (self.path / name).open("rb") as f:
+                os.fsync(f.fileno())
+                sizes[name] = os.fstat(f.fileno()).st_size
+        state = {**state, "sizes": sizes}
+        tmp = self.path / f".{STATE}.tmp"
+        with tmp.open("wb") as f:
+            pickle.dump(state, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.path / STATE)
+        self.state = state
+        self.last_saved = time.monotonic()
+
+    def export(self, out_dir: os.PathLike) -> None:
+        """Copy the outputs of the evaluation (i.e., except bookkeeping files) to out_dir."""
+        for src in sorted(self.path.rglob("*")):
+            if src.is_dir() or src.name in (ITEM_IDS, PLOTS, STATE) or src.name.startswith("."):
+                continue
+            dst = Path(out_dir) / src.relative_to(self.path)
+            dst.parent.mkdir(parents=True, exist_ok=True)
+            shutil.copy2(src, dst)
+
+
+class SkippedDataset:
+    """A dataset without its first timeseries, which must have the given item_ids (i.e., the dataset is unchanged)."""
+
+    def __init__(self, dataset: Iterable[DataEntry], item_ids: List[str]):
+        self.dataset = dataset
+        self.item_ids = item_ids
+
+    def __iter__(self) -> Iterator[DataEntry]:
+        it = iter(self.dataset)
+        for item_id, data_entry in zip(self.item_ids, it):
+            if str(data_entry.get("item_id")) != item_id:
+                raise ValueError(f"Checkpoint has item_id {item_id} but dataset has {data_entry.get('item_id')}")
+        yield from it
+
+    def __len__(self) -> int:
+        return len(self.dataset) - len(self.item_ids)  # type: ignore
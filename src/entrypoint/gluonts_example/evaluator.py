@@ -1,32 +1,60 @@
-import json
+import multiprocessing
 import os
-from typing import Any, Callable, Dict, Optional, Tuple, Union
+import pickle
+import sys
+from itertools import chain, islice
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Tuple, Union
 
 import matplotlib.pyplot as plt
 import numpy as np
 import pandas as pd
 from gluonts.evaluation import Evaluator
-from gluonts.model.forecast import Config, Forecast
-from smallmatter.ds import MontagePager
-
+from gluonts.gluonts_tqdm import tqdm
+from gluonts.model.forecast import Config, Forecast, OutputType, Quantile
+
+from . import plotting
+from .aggregator import ItemMetricsWriter, MetricsAggregator, base_agg_funs
+from .batch_metrics import MetricsBatch
+from .checkpoint import ITEM_IDS, PLOTS, EvalCheckpoint
+from .forecast import tabulate_forecasts
 from .metrics import wmape
+from .plotting import PlotRenderer
+from .results import ForecastResult, ResultsWriter
 from .util import mkdir
 
 output_configuration = Config(quantiles=["0.1", "0.2", "0.3", "0.4", "0.5", "0.6", "0.7", "0.8", "0.9"])
 
-plt.rcParams.update(
-    {
-        "legend.fontsize": 8,
-        "axes.labelsize": 8,
-        "axes.titlesize": 10,
-        "xtick.labelsize": 8,
-        "ytick.labelsize": 8,
-        "legend.borderpad": 0.8,
-    }
-)
-
 
 class MyEvaluator(Evaluator):
+    """Evaluator that also writes forecasts to results.jsonl (or another format), plots them, and computes wMAPE.
+
+    With num_workers > 0, metrics are computed by a pool of worker processes, while results.jsonl and plots are
+    written by this process in the order of the timeseries. Hence, the outputs are identical to num_workers=0.
+
+    With batch_size > 0, metrics are computed batch_size timeseries at a time over stacked arrays (see MetricsBatch),
+    rather than one timeseries at a time.
+
+    With item_writers, item metrics are written (and aggregated) as soon as they are computed, rather than collected
+    into a DataFrame, hence memory stays flat regardless of the number of timeseries. __call__() then returns None as
+    the item metrics.
+
+    With a checkpoint, the evaluation can resume after an interruption (see EvalCheckpoint). Outputs are written to
+    the checkpoint directory (i.e., out_dir must be the checkpoint directory), and item metrics are streamed as with
+    item_writers. On resume, pass only the timeseries not evaluated yet (see EvalCheckpoint.skip_evaluated()); the
+    returned aggregate metrics still cover all timeseries.
+
+    Each forecast is first replaced by a float32 QuantileForecast of just the quantile levels needed by metrics,
+    results.jsonl, and plots (see tabulate_forecasts()), so its samples are released early.
+
+    Which timeseries to plot is chosen by the plot policy (see PlotRenderer), and plots are rendered by a background
+    process, hence metrics never wait for matplotlib.
+    """
+
+    # Aggregation of our custom item metrics, in addition to those of gluonts.
+    custom_agg_funs = {
+        "wMAPE": "mean",
+    }
+
     # NOTE: do not write anything to stdout or stderr, otherwise mix-up with tqdm progress bar.
     def __init__(
         self,
@@ -35,15 +63,23 @@ class MyEvaluator(Evaluator):
         plot_transparent: bool = False,
         gt_inverse_transform: Optional[Callable] = None,
         clip_at_zero: bool = True,
+        num_workers: int = 0,
+        batch_size: int = 0,
+        plot: str = "all",
+        item_writers: Sequence[ItemMetricsWriter] = (),
+        results_format: str = "jsonl",
+        checkpoint: Optional[EvalCheckpoint] = None,
         **kwargs,
     ):
-        super().__init__(*args, num_workers=0, **kwargs)
+        super().__init__(*args, num_workers=num_workers, **kwargs)
+        if checkpoint is not None and os.path.realpath(out_dir) != os.path.realpath(checkpoint.path):
+            raise ValueError(f"out_dir={out_dir} must be the checkpoint directory {checkpoint.path}")
         self.out_dir = mkdir(out_dir)
-        self.out_fname = self.out_dir / "results.jsonl"
         self.plot_dir = mkdir(self.out_dir / "plots")
         mkdir(self.plot_dir / "montages")
         mkdir(self.plot_dir / "individuals")
 
+        self.batch_size = batch_size
         self.gt_inverse_transform = gt_inverse_transform
         self.clip_at_zero = clip_at_zero
 
@@ -51,28 +87,198 @@ class MyEvaluator(Evaluator):
         self.plot_ci = [50.0, 90.0]
         self.plot_transparent = plot_transparent
         self.figure, self.ax = plt.subplots(figsize=(6.4, 4.8), dpi=100, tight_layout=True)
-        self.mp = MontagePager(
-            self.out_dir / "plots", page_size=100, savefig_kwargs={"transparent": self.plot_transparent}
+        self.plotter = PlotRenderer(
+            self.out_dir / "plots", plot, self.plot_ci, savefig_kwargs={"transparent": self.plot_transparent}
         )
 
-        self.out_f = self.out_fname.open("w")
+        self.checkpoint = checkpoint
+        if checkpoint is not None:
+            checkpoint.truncate(f"results.{results_format}")
+        self.results = ResultsWriter(
+            self.out_dir, output_configuration.quantiles, fmt=results_format, append=checkpoint is not None
+        )
+        self.out_fname = self.results.path
+
+        self.item_writers = list(item_writers)
+        self.streaming = bool(self.item_writers) or checkpoint is not None
+        self.aggregator = MetricsAggregator({**base_agg_funs(self.quantiles), **self.custom_agg_funs})
+        if checkpoint is not None:
+            self.resume()
+        self.num_resumed = self.aggregator.num_series
+
+    def __call__(
+        self,
+        ts_iterator: Iterable[Union[pd.Series, pd.DataFrame]],
+        fcst_iterator: Iterable[Forecast],
+        num_series: Optional[int] = None,
+    ) -> Tuple[Dict[str, float], Optional[pd.DataFrame]]:
+        # Quantiles needed by metrics, results.jsonl, and plots are computed once per forecast.
+        batch_size = self.batch_size if self.batch_size > 0 else self.chunk_size
+        fcst_iterator = tabulate_forecasts(fcst_iterator, self.quantile_levels(), batch_size=batch_size)
+
+        parallel = self.num_workers > 0 and sys.platform != "win32"
+        if not parallel and self.batch_size <= 0 and not self.streaming:
+            return super().__call__(ts_iterator, fcst_iterator, num_series)
+
+        ts_iterator = iter(ts_iterator)
+        fcst_iterator = iter(fcst_iterator)
+        rows: List[Dict[str, Any]] = []
+
+        # Workers are forked, hence inherit this evaluator (but only use its side-effect free methods).
+        global _evaluator
+        _evaluator = self
+        pool = multiprocessing.get_context("fork").Pool(processes=self.num_workers) if parallel else None
+
+        # Timeseries and forecasts are sent to the workers one window at a time, to bound memory usage. While workers
+        # process a window, this process writes the results and plots of the previous window.
+        window_size = batch_size * (self.num_workers * 4 if parallel else 1)
+        with tqdm(zip(ts_iterator, fcst_iterator), total=num_series, desc="Running evaluation") as it:
+            pairs = iter(it)
+            pending = None
+            for window in iter(lambda: list(islice(pairs, window_size)), []):
+                batches = [window[i : i + batch_size] for i in range(0, len(window), batch_size)]
+                if pool is None:
+                    rows.extend(self.write_results(window, _evaluate_batch(batches[0])))
+                    continue
+                async_result = pool.map_async(_evaluate_batch, batches, chunksize=1)
+                if pending is not None:
+                    rows.extend(self.write_results(pending[0], chain.from_iterable(pending[1].get())))
+                pending = window, async_result
+            if pending is not None:
+                rows.extend(self.write_results(pending[0], chain.from_iterable(pending[1].get())))
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+        assert not any(True for _ in ts_iterator), "ts_iterator has more elements than fcst_iterator"
+        assert not any(True for _ in fcst_iterator), "fcst_iterator has more elements than ts_iterator"
+        num_rows = self.aggregator.num_series - self.num_resumed if self.streaming else len(rows)
+        if num_series is not None:
+            assert num_rows == num_series, f"num_series={num_series} did not match number of elements={num_rows}"
+
+        if self.checkpoint is not None:
+            self.save_checkpoint()
+        if self.streaming:
+            totals, _ = self.get_aggregate_metrics(self.aggregator.summary())
+            return totals, None
+
+        # See Evaluator.__call__() on why dtype=np.float64.
+        metrics_per_ts = pd.DataFrame(rows, dtype=np.float64)
+        return self.get_aggregate_metrics(metrics_per_ts)
+
+    def quantile_levels(self) -> List[str]:
+        """Quantile levels of all consumers of a forecast: metrics, wMAPE, results.jsonl, and plots."""
+        levels = (
+            [q.value for q in self.quantiles]
+            + [0.5]
+            + [Quantile.parse(q).value for q in output_configuration.quantiles]
+            + [p / 100.0 for p in plotting.plot_percentiles(self.plot_ci)]
+        )
+        return list(dict.fromkeys(str(level) for level in levels))
+
+    def write_results(
+        self, window: List[Tuple[Any, Forecast]], results: Iterable[Tuple[Dict[str, Any], ForecastResult]]
+    ) -> List[Dict[str, Any]]:
+        """Write the results and plots of a window of timeseries, in order, given their metrics and forecast results.
+
+        Returns the item metrics of the window, unless they are streamed to the item writers.
+        """
+        rows = []
+        for (time_series, forecast), (metrics, result) in zip(window, results):
+            self.results.write(result)
+            self.plotter.add(self.ground_truth(time_series), forecast, metrics["wMAPE"])
+            rows.append(metrics)
+            if self.checkpoint is not None:
+                self.evaluated.write(f"{result.item_id}\n")
+
+        if self.streaming:
+            # Streamed out, hence not collected.
+            self.aggregator.update(rows)
+            for writer in self.item_writers:
+                writer.write(rows)
+            if self.checkpoint is not None and self.checkpoint.due():
+                self.save_checkpoint()
+            return []
+        return rows
+
+    def resume(self) -> None:
+        """Continue the outputs, aggregates, and plots as of the checkpoint (if any)."""
+        checkpoint: EvalCheckpoint = self.checkpoint  # type: ignore
+        for writer in self.item_writers:
+            checkpoint.truncate(self._checkpoint_name(writer.path))
+            writer.resume()
+
+        if checkpoint.truncate(PLOTS) > 0:
+            with (checkpoint.path / PLOTS).open("rb") as f:
+                submitted = list(_load_pickles(f))
+        else:
+            submitted = []
+        if checkpoint.state:
+            self.aggregator.load_state_dict(checkpoint.state["aggregator"])
+            self.plotter.resume(checkpoint.state["plotter"], submitted)
+        self.plotter.log = (checkpoint.path / PLOTS).open("ab")
+
+        checkpoint.truncate(ITEM_IDS)
+        self.evaluated = (checkpoint.path / ITEM_IDS).open("a")
+
+    def save_checkpoint(self) -> None:
+        """Flush the outputs, then save the aggregates and plot selection as of the last written timeseries."""
+        self.results.sync()
+        self.plotter.log.flush()  # type: ignore
+        self.evaluated.flush()
+        files = [self.results.path.name, ITEM_IDS, PLOTS] + [self._checkpoint_name(w.path) for w in self.item_writers]
+        state = {
+            "num_series": self.aggregator.num_series,
+            "aggregator": self.aggregator.state_dict(),
+            "plotter": self.plotter.state_dict(),
+        }
+        self.checkpoint.save(state, files)  # type: ignore
+
+    def _checkpoint_name(self, path: os.PathLike) -> str:
+        """Path of an output file relative to the checkpoint directory, which must contain it."""
+        try:
+            return str(os.path.relpath(os.path.realpath(path), os.path.realpath(self.checkpoint.path)))  # type: ignore
+        except ValueError:
+            raise ValueError(f"{path} is not in the checkpoint directory")
 
     def get_metrics_per_ts(
         self, time_series: Union[pd.Series, pd.DataFrame], forecast: Forecast
     ) -> Dict[str, Union[float, str, None]]:
-        # Inverse tranformation (if any), then clip to 0.
+        time_series = self.ground_truth(time_series)
+        metrics, result = self.evaluate_ts(time_series, forecast)
+
+        # Write forecast results to output file.
+        self.results.write(result)
+
+        # Add to montage (if selected)
+        self.plotter.add(time_series, forecast, metrics["wMAPE"])
+
+        return metrics
+
+    def ground_truth(self, time_series: Union[pd.Series, pd.DataFrame]) -> Union[pd.Series, pd.DataFrame]:
+        """Inverse tranformation (if any), then clip to 0."""
         if self.gt_inverse_transform is not None:
             time_series = self.gt_inverse_transform(time_series)
         if self.clip_at_zero:
             time_series = time_series.clip(lower=0.0)
+        return time_series
 
+    def evaluate_ts(
+        self, time_series: Union[pd.Series, pd.DataFrame], forecast: Forecast
+    ) -> Tuple[Dict[str, Union[float, str, None]], ForecastResult]:
+        """Compute the metrics of a (ground-truth) timeseries, and its forecast results, without any side effect."""
         # Compute the built-in metrics
         metrics = super().get_metrics_per_ts(time_series, forecast)
 
-        # Write forecast results to output file.
-        result: Dict[str, Any] = {"item_id": str(forecast.item_id), **forecast.as_json_dict(output_configuration)}
-        json.dump(result, self.out_f)
-        self.out_f.write("\n")
+        # Forecast results for the output file.
+        output_types = output_configuration.output_types
+        result = ForecastResult(
+            str(forecast.item_id),
+            forecast.mean if OutputType.mean in output_types else None,
+            np.stack([forecast.quantile(Quantile.parse(q).value) for q in output_configuration.quantiles])
+            if OutputType.quantiles in output_types
+            else None,
+        )
 
         # region: custom metrics.
         # Follow gluonts.evaluation.Evaluator who uses median
@@ -84,19 +290,44 @@ class MyEvaluator(Evaluator):
         metrics["wMAPE"] = wmape(pred_target, median_fcst, version=2)
         # endregion: custom metrics
 
-        # Add to montage
-        self.plot_prob_forecasts(self.mp.pop(forecast.item_id), time_series, forecast, self.plot_ci)
+        return metrics, result
+
+    def evaluate_batch(
+        self, pairs: Sequence[Tuple[Union[pd.Series, pd.DataFrame], Forecast]]
+    ) -> List[Tuple[Dict[str, Any], ForecastResult]]:
+        """Same as evaluate_ts() on each (ground-truth) timeseries, but vectorized when batch_size > 0."""
+        if self.batch_size <= 0 or len({forecast.prediction_length for _, forecast in pairs}) > 1:
+            return [self.evaluate_ts(time_series, forecast) for time_series, forecast in pairs]
+
+        batch = MetricsBatch(self, pairs, levels=output_configuration.quantiles)
+        metrics = batch.metrics()
+        metrics["wMAPE"] = wmape(batch.target, batch.quantile(0.5), version=2, axis=1)
+
+        # Forecast results for the output file, in the same format as evaluate_ts().
+        output_types = output_configuration.output_types
+        means = batch.table.mean if OutputType.mean in output_types else None
+        quantiles = (
+            np.stack([batch.quantile(q) for q in output_configuration.quantiles], axis=1)
+            if OutputType.quantiles in output_types
+            else None
+        )
+        results = [
+            ForecastResult(
+                str(forecast.item_id),
+                means[i] if means is not None else None,
+                quantiles[i] if quantiles is not None else None,
+            )
+            for i, forecast in enumerate(batch.forecasts)
+        ]
 
-        return metrics
+        return list(zip(batch.rows(metrics), results))
 
     def get_aggregate_metrics(self, metric_per_ts: pd.DataFrame) -> Tuple[Dict[str, float], pd.DataFrame]:
         totals, metrics_per_ts = super().get_aggregate_metrics(metric_per_ts)
 
         # region: for each metric, aggregate across timeseries.
         # Aggregation step
-        agg_funs = {
-            "wMAPE": "mean",
-        }
+        agg_funs = self.custom_agg_funs
         assert set(metric_per_ts.columns) >= agg_funs.keys(), "The some of the requested item metrics are missing."
         my_totals = {key: metric_per_ts[key].agg(agg) for key, agg in agg_funs.items()}
 
@@ -104,78 +335,41 @@ class MyEvaluator(Evaluator):
         totals.update(my_totals)
         # endregion
 
-        # Save montage
-        self.mp.savefig()
+        # Render the remaining selected plots, and save montage
+        self.plotter.close()
 
         # Make sure to flush buffered results to the disk.
-        self.out_f.close()
+        self.results.close()
+        for writer in self.item_writers:
+            writer.close()
+        if self.checkpoint is not None:
+            self.evaluated.close()
+            self.plotter.log.close()  # type: ignore
 
         return totals, metrics_per_ts
 
-    @staticmethod
-    def plot_prob_forecasts(ax, time_series, forecast, intervals, past_length=8):
-        plot_length = past_length + forecast.prediction_length
-        time_series[0][-plot_length:].plot(ax=ax, label="actual")
-        MyEvaluator.plot2(forecast, prediction_intervals=intervals, show_mean=False)
-        plt.grid(which="both")
-        plt.legend(loc="upper left")
-        plt.gca().set_title(str(forecast.item_id).replace("|", "\n"))
-
-    @staticmethod
-    def plot2(
-        forecast,
-        prediction_intervals=(50.0, 90.0),
-        show_mean=False,
-        color="g",  # This is for alpha (CI range)
-        label=None,
-        *args,
-        **kwargs,
-    ):
-        """Customize gluonts.model.forecast.Forecast.
-
-        Notable changes: change median and mean to other than green, increase transparencyi of interval filling.
+    # Kept for backward compatibility; see plotting.py.
+    plot_prob_forecasts = staticmethod(plotting.plot_prob_forecasts)
+    plot2 = staticmethod(plotting.plot2)
 
-        The rest are exactly the same as the original.
-        """
-        label_prefix = "" if label is None else label + "-"
 
-        for c in prediction_intervals:
-            assert 0.0 <= c <= 100.0
+################################################################################
+# Worker process
+################################################################################
+_evaluator: Optional[MyEvaluator] = None
 
-        ps = [50.0] + [50.0 + f * c / 2.0 for c in prediction_intervals for f in [-1.0, +1.0]]
-        percentiles_sorted = sorted(set(ps))
 
-        def alpha_for_percentile(p):
-            return (p / 100.0) ** 0.5  # marcverd: increase transparency
+def _evaluate_batch(
+    batch: List[Tuple[Union[pd.Series, pd.DataFrame], Forecast]]
+) -> List[Tuple[Dict[str, Any], ForecastResult]]:
+    with np.errstate(invalid="ignore"):
+        pairs = [(_evaluator.ground_truth(time_series), forecast) for time_series, forecast in batch]  # type: ignore
+        return _evaluator.evaluate_batch(pairs)  # type: ignore
 
-        ps_data = [forecast.quantile(p / 100.0) for p in percentiles_sorted]
-        i_p50 = len(percentiles_sorted) // 2
 
-        p50_data = ps_data[i_p50]
-        p50_series = pd.Series(data=p50_data, index=forecast.index)
-        p50_series.plot(color="xkcd:maroon", ls="-", label=f"{label_prefix}median")
-
-        if show_mean:
-            mean_data = np.mean(forecast._sorted_samples, axis=0)
-            pd.Series(data=mean_data, index=forecast.index).plot(
-                color="xkcd:crimson", ls=":", label=f"{label_prefix}mean", *args, **kwargs,
-            )
-
-        for i in range(len(percentiles_sorted) // 2):
-            ptile = percentiles_sorted[i]
-            alpha = alpha_for_percentile(ptile)
-            plt.fill_between(
-                forecast.index,
-                ps_data[i],
-                ps_data[-i - 1],
-                facecolor=color,
-                alpha=alpha,
-                interpolate=True,
-                *args,
-                **kwargs,
-            )
-            # Hack to create labels for the error intervals.
-            # Doesn't actually plot anything, because we only pass a single data point
-            pd.Series(data=p50_data[:1], index=forecast.index[:1]).plot(
-                color=color, alpha=alpha, linewidth=8, label=f"{label_prefix}{100 - ptile * 2}%", *args, **kwargs,
-            )
+def _load_pickles(f) -> Iterable[Any]:
+    while True:
+        try:
+            yield pickle.load(f)
+        except EOFError:
+            return
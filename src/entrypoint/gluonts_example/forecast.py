@@ -0,0 +1,126 @@
+from itertools import islice
+from typing import TYPE_CHECKING, Iterable, Iterator, List, NamedTuple, Optional, Sequence
+
+import numpy as np
+
+if TYPE_CHECKING:
+    # Imported where needed instead, so that importing the inference entrypoint does not load gluonts (and mxnet).
+    from gluonts.model.forecast import Forecast, QuantileForecast
+
+
+class QuantileTable(NamedTuple):
+    """Quantiles and mean of a batch of forecasts, stacked as dense arrays.
+
+    Attributes:
+        levels (List[str]): quantile names, in the same order as the second axis of `quantiles`.
+        quantiles (np.ndarray): shape (num_forecasts, num_levels, prediction_length).
+        mean (Optional[np.ndarray]): shape (num_forecasts, prediction_length), or None when not requested.
+    """
+
+    levels: List[str]
+    quantiles: np.ndarray
+    mean: Optional[np.ndarray]
+
+    def __len__(self) -> int:
+        return self.quantiles.shape[0]
+
+
+def quantile_table(forecasts: Sequence["Forecast"], levels: Sequence[str], mean: bool = True) -> QuantileTable:
+    """Compute the requested quantiles (and mean) of many forecasts in one go.
+
+    Sample forecasts of identical shape are stacked into a (num_forecasts, num_samples, prediction_length) array, so
+    that sorting, quantile lookup, and mean are a few NumPy calls over the whole batch rather than per forecast. The
+    results are bit-identical to `forecast.quantile(q)` and `forecast.mean`. Any other forecast (e.g., those without
+    samples) falls back to the per-forecast methods.
+
+    Args:
+        forecasts (Sequence[Forecast]): forecasts to tabulate.
+        levels (Sequence[str]): quantile levels, e.g., ["0.1", "0.5", "0.9"].
+        mean (bool, optional): whether to compute the mean. Defaults to True.
+
+    Returns:
+        QuantileTable: the stacked quantiles and mean.
+    """
+    from gluonts.model.forecast import Quantile
+
+    quantiles = [Quantile.parse(level) for level in levels]
+    names = [q.name for q in quantiles]
+
+    if not _stackable(forecasts):
+        qs = np.stack(
+            [np.array([f.quantile(q.value) for q in quantiles]).reshape(-1, f.prediction_length) for f in forecasts]
+        )
+        means = np.stack([f.mean for f in forecasts]) if mean else None
+        return QuantileTable(names, qs, means)
+
+    # Follow gluonts.model.forecast.SampleForecast.quantile(), which picks a sample rather than interpolates.
+    samples = np.stack([f.samples for f in forecasts])
+    num_samples = samples.shape[1]
+    idx = [int(np.round((num_samples - 1) * q.value)) for q in quantiles]
+    qs = np.sort(samples, axis=1)[:, idx, :] if idx else samples[:, :0, :]
+    means = np.mean(samples, axis=1) if mean else None
+    return QuantileTable(names, qs, means)
+
+
+def iter_quantile_tables(
+    forecasts: Iterable["Forecast"], levels: Sequence[str], mean: bool = True, batch_size: int = 256
+) -> Iterator[QuantileTable]:
+    """Tabulate forecasts in batches, to bound the size of the stacked sample arrays."""
+    it = iter(forecasts)
+    while True:
+        batch = list(islice(it, batch_size))
+        if not batch:
+            return
+        yield quantile_table(batch, levels, mean=mean)
+
+
+def tabulate_forecasts(
+    forecasts: Iterable["Forecast"], levels: Sequence[str], batch_size: int = 256
+) -> Iterator["QuantileForecast"]:
+    """Replace each forecast by a QuantileForecast of just the requested quantile levels and mean.
+
+    Quantiles are computed once per forecast (see quantile_table()), and stored as float32, hence every consumer of
+    the QuantileForecast (e.g., metrics, serialization, plots) looks them up instead of re-deriving them from samples.
+    A batch of forecasts (and their samples) is released as soon as it has been tabulated.
+
+    Args:
+        forecasts (Iterable[Forecast]): forecasts to tabulate.
+        levels (Sequence[str]): quantile levels, e.g., ["0.1", "0.5", "0.9"]. Other levels of the resulted
+            QuantileForecast are NaN.
+        batch_size (int, optional): number of forecasts per quantile_table(). Defaults to 256.
+
+    Yields:
+        QuantileForecast: one per forecast, in the same order.
+    """
+    from gluonts.model.forecast import Quantile, QuantileForecast
+
+    # Keys as Quantile.parse(float).name, i.e., the name looked up by quantile(float).
+    keys = [str(Quantile.parse(level).value) for level in levels] + ["mean"]
+    it = iter(forecasts)
+    while True:
+        batch = list(islice(it, batch_size))
+        if not batch:
+            return
+
+        if len({f.prediction_length for f in batch}) == 1:
+            arrays = list(_forecast_arrays(quantile_table(batch, levels)))
+        else:
+            arrays = [_forecast_arrays(quantile_table([f], levels))[0] for f in batch]
+        metadata = [(f.start_date, f.freq, f.item_id, f.info) for f in batch]
+        del batch
+
+        for forecast_arrays, (start_date, freq, item_id, info) in zip(arrays, metadata):
+            yield QuantileForecast(forecast_arrays, start_date, freq, keys, item_id=item_id, info=info)
+
+
+def _forecast_arrays(table: QuantileTable) -> np.ndarray:
+    """Stack quantiles then mean, i.e., (num_forecasts, num_levels + 1, prediction_length) float32."""
+    return np.concatenate([table.quantiles, table.mean[:, None, :]], axis=1).astype(np.float32)  # type: ignore
+
+
+def _stackable(forecasts: Sequence["Forecast"]) -> bool:
+    shapes = {getattr(getattr(f, "samples", None), "shape", None) for f in forecasts}
+    if len(shapes) != 1:
+        return False
+    shape = shapes.pop()
+    return shape is not None and len(shape) == 2
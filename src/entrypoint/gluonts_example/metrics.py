@@ -1,7 +1,7 @@
 import numpy as np
 
 
-def mape(y_true, y_pred, version=0) -> float:
+def mape(y_true, y_pred, version=0, axis=None) -> float:
     r"""
     .. math::
         mape = mean(|Y - Y_hat| / |Y|))
@@ -11,29 +11,31 @@ def mape(y_true, y_pred, version=0) -> float:
         y_pred (np.array): Forecasts
         version (int, optional): Version 0 is as-is implementation of formula. Version 1 & 2 deal with div-by-0, but
             version=1 ignores those with y=0 from calculation. Defaults to 0.
+        axis (int, optional): axis along which to average, e.g., 1 for one mape per row of (series x horizon)
+            arrays. Defaults to None, i.e., average over all values.
 
     Returns:
         array of floats: mape values
     """
 
     if version == 0:
-        return np.mean(np.abs((y_true - y_pred) / y_true))
+        return np.mean(np.abs((y_true - y_pred) / y_true), axis=axis)
     elif version == 1:
         # This version takes care of div-by-0, and ignore 0-y in nominator.
         # See: https://github.com/awslabs/gluon-ts/pull/725
         denominator = np.abs(y_true)
         flag = denominator == 0
-        return np.mean((np.abs(y_true - y_pred) * (1 - flag)) / (denominator + flag))
+        return np.mean((np.abs(y_true - y_pred) * (1 - flag)) / (denominator + flag), axis=axis)
     elif version == 2:
         # This version takes care of div-by-0, and include 0-y in nominator.
         denominator = np.abs(y_true)
         flag = denominator == 0
-        return np.mean(np.abs(y_true - y_pred) / (denominator + flag))
+        return np.mean(np.abs(y_true - y_pred) / (denominator + flag), axis=axis)
 
     raise ValueError(f"Unknown mape version: {version}")
 
 
-def wmape(actual, forecast, version=0) -> float:
+def wmape(actual, forecast, version=0, axis=None) -> float:
     r"""
     .. math::
         wmape = mape * (actual / sum(actual))
@@ -46,6 +48,8 @@ def wmape(actual, forecast, version=0) -> float:
         forecast (np.array): Forecasts
         version (int, optional): mape version to use. See mape(). Defaults to 0 (which
             may perform division-by-zero).
+        axis (int, optional): axis of the timestamps, e.g., 1 for one wmape per row of (series x horizon) arrays.
+            Defaults to None, i.e., one wmape over all values.
 
     Returns:
         array of floats: wmape values
@@ -54,18 +58,20 @@ def wmape(actual, forecast, version=0) -> float:
     # - NOTE: as-is implementation from Logbooks/Med_Low/Weekly_AutoArima.ipynb
 
     # make a series called mape
-    se_mape = mape(actual, forecast, version=version)
+    se_mape = mape(actual, forecast, version=version, axis=axis)
+    if axis is not None:
+        se_mape = np.expand_dims(se_mape, axis)
 
     # get a float of the sum of the actual
     # - NOTE: this as-is implementation assumes actual are positives. Would it
     # be better to enforce this assumption by using np.sum(np.abs(actual))?
-    ft_actual_sum = actual.sum()
+    ft_actual_sum = actual.sum(axis=axis)
 
     # get a series of the multiple of the actual & the mape
     se_actual_prod_mape = actual * se_mape
 
     # summate the prod of the actual and the mape
-    ft_actual_prod_mape_sum = se_actual_prod_mape.sum()
+    ft_actual_prod_mape_sum = se_actual_prod_mape.sum(axis=axis)
 
     # float: wmape of forecast
     ft_wmape_forecast = ft_actual_prod_mape_sum / ft_actual_sum
@@ -0,0 +1,216 @@
+"""Binary, memory-mapped cache of JSON-lines gluonts datasets.
+
+A dataset split (e.g., s3_dataset/train) is parsed once, then saved under cache_dir/<split>-<checksum>/ as:
+
+- target.bin: the float32 targets of all timeseries, concatenated.
+- target_offsets.npy: the i-th target is target[target_offsets[i]:target_offsets[i + 1]].
+- start.npy, item_id.npy: one string per timeseries.
+- feat_static_cat.npy, feat_static_real.npy: one row per timeseries.
+
+The checksum covers the content of every file of the split, hence a changed split is cached under a new directory.
+Loading a cached split memory-maps those arrays, so it takes no parsing; each target is copied out of the page cache
+only when its timeseries is iterated.
+
+Only univariate timeseries with the fields above are supported. Other datasets are not cached; see cached_dataset().
+
+materialize_datasets() writes loaded (e.g., transformed) splits to the same layout, e.g., on /dev/shm, so that forked
+processes share one copy of the targets.
+"""
+import hashlib
+import json
+import logging
+import os
+import shutil
+import tempfile
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, BinaryIO, Dict, Iterable, Iterator, List, Optional, Union
+
+import numpy as np
+from gluonts.dataset.common import DataEntry, ProcessDataEntry, TrainDatasets, load_datasets
+
+logger = logging.getLogger(__name__)
+
+# Fields that are cached. The "source" field added by gluonts' FileDataset is not.
+FIELDS = ("start", "target", "item_id", "feat_static_cat", "feat_static_real")
+STATIC_FIELDS = {"feat_static_cat": np.int32, "feat_static_real": np.float32}
+
+
+class MmapDataset:
+    """A gluonts dataset backed by the memory-mapped arrays of a cache directory.
+
+    Entries are processed like gluonts' FileDataset does (e.g., start becomes a pd.Timestamp). Each target is a
+    writable float32 copy of its slice of the memory-mapped target.bin, as gluonts transformations may modify it in
+    place (e.g., AddObservedValuesIndicator replaces NaN), and the next pass (e.g., epoch) must see the original.
+    """
+
+    def __init__(self, path: Union[str, os.PathLike], freq: str):
+        self.path = Path(path)
+        self.freq = freq
+        self.process = ProcessDataEntry(freq, one_dim_target=True)
+
+        num_values = json.loads((self.path / "meta.json").read_text())["num_values"]
+        self.target = (
+            np.memmap(self.path / "target.bin", dtype=np.float32, mode="r", shape=(num_values,))
+            if num_values > 0
+            else np.empty(0, dtype=np.float32)
+        )
+        self.offsets = np.load(self.path / "target_offsets.npy")
+        self.fields = {f.stem: np.load(f, mmap_mode="r") for f in sorted(self.path.glob("*.npy")) if f.stem in FIELDS}
+
+    def __iter__(self) -> Iterator[DataEntry]:
+        for i in range(len(self)):
+            data_entry = {"target": np.array(self.target[self.offsets[i] : self.offsets[i + 1]])}
+            for field, values in self.fields.items():
+                data_entry[field] = str(values[i]) if values.ndim == 1 else np.array(values[i])
+            yield self.process(data_entry)
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+
+def load_cached_datasets(
+    metadata: Path, train: Path, test: Optional[Path], cache_dir: Union[str, os.PathLike]
+) -> TrainDatasets:
+    """Like gluonts.dataset.common.load_datasets(), but with the train and test splits served from the cache."""
+    dataset = load_datasets(metadata=metadata, train=train, test=test)
+    freq = dataset.metadata.freq
+    return TrainDatasets(
+        metadata=dataset.metadata,
+        train=cached_dataset(dataset.train, train, freq, cache_dir),
+        test=cached_dataset(dataset.test, test, freq, cache_dir) if test is not None else None,
+    )
+
+
+def cached_dataset(
+    dataset: Iterable[DataEntry], path: Union[str, os.PathLike], freq: str, cache_dir: Union[str, os.PathLike]
+) -> Iterable[DataEntry]:
+    """Return the cached copy of a dataset split, and create it first if needed.
+
+    Args:
+        dataset (Iterable[DataEntry]): the dataset split, e.g., a FileDataset, to parse when not cached yet.
+        path (Union[str, os.PathLike]): the directory (or file) of the dataset split, to checksum.
+        freq (str): frequency of the timeseries.
+        cache_dir (Union[str, os.PathLike]): root directory of the cache.
+
+    Returns:
+        Iterable[DataEntry]: an MmapDataset, or the dataset as-is when it cannot be cached.
+    """
+    path = Path(path)
+    split_dir = Path(cache_dir) / f"{path.name}-{checksum(path)}"
+    if not (split_dir / "meta.json").exists():
+        logger.info("cached_dataset: caching %s to %s", path, split_dir)
+        try:
+            _write(dataset, split_dir)
+        except ValueError as e:
+            logger.warning("cached_dataset: not caching %s: %s", path, e)
+            return dataset
+    else:
+        logger.info("cached_dataset: reuse %s for %s", split_dir, path)
+    return MmapDataset(split_dir, freq)
+
+
+def materialize_datasets(dataset: TrainDatasets, cache_dir: Union[str, os.PathLike]) -> TrainDatasets:
+    """Write the train and test splits (e.g., transformed) to cache_dir once, then serve them memory-mapped.
+
+    With cache_dir on a tmpfs (e.g., /dev/shm), forked processes share a single in-memory copy of the targets. Splits
+    that cannot be cached are loaded into a list instead, which forked processes share copy-on-write.
+    """
+    freq = dataset.metadata.freq
+    splits = {}
+    for name, split in (("train", dataset.train), ("test", dataset.test)):
+        if split is None:
+            splits[name] = None
+            continue
+        split_dir = Path(cache_dir) / name
+        try:
+            _write(split, split_dir)
+            splits[name] = MmapDataset(split_dir, freq)
+        except ValueError as e:
+            logger.warning("materialize_datasets: loading %s into memory instead: %s", name, e)
+            splits[name] = list(split)
+    return TrainDatasets(metadata=dataset.metadata, train=splits["train"], test=splits["test"])
+
+
+@contextmanager
+def shared_datasets(dataset: TrainDatasets) -> Iterator[TrainDatasets]:
+    """Materialize the train and test splits to /dev/shm (when available) for the duration of the context."""
+    shm_dir = tempfile.mkdtemp(prefix="gluonts-", dir="/dev/shm" if os.path.isdir("/dev/shm") else None)
+    try:
+        yield materialize_datasets(dataset, shm_dir)
+    finally:
+        shutil.rmtree(shm_dir, ignore_errors=True)
+
+
+def checksum(path: Union[str, os.PathLike]) -> str:
+    """Digest the relative name and content of every (non-hidden) file under path."""
+    path = Path(path)
+    files = [path] if path.is_file() else sorted(p for p in path.rglob("*") if p.is_file())
+    h = hashlib.sha1()
+    for fname in files:
+        if fname.name.startswith("."):
+            continue
+        h.update(f"{fname.relative_to(path.parent)}\n".encode())
+        with fname.open("rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                h.update(block)
+    return h.hexdigest()[:16]
+
+
+def _write(dataset: Iterable[DataEntry], split_dir: Path) -> None:
+    """Convert a dataset split into the cache layout, in a temporary directory which is then renamed to split_dir.
+
+    Targets are streamed to target.bin, so only the (small) per-timeseries fields are accumulated in memory.
+    """
+    split_dir.parent.mkdir(parents=True, exist_ok=True)
+    tmp_dir = Path(tempfile.mkdtemp(dir=split_dir.parent, prefix=f".{split_dir.name}-"))
+    try:
+        fields: Dict[str, List[Any]] = {}
+        with (tmp_dir / "target.bin").open("wb") as f:
+            offsets = _write_targets(dataset, f, fields)
+
+        num_series = len(offsets) - 1
+        np.save(tmp_dir / "target_offsets.npy", np.asarray(offsets, dtype=np.int64))
+        for field, values in fields.items():
+            if len(values) != num_series:
+                raise ValueError(f"{field} is not present in every timeseries")
+            np.save(tmp_dir / f"{field}.npy", _to_array(field, values))
+        (tmp_dir / "meta.json").write_text(json.dumps({"num_series": num_series, "num_values": offsets[-1]}))
+
+        try:
+            os.rename(tmp_dir, split_dir)
+        except OSError:
+            # Another process has just cached the same split.
+            if not (split_dir / "meta.json").exists():
+                raise
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+def _write_targets(dataset: Iterable[DataEntry], f: BinaryIO, fields: Dict[str, List[Any]]) -> List[int]:
+    """Append the target of each timeseries to f and the other fields to fields, then return the target offsets."""
+    offsets = [0]
+    for data_entry in dataset:
+        unknown = data_entry.keys() - set(FIELDS) - {"source"}
+        if unknown:
+            raise ValueError(f"unsupported fields {sorted(unknown)}")
+        target = np.asarray(data_entry["target"], dtype=np.float32)
+        if target.ndim != 1:
+            raise ValueError("multivariate target")
+        f.write(target.tobytes())
+        offsets.append(offsets[-1] + len(target))
+
+        fields.setdefault("start", []).append(str(data_entry["start"]))
+        for field in FIELDS[2:]:
+            if field in data_entry:
+                fields.setdefault(field, []).append(data_entry[field])
+    return offsets
+
+
+def _to_array(field: str, values: List[Any]) -> np.ndarray:
+    if field in STATIC_FIELDS:
+        rows = [np.asarray(v, dtype=STATIC_FIELDS[field]) for v in values]
+        if len({row.shape for row in rows}) > 1:
+            raise ValueError(f"{field} has rows of different lengths")
+        return np.stack(rows) if rows else np.empty((0, 0), dtype=STATIC_FIELDS[field])
+    return np.asarray([str(v) for v in values])
@@ -0,0 +1,194 @@
+"""Multi-process inference: split the timeseries of one request across a pool of single-model worker processes.
+
+This module must not import mxnet (nor gluonts) at the top level: worker processes import it first, and must pin
+their OMP/MKL thread count before mxnet is loaded.
+"""
+import logging
+import multiprocessing
+import os
+from collections import deque
+from contextlib import contextmanager
+from typing import Any, Deque, Dict, Iterable, Iterator, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Environment variables that cap the number of threads of the math libraries used by mxnet.
+THREAD_ENV_VARS = ("OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS")
+
+# Number of timeseries per task sent to a worker. Small enough to spread a request over many workers, yet large
+# enough to fill the predictor's batches.
+WORKER_CHUNK_SIZE = 128
+
+# Max. number of chunks per worker that are submitted to the pool but not yet yielded: enough to keep every worker
+# busy while the results of the previous chunks are consumed.
+MAX_PENDING_PER_WORKER = 2
+
+
+def available_cpus() -> int:
+    """Number of logical cpus this process may run on."""
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def physical_cores() -> int:
+    """Number of physical cores this process may run on, i.e., excluding hyperthreading siblings.
+
+    On Linux, this is derived from the number of logical cpus per physical core in /proc/cpuinfo. Otherwise, fallbacks
+    to the number of logical cpus.
+    """
+    cpus = available_cpus()
+    try:
+        with open("/proc/cpuinfo") as f:
+            logical, cores, physical_id = 0, set(), ""
+            for line in f:
+                key, _, value = line.partition(":")
+                key = key.strip()
+                if key == "processor":
+                    logical += 1
+                elif key == "physical id":
+                    physical_id = value.strip()
+                elif key == "core id":
+                    cores.add((physical_id, value.strip()))
+    except OSError:
+        return cpus
+
+    if logical == 0 or not cores:
+        return cpus
+    siblings = max(1, logical // len(cores))
+    return max(1, cpus // siblings)
+
+
+def plan_workers(num_workers: int = 0, threads_per_worker: int = 0, cores: int = 0) -> Tuple[int, int]:
+    """Decide the number of worker processes and the number of threads each.
+
+    A single mxnet forward pass on an inference-sized batch scales poorly beyond a couple of OMP threads, so filling
+    the cores with many narrow workers gives higher throughput than one wide process. Hyperthreading siblings are not
+    counted, as OMP math kernels gain little from them.
+
+    Args:
+        num_workers (int, optional): Number of workers; 0 means one worker per threads_per_worker cores. Defaults to 0.
+        threads_per_worker (int, optional): Threads per worker; 0 means 2 on 8+ cores, else 1. Defaults to 0.
+        cores (int, optional): Number of cores to plan for; 0 means detect the physical cores. Defaults to 0.
+
+    Returns:
+        Tuple[int, int]: (num_workers, threads_per_worker)
+    """
+    cores = cores if cores > 0 else physical_cores()
+    if threads_per_worker <= 0:
+        threads_per_worker = 2 if cores >= 8 else 1
+    if num_workers <= 0:
+        num_workers = max(1, cores // threads_per_worker)
+    return num_workers, threads_per_worker
+
+
+class InferencePool:
+    """A pool of worker processes, each with its own copy of the predictor loaded from model_dir.
+
+    Workers are spawned rather than forked, because the parent process has already initialized mxnet's engine and
+    OMP runtime, and those do not survive a fork with a different thread count.
+    """
+
+    def __init__(self, model_dir: str, num_workers: int = 0, threads_per_worker: int = 0, warmup: bool = True):
+        self.model_dir = model_dir
+        self.num_workers, self.threads_per_worker = plan_workers(num_workers, threads_per_worker)
+        logger.info(
+            "InferencePool: %d workers x %d threads for %s", self.num_workers, self.threads_per_worker, model_dir
+        )
+
+        ctx = multiprocessing.get_context("spawn")
+        with _thread_env(self.threads_per_worker):
+            self.pool = ctx.Pool(
+                self.num_workers,
+                initializer=_init_worker,
+                initargs=(model_dir, self.threads_per_worker, warmup),
+            )
+
+    def imap(
+        self,
+        chunks: Iterable[List[Dict[str, Any]]],
+        num_samples: int,
+        config: Any,
+        tabulate: bool = False,
+        seed: Optional[int] = None,
+        metrics: Optional[Any] = None,
+        pre_transformed: bool = False,
+    ) -> Iterator[Any]:
+        """Forecast and serialize chunks of timeseries in parallel, and yield the results in input order.
+
+        See gluonts_example.serving.predict_chunk() for the result of each chunk. When metrics (a RequestMetrics) is
+        given, the stage timings of the workers are added to it, hence their predict and serialize seconds are summed
+        across workers.
+
+        Chunks are pulled lazily by the calling thread, and at most MAX_PENDING_PER_WORKER * num_workers of them are
+        submitted but not yet yielded, hence memory stays bounded by a few chunks per worker.
+        """
+        kwargs = dict(seed=seed, pre_transformed=pre_transformed)
+        max_pending = MAX_PENDING_PER_WORKER * self.num_workers
+        pending: Deque[Any] = deque()
+        for chunk in chunks:
+            task = (chunk, num_samples, config, tabulate, kwargs, metrics is not None)
+            pending.append(self.pool.apply_async(_predict_chunk, (task,)))
+            if len(pending) >= max_pending:
+                yield _get_result(pending.popleft(), metrics)
+        while pending:
+            yield _get_result(pending.popleft(), metrics)
+
+    def close(self) -> None:
+        self.pool.terminate()
+        self.pool.join()
+
+
+def _get_result(async_result: Any, metrics: Optional[Any]) -> Any:
+    """Wait for the result of a chunk, and add the stage timings of its worker to metrics."""
+    result, worker_metrics = async_result.get()
+    if worker_metrics is not None:
+        metrics.merge(worker_metrics)  # type: ignore
+    return result
+
+
+@contextmanager
+def _thread_env(threads: int):
+    """Temporarily set the thread-count environment variables, so that spawned processes inherit them."""
+    old = {var: os.environ.get(var) for var in THREAD_ENV_VARS}
+    os.environ.update({var: str(threads) for var in THREAD_ENV_VARS})
+    try:
+        yield
+    finally:
+        for var, value in old.items():
+            if value is None:
+                del os.environ[var]
+            else:
+                os.environ[var] = value
+
+
+################################################################################
+# Worker process
+################################################################################
+_predictor: Optional[Any] = None
+
+
+def _init_worker(model_dir: str, threads: int, warmup: bool) -> None:
+    # Must be done before the first import of mxnet in this process.
+    os.environ.update({var: str(threads) for var in THREAD_ENV_VARS})
+
+    from .serving import load_predictor, predict, synthetic_request
+
+    global _predictor
+    _predictor = load_predictor(model_dir)
+    if warmup:
+        try:
+            list(predict(synthetic_request(_predictor, getattr(_predictor, "batch_size", 1)), _predictor))
+        except Exception:
+            logger.warning("InferencePool: warm-up request failed in worker %d", os.getpid(), exc_info=True)
+
+
+def _predict_chunk(task: Tuple[List[Dict[str, Any]], int, Any, bool, Dict[str, Any], bool]) -> Tuple[Any, Any]:
+    from .serving import predict_chunk
+    from .telemetry import RequestMetrics
+
+    chunk, num_samples, config, tabulate, kwargs, timed = task
+    metrics = RequestMetrics() if timed else None
+    result = predict_chunk(chunk, _predictor, num_samples, config, tabulate, metrics=metrics, **kwargs)
+    return result, (metrics.to_dict() if metrics is not None else None)
@@ -0,0 +1,282 @@
+"""Backtest plots: which timeseries to plot, and rendering them in a background process.
+
+Rendering is decoupled from metric computation: the evaluator hands each timeseries to a PlotRenderer, which
+precomputes just the quantiles to draw (see PlotForecast), and queues them to a renderer process that owns the
+montage pages. The queue is bounded (see QUEUE_SIZE), hence metric computation waits on matplotlib only when the
+renderer lags that far behind, and memory stays flat even when plotting every timeseries.
+
+When the renderer process fails (e.g., a matplotlib error), an error is logged and the remaining plots are dropped,
+rather than failing the evaluation.
+"""
+import heapq
+import logging
+import multiprocessing
+import pickle
+import queue
+import random
+from pathlib import Path
+from typing import Any, BinaryIO, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import matplotlib.pyplot as plt
+import numpy as np
+import pandas as pd
+from gluonts.model.forecast import Forecast
+from smallmatter.ds import MontagePager
+
+plt.rcParams.update(
+    {
+        "legend.fontsize": 8,
+        "axes.labelsize": 8,
+        "axes.titlesize": 10,
+        "xtick.labelsize": 8,
+        "ytick.labelsize": 8,
+        "legend.borderpad": 0.8,
+    }
+)
+
+# Policies of which timeseries to plot. "random" and "worst" (by wMAPE) must be followed by ":N", e.g., "worst:100".
+PLOT_POLICIES = ("all", "none", "random", "worst")
+
+# Number of actual observations plotted before the forecast horizon.
+PAST_LENGTH = 8
+
+# Max. number of timeseries queued to the renderer process, and seconds between checks that it is still alive while
+# the queue is full.
+QUEUE_SIZE = 256
+QUEUE_TIMEOUT = 1.0
+
+logger = logging.getLogger(__name__)
+
+
+def plot_prob_forecasts(ax, time_series, forecast, intervals, past_length=PAST_LENGTH):
+    plot_length = past_length + forecast.prediction_length
+    time_series[0][-plot_length:].plot(ax=ax, label="actual")
+    plot2(forecast, prediction_intervals=intervals, show_mean=False)
+    plt.grid(which="both")
+    plt.legend(loc="upper left")
+    plt.gca().set_title(str(forecast.item_id).replace("|", "\n"))
+
+
+def plot_percentiles(prediction_intervals=(50.0, 90.0)) -> List[float]:
+    """Sorted percentiles that plot2() draws for the prediction intervals, i.e., the median and interval bounds."""
+    for c in prediction_intervals:
+        assert 0.0 <= c <= 100.0
+
+    ps = [50.0] + [50.0 + f * c / 2.0 for c in prediction_intervals for f in [-1.0, +1.0]]
+    return sorted(set(ps))
+
+
+def plot2(
+    forecast,
+    prediction_intervals=(50.0, 90.0),
+    show_mean=False,
+    color="g",  # This is for alpha (CI range)
+    label=None,
+    *args,
+    **kwargs,
+):
+    """Customize gluonts.model.forecast.Forecast.
+
+    Notable changes: change median and mean to other than green, increase transparencyi of interval filling.
+
+    The rest are exactly the same as the original.
+    """
+    label_prefix = "" if label is None else label + "-"
+
+    percentiles_sorted = plot_percentiles(prediction_intervals)
+
+    def alpha_for_percentile(p):
+        return (p / 100.0) ** 0.5  # marcverd: increase transparency
+
+    ps_data = [forecast.quantile(p / 100.0) for p in percentiles_sorted]
+    i_p50 = len(percentiles_sorted) // 2
+
+    p50_data = ps_data[i_p50]
+    p50_series = pd.Series(data=p50_data, index=forecast.index)
+    p50_series.plot(color="xkcd:maroon", ls="-", label=f"{label_prefix}median")
+
+    if show_mean:
+        mean_data = np.mean(forecast._sorted_samples, axis=0)
+        pd.Series(data=mean_data, index=forecast.index).plot(
+            color="xkcd:crimson", ls=":", label=f"{label_prefix}mean", *args, **kwargs,
+        )
+
+    for i in range(len(percentiles_sorted) // 2):
+        ptile = percentiles_sorted[i]
+        alpha = alpha_for_percentile(ptile)
+        plt.fill_between(
+            forecast.index,
+            ps_data[i],
+            ps_data[-i - 1],
+            facecolor=color,
+            alpha=alpha,
+            interpolate=True,
+            *args,
+            **kwargs,
+        )
+        # Hack to create labels for the error intervals.
+        # Doesn't actually plot anything, because we only pass a single data point
+        pd.Series(data=p50_data[:1], index=forecast.index[:1]).plot(
+            color=color, alpha=alpha, linewidth=8, label=f"{label_prefix}{100 - ptile * 2}%", *args, **kwargs,
+        )
+
+
+class PlotForecast:
+    """Just enough of a forecast for plot_prob_forecasts(): the item_id, index, and precomputed quantiles.
+
+    It is much smaller than the forecast (e.g., 5 quantiles instead of 1000 sample paths), hence cheap to queue to the
+    renderer process.
+    """
+
+    def __init__(self, forecast: Forecast, intervals: Sequence[float]):
+        self.item_id = forecast.item_id
+        self.index = forecast.index
+        self.prediction_length = forecast.prediction_length
+        self.quantiles = {p / 100.0: forecast.quantile(p / 100.0) for p in plot_percentiles(intervals)}
+
+    def quantile(self, q: float) -> np.ndarray:
+        return self.quantiles[q]
+
+
+class PlotRenderer:
+    """Select timeseries to plot as per a policy, and render them to montage pages in a background process.
+
+    Policies:
+    - "all": plot every timeseries, in order.
+    - "none": plot nothing.
+    - "random:N": plot N timeseries sampled uniformly (reservoir sampling), in order.
+    - "worst:N": plot the N timeseries with the highest wMAPE, from the worst.
+
+    Call add() for each timeseries in order, then close() to render the remaining selection and wait for the
+    renderer process to save the last page.
+    """
+
+    def __init__(
+        self,
+        plot_dir: Path,
+        policy: str = "all",
+        intervals: Sequence[float] = (50.0, 90.0),
+        savefig_kwargs: Optional[Dict[str, Any]] = None,
+        seed: int = 0,
+    ):
+        self.plot_dir = plot_dir
+        self.kind, self.n = parse_plot_policy(policy)
+        self.intervals = intervals
+        self.savefig_kwargs = savefig_kwargs or {}
+        self.rng = random.Random(seed)
+        self.num_added = 0
+        self.selected: List[Tuple[Any, ...]] = []
+        self.queue: Optional[Any] = None
+        self.process: Optional[Any] = None
+        # When set, every submitted item is also pickled to this binary file, e.g., to replay them on resume.
+        self.log: Optional[BinaryIO] = None
+        self.failed = False
+
+    def state_dict(self) -> Dict[str, Any]:
+        """Selection state, to resume() an interrupted evaluation."""
+        return {"num_added": self.num_added, "rng": self.rng.getstate(), "selected": list(self.selected)}
+
+    def resume(self, state: Dict[str, Any], submitted: Iterable[Tuple[pd.DataFrame, PlotForecast]]) -> None:
+        """Restore the selection state, and re-render the items submitted before the interruption."""
+        self.num_added = state["num_added"]
+        self.rng.setstate(state["rng"])
+        self.selected = state["selected"]
+        log, self.log = self.log, None
+        for item in submitted:
+            self._submit(item)
+        self.log = log
+
+    def add(self, time_series: pd.DataFrame, forecast: Forecast, wmape: Any = np.nan) -> None:
+        i = self.num_added
+        self.num_added += 1
+        if self.kind == "all":
+            self._submit(self._item(time_series, forecast))
+        elif self.kind == "random":
+            # Reservoir sampling: the i-th timeseries replaces a random selected one with probability n / (i + 1).
+            if i < self.n:
+                self.selected.append((i, self._item(time_series, forecast)))
+            else:
+                j = self.rng.randint(0, i)
+                if j < self.n:
+                    self.selected[j] = (i, self._item(time_series, forecast))
+        elif self.kind == "worst":
+            # Min-heap of the n highest wMAPE so far; NaN (or masked) wMAPE is never the worst.
+            key = float(wmape) if wmape is not np.ma.masked and not np.isnan(wmape) else -np.inf
+            if len(self.selected) < self.n:
+                heapq.heappush(self.selected, (key, i, self._item(time_series, forecast)))
+            elif key > self.selected[0][0]:
+                heapq.heapreplace(self.selected, (key, i, self._item(time_series, forecast)))
+
+    def close(self) -> None:
+        if self.kind == "random":
+            for _, item in sorted(self.selected, key=lambda x: x[0]):
+                self._submit(item)
+        elif self.kind == "worst":
+            for _, _, item in sorted(self.selected, key=lambda x: (-x[0], x[1])):
+                self._submit(item)
+        self.selected = []
+
+        if self.process is not None:
+            self._put(None)
+            self.process.join()
+            if self.process.exitcode != 0 and not self.failed:
+                logger.error("Plot renderer exited with code %s, hence some plots are missing.", self.process.exitcode)
+            self.process = None
+
+    def _item(self, time_series: pd.DataFrame, forecast: Forecast) -> Tuple[pd.DataFrame, PlotForecast]:
+        # Only the plotted tail of the actual timeseries is queued.
+        plot_length = PAST_LENGTH + forecast.prediction_length
+        return time_series[-plot_length:], PlotForecast(forecast, self.intervals)
+
+    def _submit(self, item: Tuple[pd.DataFrame, PlotForecast]) -> None:
+        # Pickled here rather than by the queue's feeder thread, so that an unpicklable item raises in the caller
+        # instead of being silently dropped.
+        data = pickle.dumps(item)
+        if self.process is None:
+            # Forked (as the evaluator's workers), so that the renderer inherits matplotlib's configuration.
+            ctx = multiprocessing.get_context("fork")
+            self.queue = ctx.Queue(maxsize=QUEUE_SIZE)
+            self.process = ctx.Process(
+                target=_render, args=(self.queue, self.plot_dir, self.intervals, self.savefig_kwargs), daemon=True
+            )
+            self.process.start()
+        self._put(data)
+        if self.log is not None:
+            self.log.write(data)
+
+    def _put(self, data: Optional[bytes]) -> None:
+        """Queue to the renderer process, unless it has failed."""
+        while not self.failed:
+            try:
+                self.queue.put(data, timeout=QUEUE_TIMEOUT)  # type: ignore
+                return
+            except queue.Full:
+                if not self.process.is_alive():  # type: ignore
+                    self.failed = True
+                    logger.error(
+                        "Plot renderer exited with code %s, hence the remaining plots are dropped.",
+                        self.process.exitcode,  # type: ignore
+                    )
+
+
+def parse_plot_policy(policy: str) -> Tuple[str, int]:
+    """Parse "all", "none", "random:N", or "worst:N" to (kind, N)."""
+    kind, _, n = policy.partition(":")
+    if kind not in PLOT_POLICIES or (kind in ("random", "worst")) != bool(n):
+        raise ValueError(f"Unknown plot policy: {policy}")
+    try:
+        return kind, int(n) if n else 0
+    except ValueError:
+        raise ValueError(f"Unknown plot policy: {policy}")
+
+
+def _render(q, plot_dir: Path, intervals: Sequence[float], savefig_kwargs: Dict[str, Any]) -> None:
+    """Renderer process: draw each queued timeseries onto the montage pages, until a None is received."""
+    mp = MontagePager(plot_dir, page_size=100, savefig_kwargs=savefig_kwargs)
+    while True:
+        data = q.get()
+        if data is None:
+            break
+        time_series, forecast = pickle.loads(data)
+        plot_prob_forecasts(mp.pop(forecast.item_id), time_series, forecast, intervals)
+    mp.savefig()
@@ -0,0 +1,160 @@
+"""Buffered writer of the forecast results of a backtest, e.g., results.jsonl.
+
+Results are buffered, then serialized and written buffer_size forecasts at a time. Supported formats:
+
+- jsonl: one JSON object per line, the same as json.dumps({"item_id": ..., **forecast.as_json_dict(config)}).
+- jsonl.gz: gzip-compressed jsonl.
+- parquet, arrow: columnar Parquet or Arrow IPC file with an item_id column, then a mean column and a column per
+  quantile level, each a fixed-size list of prediction_length float32. Requires pyarrow, and forecasts of the same
+  prediction length.
+"""
+import gzip
+import os
+from pathlib import Path
+from typing import Any, Iterator, List, NamedTuple, Optional, Sequence
+
+import numpy as np
+
+from .forecast import QuantileTable
+from .serde import table_to_json_lines
+
+RESULTS_FORMATS = ("jsonl", "jsonl.gz", "parquet", "arrow")
+
+
+class ForecastResult(NamedTuple):
+    """What to write of a forecast.
+
+    Attributes:
+        item_id (str): item_id of the forecast.
+        mean (Optional[np.ndarray]): shape (prediction_length,), or None when not written.
+        quantiles (Optional[np.ndarray]): shape (num_levels, prediction_length), or None when not written.
+    """
+
+    item_id: str
+    mean: Optional[np.ndarray]
+    quantiles: Optional[np.ndarray]
+
+
+class ResultsWriter:
+    """Write forecast results to out_dir/results.<format>, buffer_size forecasts at a time.
+
+    Args:
+        out_dir (os.PathLike): output directory.
+        levels (Sequence[str]): names of the quantile levels, in the order of ForecastResult.quantiles.
+        fmt (str, optional): one of RESULTS_FORMATS. Defaults to "jsonl".
+        buffer_size (int, optional): number of forecasts per write. Defaults to 1024.
+        append (bool, optional): append to the existing file, e.g., truncated as of a checkpoint. Only for jsonl and
+            jsonl.gz. Defaults to False.
+    """
+
+    def __init__(
+        self,
+        out_dir: os.PathLike,
+        levels: Sequence[str],
+        fmt: str = "jsonl",
+        buffer_size: int = 1024,
+        append: bool = False,
+    ):
+        if fmt not in RESULTS_FORMATS:
+            raise ValueError(f"Unknown results format: {fmt}")
+        if append and fmt not in ("jsonl", "jsonl.gz"):
+            raise ValueError(f"Cannot append results to: {fmt}")
+        self.path = Path(out_dir) / f"results.{fmt}"
+        self.levels = list(levels)
+        self.fmt = fmt
+        self.buffer_size = buffer_size
+        self.buffer: List[ForecastResult] = []
+        self.f: Any = None
+        self.writer: Any = None
+
+        if fmt == "jsonl":
+            self.f = self.path.open("a" if append else "w")
+        elif fmt == "jsonl.gz":
+            self.f = gzip.open(self.path, "at" if append else "wt")
+
+    def write(self, result: ForecastResult) -> None:
+        self.buffer.append(result)
+        if len(self.buffer) >= self.buffer_size:
+            self.flush()
+
+    def flush(self) -> None:
+        if not self.buffer:
+            return
+        if self.f is not None:
+            self._write_json_lines()
+        else:
+            self._write_record_batch()
+        self.buffer = []
+
+    def sync(self) -> None:
+        """Write the buffer, and make the file valid as-is, i.e., safe to truncate to its current size and append."""
+        self.flush()
+        if self.fmt == "jsonl":
+            self.f.flush()
+        elif self.fmt == "jsonl.gz":
+            # End the gzip member; appending starts a new one (concatenated members are a valid gzip file).
+            self.f.close()
+            self.f = gzip.open(self.path, "at")
+        else:
+            raise ValueError(f"Cannot sync results to: {self.fmt}")
+
+    def close(self) -> None:
+        self.flush()
+        if self.f is not None:
+            self.f.close()
+        if self.writer is not None:
+            self.writer.close()
+
+    def _write_json_lines(self) -> None:
+        # Stack the buffer to convert all floats with one tolist(), unless prediction lengths differ.
+        groups = [self.buffer] if len({_length(r) for r in self.buffer}) == 1 else [[r] for r in self.buffer]
+        for results in groups:
+            self.f.write("\n".join(_json_lines(results, self.levels)))
+            self.f.write("\n")
+
+    def _write_record_batch(self) -> None:
+        import pyarrow as pa  # Optional dependency, needed only by parquet and arrow outputs.
+
+        columns = {"item_id": pa.array([r.item_id for r in self.buffer], type=pa.string())}
+        if self.buffer[0].mean is not None:
+            columns["mean"] = _fixed_size_list(np.stack([r.mean for r in self.buffer]))
+        if self.buffer[0].quantiles is not None:
+            quantiles = np.stack([r.quantiles for r in self.buffer])
+            for i, level in enumerate(self.levels):
+                columns[level] = _fixed_size_list(quantiles[:, i, :])
+        batch = pa.RecordBatch.from_arrays(list(columns.values()), names=list(columns))
+
+        if self.writer is None:
+            if self.fmt == "parquet":
+                import pyarrow.parquet as pq
+
+                self.writer = pq.ParquetWriter(str(self.path), batch.schema)
+            else:
+                self.writer = pa.ipc.new_file(str(self.path), batch.schema)
+        if self.fmt == "parquet":
+            self.writer.write_table(pa.Table.from_batches([batch]))
+        else:
+            self.writer.write_batch(batch)
+
+
+def _length(result: ForecastResult) -> int:
+    return (result.mean if result.mean is not None else result.quantiles).shape[-1]  # type: ignore
+
+
+def _json_lines(results: List[ForecastResult], levels: Sequence[str]) -> Iterator[str]:
+    """JSON lines of results of the same prediction length, with NaN as-is (like json.dumps())."""
+    n, length = len(results), _length(results[0])
+    has_quantiles = results[0].quantiles is not None
+    quantiles = np.stack([r.quantiles for r in results]) if has_quantiles else np.empty((n, 0, length))
+    mean = np.stack([r.mean for r in results]) if results[0].mean is not None else None
+    table = QuantileTable(list(levels) if has_quantiles else [], quantiles, mean)
+    return table_to_json_lines(
+        table, quantiles=has_quantiles, nan_as_string=False, item_ids=[r.item_id for r in results]
+    )
+
+
+def _fixed_size_list(a: np.ndarray) -> Any:
+    """(num_forecasts, prediction_length) array to a fixed-size list of float32 column."""
+    import pyarrow as pa
+
+    return pa.FixedSizeListArray.from_arrays(pa.array(a.astype(np.float32).ravel()), a.shape[1])
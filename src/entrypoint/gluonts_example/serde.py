@@ -0,0 +1,394 @@
+import gzip
+import io
+import json
+import zlib
+from itertools import chain
+from typing import TYPE_CHECKING, Any, BinaryIO, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+
+from .forecast import QuantileTable, iter_quantile_tables
+
+if TYPE_CHECKING:
+    # Imported on first use otherwise, as gluonts.model.forecast pulls in mxnet and pandas.
+    from gluonts.model.forecast import Config, Forecast
+
+# Media type of the columnar NumPy format; see iter_npz() and table_to_npz().
+NPZ = "application/x-npz"
+
+# Supported values of the "encoding" media type parameter, e.g., "application/json; encoding=gzip".
+ENCODINGS = ("identity", "gzip", "zstd")
+
+Payload = Union[str, bytes, BinaryIO]
+
+
+# jsonify_floats is taken from gluonts/shell/serve/util.py
+#
+# The module depends on flask, and we may not want to import when testing in our own dev env.
+def jsonify_floats(json_object):
+    """Traverse through the JSON object and converts non JSON-spec compliant floats(nan, -inf, inf) to string.
+
+    Parameters
+    ----------
+    json_object
+        JSON object
+    """
+    if isinstance(json_object, dict):
+        return {k: jsonify_floats(v) for k, v in json_object.items()}
+    elif isinstance(json_object, list):
+        return [jsonify_floats(item) for item in json_object]
+    elif isinstance(json_object, float):
+        if np.isnan(json_object):
+            return "NaN"
+        elif np.isposinf(json_object):
+            return "Infinity"
+        elif np.isneginf(json_object):
+            return "-Infinity"
+        return json_object
+    return json_object
+
+
+def iter_json_lines(payload: Payload, target_ufunc: Optional[np.ufunc] = None) -> Iterator[Dict[str, Any]]:
+    """Lazily deserialize JSON lines, one line at a time; blank lines are skipped.
+
+    Bytes payload is not decoded upfront into one big string: each line is handed as-is to `json.loads()`. A binary
+    file-like payload (e.g., from decompress()) is read line by line.
+
+    When target_ufunc is given, each target is parsed into a float32 array then forward-transformed in place; see
+    transform_target(). Records without a target (i.e., the header record of split_header()) are yielded as-is.
+    """
+    if isinstance(payload, bytes):
+        stream = io.BytesIO(payload)
+    elif isinstance(payload, str):
+        stream = io.StringIO(payload)
+    else:
+        stream = payload
+    for line in stream:
+        if line.strip():
+            entry = json.loads(line)
+            if target_ufunc is not None and "target" in entry:
+                transform_target(entry, target_ufunc)
+            yield entry
+
+
+def iter_npz(payload: Payload, target_ufunc: Optional[np.ufunc] = None) -> Iterator[Dict[str, Any]]:
+    """Deserialize columnar timeseries from an .npz payload.
+
+    The targets of all timeseries are concatenated into a single "target" array, and "target_offsets" (of length
+    num_series + 1) delimits them, i.e., the i-th target is target[target_offsets[i]:target_offsets[i + 1]]. The
+    "start" array holds a timestamp string for each timeseries. Optional arrays are "item_id" (one per timeseries),
+    "feat_static_cat" and "feat_static_real" (one row per timeseries).
+
+    Each target is a float32 view into the payload array, i.e., no Python float is created per observation. When
+    target_ufunc is given, it is applied in place to the concatenated targets of all timeseries in one call.
+    """
+    if not isinstance(payload, bytes):
+        # .npz is a zip archive, which must be seekable.
+        payload = payload.read()
+    with np.load(io.BytesIO(payload), allow_pickle=False) as npz:
+        values = npz["target"].astype(np.float32, copy=False)
+        offsets = npz["target_offsets"]
+        starts = npz["start"]
+        optionals = {k: npz[k] for k in ("item_id", "feat_static_cat", "feat_static_real") if k in npz.files}
+    if target_ufunc is not None:
+        target_ufunc(values, out=values)
+
+    for i in range(len(starts)):
+        entry: Dict[str, Any] = {"start": str(starts[i]), "target": values[offsets[i] : offsets[i + 1]]}
+        for k, v in optionals.items():
+            entry[k] = v[i] if v.ndim > 1 else str(v[i])
+        yield entry
+
+
+def transform_target(entry: Dict[str, Any], ufunc: np.ufunc) -> Dict[str, Any]:
+    """Convert the target of a timeseries to a contiguous float32 array, then apply ufunc (e.g., np.log1p) in place.
+
+    This allocates one array per timeseries, and gluonts takes it as-is since it is already float32. Compare this to
+    applying `util.log1p()` on a ListDataset, which allocates a float64 array per timeseries, and then gluonts
+    allocates another float32 copy of it.
+    """
+    target = np.ascontiguousarray(entry["target"], dtype=np.float32)
+    ufunc(target, out=target)
+    entry["target"] = target
+    return entry
+
+
+def entries_to_npz(entries: Iterable[Dict[str, Any]]) -> bytes:
+    """Serialize timeseries to the columnar .npz format of iter_npz(), e.g., to prepare requests."""
+    entries = list(entries)
+    targets = [np.asarray(entry["target"], dtype=np.float32) for entry in entries]
+    arrays = {
+        "target": np.concatenate(targets) if targets else np.empty(0, dtype=np.float32),
+        "target_offsets": np.cumsum([0] + [len(t) for t in targets], dtype=np.int64),
+        "start": np.array([str(entry["start"]) for entry in entries]),
+    }
+    if entries and "item_id" in entries[0]:
+        arrays["item_id"] = np.array([str(entry["item_id"]) for entry in entries])
+    for k, dtype in (("feat_static_cat", np.int64), ("feat_static_real", np.float32)):
+        if entries and k in entries[0]:
+            arrays[k] = np.array([entry[k] for entry in entries], dtype=dtype)
+
+    buf = io.BytesIO()
+    np.savez(buf, **arrays)
+    return buf.getvalue()
+
+
+def content_encoding(media_type: Optional[str]) -> str:
+    """Get the compression of a payload from the "encoding" (or "content-encoding") media type parameter.
+
+    Raises:
+        ValueError: unsupported encoding.
+
+    Returns:
+        str: one of ENCODINGS.
+    """
+    params = parse_media_type(media_type)[1]
+    encoding = params.get("encoding", params.get("content-encoding", "identity")).lower() or "identity"
+    if encoding not in ENCODINGS:
+        raise ValueError(f"Unsupported encoding: {encoding}. Supported encodings are {ENCODINGS}.")
+    return encoding
+
+
+def decompress(payload: Union[str, bytes], encoding: str) -> Payload:
+    """Wrap a compressed payload in a file-like object that inflates on the fly, rather than in one go.
+
+    Args:
+        payload (Union[str, bytes]): Possibly compressed payload.
+        encoding (str): One of ENCODINGS.
+
+    Returns:
+        Payload: payload as-is when encoding is identity, otherwise a binary file-like object.
+    """
+    if encoding == "identity":
+        return payload
+    if isinstance(payload, str):
+        raise ValueError(f"Payload with encoding={encoding} must be bytes.")
+    if encoding == "gzip":
+        return gzip.GzipFile(fileobj=io.BytesIO(payload), mode="rb")
+    if encoding == "zstd":
+        import zstandard  # Optional dependency, needed only by zstd payloads.
+
+        return io.BufferedReader(zstandard.ZstdDecompressor().stream_reader(io.BytesIO(payload)))
+    raise ValueError(f"Unsupported encoding: {encoding}")
+
+
+def compress(chunks: Iterable[bytes], encoding: str) -> Iterator[bytes]:
+    """Incrementally compress a stream of chunks, e.g., from transform_stream(), into one gzip or zstd stream."""
+    if encoding == "identity":
+        yield from chunks
+        return
+
+    if encoding == "gzip":
+        compressor = zlib.compressobj(6, zlib.DEFLATED, 31)  # wbits=31 means gzip header & trailer.
+    elif encoding == "zstd":
+        import zstandard  # Optional dependency, needed only by zstd payloads.
+
+        compressor = zstandard.ZstdCompressor().compressobj()
+    else:
+        raise ValueError(f"Unsupported encoding: {encoding}")
+
+    for chunk in chunks:
+        out = compressor.compress(chunk)
+        if out:
+            yield out
+    yield compressor.flush()
+
+
+def split_header(entries: Iterable[Dict[str, Any]]) -> Tuple[Optional[Dict[str, Any]], Iterator[Dict[str, Any]]]:
+    """Detach the optional header record, i.e., a first line such as {"configuration": {"quantiles": ["0.5"]}}.
+
+    Returns:
+        Tuple[Optional[Dict[str, Any]], Iterator[Dict[str, Any]]]: the header's configuration (or None if there's no
+        header record), and the remaining timeseries.
+    """
+    it = iter(entries)
+    first = next(it, None)
+    if first is None:
+        return None, it
+    if "configuration" in first and "target" not in first:
+        return first["configuration"], it
+    return None, chain([first], it)
+
+
+def parse_media_type(media_type: Optional[str]) -> Tuple[str, Dict[str, str]]:
+    """Split "application/json; quantiles=0.5,0.9" into ("application/json", {"quantiles": "0.5,0.9"})."""
+    if not media_type:
+        return "", {}
+    mime, *params = media_type.split(";")
+    d = {}
+    for param in params:
+        k, sep, v = param.partition("=")
+        if sep:
+            d[k.strip().lower()] = v.strip().strip('"')
+    return mime.strip().lower(), d
+
+
+def request_config(
+    config: "Config", num_samples: int, media_types: Sequence[str] = (), header: Optional[Dict[str, Any]] = None
+) -> Tuple[int, "Config"]:
+    """Resolve the number of sample paths and the output configuration of a request.
+
+    Callers may ask for less than the defaults, e.g., 100 sample paths and the median only, either with media type
+    parameters (e.g., "application/json; num_samples=100; quantiles=0.5; output_types=quantiles"), or with a header
+    record (see `split_header()`). Later sources override earlier ones: the defaults, the parameters of each media
+    type, then the header record.
+
+    Args:
+        config (Config): default output configuration.
+        num_samples (int): default number of sample paths.
+        media_types (Sequence[str], optional): content type and accept type of the request. Defaults to ().
+        header (Optional[Dict[str, Any]], optional): configuration of the header record. Defaults to None.
+
+    Raises:
+        ValueError: invalid num_samples, quantiles, or output_types.
+
+    Returns:
+        Tuple[int, Config]: number of sample paths and output configuration of the request.
+    """
+    from gluonts.model.forecast import Config, OutputType, Quantile
+
+    overrides: Dict[str, Any] = {}
+    for media_type in media_types:
+        params = parse_media_type(media_type)[1]
+        if "num_samples" in params:
+            overrides["num_samples"] = params["num_samples"]
+        for key in ("quantiles", "output_types"):
+            if key in params:
+                overrides[key] = [v for v in params[key].split(",") if v.strip()]
+    if header:
+        overrides.update({k: v for k, v in header.items() if k in ("num_samples", "quantiles", "output_types")})
+    if not overrides:
+        return num_samples, config
+
+    try:
+        num_samples = int(overrides.get("num_samples", num_samples))
+        quantiles = [Quantile.parse(str(q).strip()).name for q in overrides.get("quantiles", config.quantiles)]
+        output_types = {OutputType(t.strip()) for t in overrides.get("output_types", config.output_types)}
+    except Exception as e:
+        raise ValueError(f"Invalid request configuration {overrides}: {e}") from e
+    if num_samples < 1:
+        raise ValueError(f"Invalid request configuration {overrides}: num_samples must be positive")
+
+    return num_samples, Config(quantiles=quantiles, output_types=output_types)
+
+
+def forecasts_to_json_lines(forecasts: Iterable["Forecast"], config: "Config", batch_size: int = 256) -> Iterator[str]:
+    """Serialize forecasts to JSON lines, a batch of forecasts at a time.
+
+    Each line is byte-identical to `json.dumps(jsonify_floats(forecast.as_json_dict(config)))`, but the quantiles and
+    mean of a whole batch are computed by a few NumPy calls (see `quantile_table()`), and the non-finite floats are
+    replaced using a vectorized mask rather than a recursive Python traversal.
+
+    Args:
+        forecasts (Iterable[Forecast]): forecasts to serialize.
+        config (Config): output configuration, i.e., what to serialize.
+        batch_size (int, optional): number of forecasts to stack at a time. Defaults to 256.
+
+    Yields:
+        str: a JSON line (without the newline character) for each forecast.
+    """
+    from gluonts.model.forecast import OutputType
+
+    if OutputType.samples in config.output_types:
+        # Raw samples are not tabulated, so fallback to the per-forecast path.
+        for forecast in forecasts:
+            yield json.dumps(jsonify_floats(forecast.as_json_dict(config)))
+        return
+
+    for table in forecasts_to_tables(forecasts, config, batch_size=batch_size):
+        yield from table_to_json_lines(table, quantiles=OutputType.quantiles in config.output_types)
+
+
+def forecasts_to_tables(
+    forecasts: Iterable["Forecast"], config: "Config", batch_size: int = 256
+) -> Iterator[QuantileTable]:
+    """Tabulate the quantiles and mean requested by the output configuration, a batch of forecasts at a time."""
+    levels, want_mean = table_spec(config)
+    return iter_quantile_tables(forecasts, levels, mean=want_mean, batch_size=batch_size)
+
+
+def concat_tables(tables: Sequence[QuantileTable], config: "Config", prediction_length: int) -> QuantileTable:
+    """Concatenate the tables of consecutive batches of forecasts; no tables give a table of zero forecasts."""
+    if not tables:
+        from gluonts.model.forecast import Quantile
+
+        levels, want_mean = table_spec(config)
+        levels = [Quantile.parse(level).name for level in levels]
+        quantiles = np.empty((0, len(levels), prediction_length), dtype=np.float32)
+        mean = np.empty((0, prediction_length), dtype=np.float32) if want_mean else None
+        return QuantileTable(levels, quantiles, mean)
+    if len(tables) == 1:
+        return tables[0]
+
+    quantiles = np.concatenate([t.quantiles for t in tables])
+    mean = np.concatenate([t.mean for t in tables]) if tables[0].mean is not None else None
+    return QuantileTable(tables[0].levels, quantiles, mean)
+
+
+def table_to_npz(table: QuantileTable) -> bytes:
+    """Serialize a quantile table to .npz, a dense float32 matrix per output type.
+
+    The arrays are "quantiles" of shape (num_series, num_levels, prediction_length) with the level names in
+    "quantile_levels", and "mean" of shape (num_series, prediction_length). Arrays not requested are omitted.
+    """
+    arrays = {}
+    if table.levels:
+        arrays["quantiles"] = table.quantiles.astype(np.float32, copy=False)
+        arrays["quantile_levels"] = np.array(table.levels)
+    if table.mean is not None:
+        arrays["mean"] = table.mean.astype(np.float32, copy=False)
+
+    buf = io.BytesIO()
+    np.savez(buf, **arrays)
+    return buf.getvalue()
+
+
+def table_to_json_lines(
+    table: QuantileTable, quantiles: bool = True, nan_as_string: bool = True, item_ids: Optional[Sequence[str]] = None
+) -> Iterator[str]:
+    """Serialize each row of a quantile table as a JSON line, using the key order of `Forecast.as_json_dict()`.
+
+    Args:
+        table (QuantileTable): quantiles and mean of forecasts.
+        quantiles (bool, optional): whether to output the quantiles. Defaults to True.
+        nan_as_string (bool, optional): output non-finite floats as "NaN", "Infinity", and "-Infinity" strings (as
+            per gluonts serving), otherwise as the bare (non JSON-spec compliant) tokens. Defaults to True.
+        item_ids (Optional[Sequence[str]], optional): when given, the "item_id" of each row, as the first key.
+            Defaults to None.
+
+    Yields:
+        str: a JSON line (without the newline character) for each row.
+    """
+    mean = _tolist(table.mean, nan_as_string) if table.mean is not None else None
+    values = _tolist(table.quantiles, nan_as_string) if quantiles else None
+    for i in range(len(table)):
+        d: Dict[str, Any] = {}
+        if item_ids is not None:
+            d["item_id"] = item_ids[i]
+        if mean is not None:
+            d["mean"] = mean[i]
+        if values is not None:
+            d["quantiles"] = dict(zip(table.levels, values[i]))
+        yield json.dumps(d)
+
+
+def table_spec(config: "Config") -> Tuple[List[str], bool]:
+    """Quantile levels and whether to compute mean, as per the output configuration."""
+    from gluonts.model.forecast import OutputType
+
+    if OutputType.samples in config.output_types:
+        raise ValueError("Output type 'samples' is supported by JSON lines only.")
+    levels = config.quantiles if OutputType.quantiles in config.output_types else []
+    return levels, OutputType.mean in config.output_types
+
+
+def _tolist(a: np.ndarray, nan_as_string: bool) -> List:
+    """Convert array to nested lists of Python floats, optionally with non-finite values as strings."""
+    if not nan_as_string or np.isfinite(a).all():
+        return a.tolist()
+
+    obj = a.astype(object)
+    obj[np.isnan(a)] = "NaN"
+    obj[np.isposinf(a)] = "Infinity"
+    obj[np.isneginf(a)] = "-Infinity"
+    return obj.tolist()
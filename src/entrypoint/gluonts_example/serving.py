@@ -0,0 +1,162 @@
+import hashlib
+import json
+import logging
+import os
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, Dict, Iterator, List, Optional, Union
+
+import numpy as np
+
+from .artifact import ARTIFACT, load_artifact
+from .forecast import QuantileTable
+from .serde import concat_tables, forecasts_to_json_lines, forecasts_to_tables
+from .telemetry import RequestMetrics
+from .util import clip_to_zero, expm1_and_clip_to_zero, log1p
+
+if TYPE_CHECKING:
+    # Imported on first use otherwise: gluonts (hence mxnet and pandas) is the bulk of the inference entrypoint's
+    # startup time, and a model_fn() that loads an artifact needs none of it.
+    from gluonts.dataset.common import DataEntry
+    from gluonts.model.forecast import Config, Forecast
+    from gluonts.model.predictor import Predictor
+
+logger = logging.getLogger(__name__)
+
+
+def load_predictor(model_dir: Union[str, Path]) -> "Predictor":
+    """Load a gluonts predictor, and attach the y transformations recorded in y_transform.json.
+
+    The single-file artifact (see gluonts_example.artifact) is preferred when model_dir has one, in which case the
+    network is loaded on first use.
+
+    Args:
+        model_dir (Union[str, Path]): a directory where model is saved.
+
+    Returns:
+        Predictor: A gluonts predictor, with additional `pre_input_transform` field.
+    """
+    artifact_path = os.path.join(model_dir, ARTIFACT)
+    if os.path.exists(artifact_path):
+        predictor = load_artifact(artifact_path)
+        y_transform = predictor.manifest["y_transform"]
+    else:
+        from gluonts.model.predictor import Predictor
+
+        predictor = Predictor.deserialize(Path(model_dir))
+        with open(os.path.join(model_dir, "y_transform.json"), "r") as f:
+            y_transform = json.load(f)
+
+    # If model was trained on log-space, then forecast must be inverted before metrics etc.
+    logger.info("load_predictor: custom transformations = %s", y_transform)
+    if y_transform["inverse_transform"] == "expm1":
+        predictor.output_transform = expm1_and_clip_to_zero
+    else:
+        predictor.output_transform = clip_to_zero
+
+    # Custom fields: the forward transformation of a ListDataset, and the same as a ufunc that the parsers can
+    # fuse into deserialization (see serde.transform_target()).
+    predictor.pre_input_transform = log1p if y_transform["transform"] == "log1p" else None
+    predictor.pre_input_ufunc = np.log1p if y_transform["transform"] == "log1p" else None
+
+    # Custom field, to let worker processes load the same model.
+    predictor.model_dir = str(model_dir)
+
+    return predictor
+
+
+def predict(
+    input_object: List["DataEntry"],
+    predictor: "Predictor",
+    num_samples: int = 1000,
+    metrics: Optional[RequestMetrics] = None,
+    pre_transformed: bool = False,
+) -> Iterator["Forecast"]:
+    """Forward-transform the timeseries, then lazily forecast them with the predictor.
+
+    Args:
+        input_object (List[DataEntry]): List of gluonts timeseries.
+        predictor (Predictor): A gluonts predictor, with additional `pre_input_transform` field.
+        num_samples (int, optional): Number of forecast paths for each timeseries. Defaults to 1000.
+        metrics (Optional[RequestMetrics], optional): Where to record the pre_transform and predict time. Defaults
+            to None.
+        pre_transformed (bool, optional): Whether the targets were already forward-transformed while parsed, i.e.,
+            with `predictor.pre_input_ufunc`. Defaults to False.
+
+    Returns:
+        Iterator[Forecast]: forecast results, in the same order as input_object.
+    """
+    from gluonts.dataset.common import ListDataset
+
+    # Create ListDataset here, because we need to match their freq with model's freq.
+    X = ListDataset(input_object, freq=predictor.freq)
+
+    # Apply forward transformation to input data, before injecting it to the predictor.
+    if predictor.pre_input_transform is not None and not pre_transformed:
+        logger.debug("Before predictor.pre_input_transform: %s", X.list_data)
+        if metrics is None:
+            predictor.pre_input_transform(X)
+        else:
+            with metrics.timer("pre_transform"):
+                predictor.pre_input_transform(X)
+        logger.debug("After predictor.pre_input_transform: %s", X.list_data)
+
+    forecasts = predictor.predict(X, num_samples=num_samples)
+    return forecasts if metrics is None else metrics.timed_iter("predict", forecasts)
+
+
+def predict_chunk(
+    chunk: List["DataEntry"],
+    predictor: "Predictor",
+    num_samples: int,
+    config: "Config",
+    tabulate: bool = False,
+    seed: Optional[int] = None,
+    metrics: Optional[RequestMetrics] = None,
+    pre_transformed: bool = False,
+) -> Union[str, QuantileTable]:
+    """Forecast a chunk of timeseries, then serialize the forecasts to JSON lines or (if tabulate) a quantile table.
+
+    When seed is given, the random generators of numpy and mxnet are seeded before sampling the forecast paths. When
+    metrics is given, the time to serialize (which excludes the time to lazily predict) is recorded too.
+    """
+    if tabulate and not chunk:
+        return concat_tables([], config, predictor.prediction_length)
+    if seed is not None:
+        import mxnet as mx
+
+        np.random.seed(seed)
+        mx.random.seed(seed)
+    forecasts = predict(chunk, predictor, num_samples, metrics, pre_transformed)
+    if metrics is None:
+        return _serialize(forecasts, predictor, config, tabulate)
+    with metrics.timer("serialize"):
+        return _serialize(forecasts, predictor, config, tabulate)
+
+
+def _serialize(
+    forecasts: Iterator["Forecast"], predictor: "Predictor", config: "Config", tabulate: bool
+) -> Union[str, QuantileTable]:
+    if tabulate:
+        return concat_tables(list(forecasts_to_tables(forecasts, config)), config, predictor.prediction_length)
+    return "\n".join(forecasts_to_json_lines(forecasts, config))
+
+
+def model_fingerprint(model_dir: Union[str, Path]) -> str:
+    """Digest the name, size and mtime of every file under model_dir, to detect a re-deployed model artifact."""
+    h = hashlib.sha1()
+    for root, dirs, files in os.walk(model_dir):
+        dirs.sort()
+        for fname in sorted(files):
+            path = os.path.join(root, fname)
+            st = os.stat(path)
+            h.update(f"{os.path.relpath(path, model_dir)}:{st.st_size}:{st.st_mtime_ns}\n".encode())
+    return h.hexdigest()
+
+
+def synthetic_request(predictor: "Predictor", num_series: int = 1) -> List[Dict[str, Any]]:
+    """Create timeseries with twice the prediction length worth of history, to exercise a predictor end-to-end."""
+    target = [1.0] * (2 * predictor.prediction_length)
+    return [
+        {"start": "2020-01-06", "target": target, "feat_static_cat": [0], "item_id": f"warmup-{i}"}
+        for i in range(num_series)
+    ]
@@ -0,0 +1,312 @@
+"""Timing and count metrics: per request of the inference entrypoint, and per epoch of training.
+
+Metrics are logged as "gluonts[metric-<name>]: <value>" lines, i.e., the same format as the metrics of the train
+script, so that SageMaker metric definitions (see test/match-metric.py) can scrape them. Optionally, their running
+totals are also exported to a Prometheus text file, e.g., for the node_exporter textfile collector.
+
+Callers pass around an Optional[RequestMetrics], and skip all bookkeeping when it is None.
+"""
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Dict, Iterable, Iterator, List, Optional, TypeVar, Union
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+# Stages of an inference request, in the order they are logged.
+STAGES = ("parse", "pre_transform", "predict", "serialize")
+
+
+class RequestMetrics:
+    """Seconds spent per stage, and counts (e.g., number of timeseries) of one request.
+
+    Stage timers may be nested, in which case the time of the inner stage is excluded from the outer stage. This is
+    needed because forecasts are predicted lazily, i.e., while they are being serialized.
+    """
+
+    def __init__(self):
+        self.seconds: Dict[str, float] = defaultdict(float)
+        self.counts: Dict[str, int] = defaultdict(int)
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    @contextmanager
+    def timer(self, stage: str):
+        stack = self._stack()
+        stack.append(0.0)
+        tic = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - tic
+            inner = stack.pop()
+            if stack:
+                stack[-1] += elapsed
+            with self._lock:
+                self.seconds[stage] += elapsed - inner
+
+    def timed_iter(self, stage: str, iterable: Iterable[T]) -> Iterator[T]:
+        """Wrap an iterator, to attribute the time of each next() to stage."""
+        it = iter(iterable)
+        while True:
+            with self.timer(stage):
+                try:
+                    item = next(it)
+                except StopIteration:
+                    return
+            yield item
+
+    def count(self, name: str, n: int = 1) -> None:
+        with self._lock:
+            self.counts[name] += n
+
+    def merge(self, other: Dict[str, Dict[str, Any]]) -> None:
+        """Add the metrics of another RequestMetrics, e.g., that of a worker process (see to_dict())."""
+        with self._lock:
+            for stage, seconds in other["seconds"].items():
+                self.seconds[stage] += seconds
+            for name, n in other["counts"].items():
+                self.counts[name] += n
+
+    def to_dict(self) -> Dict[str, Dict[str, Any]]:
+        return {"seconds": dict(self.seconds), "counts": dict(self.counts)}
+
+    def metrics(self, prefix: str = "inference_") -> Dict[str, Any]:
+        """Flatten to {name: value}, with every stage present even when it took no time."""
+        d: Dict[str, Any] = {f"{prefix}{stage}_seconds": self.seconds.get(stage, 0.0) for stage in STAGES}
+        d.update({f"{prefix}{stage}_seconds": s for stage, s in self.seconds.items() if stage not in STAGES})
+        d.update({f"{prefix}{name}": n for name, n in self.counts.items()})
+        return d
+
+    def log(self, to: logging.Logger = logger) -> None:
+        for name, value in self.metrics().items():
+            to.info(f"gluonts[metric-{name}]: {value}")
+
+    def _stack(self) -> list:
+        # One stack per thread, so that the timers of different threads never nest into each other.
+        stack = getattr(self._local, "stack", None)
+        if stack is None:
+            stack = self._local.stack = []
+        return stack
+
+
+class PrometheusTextfile:
+    """Accumulate request metrics into counters, and (re)write them to a Prometheus text file after each request."""
+
+    def __init__(self, path: str, prefix: str = "gluonts_"):
+        self.path = path
+        self.prefix = prefix
+        self.totals: Dict[str, float] = defaultdict(float)
+        self._lock = threading.Lock()
+
+    def update(self, metrics: RequestMetrics) -> None:
+        with self._lock:
+            self.totals["inference_requests"] += 1
+            for name, value in metrics.metrics().items():
+                self.totals[name] += value
+            lines = []
+            for name, value in sorted(self.totals.items()):
+                lines.append(f"# TYPE {self.prefix}{name}_total counter")
+                lines.append(f"{self.prefix}{name}_total {value}")
+
+            # Write-then-rename, so that a scraper never reads a partially written file.
+            tmp = f"{self.path}.{os.getpid()}.tmp"
+            try:
+                with open(tmp, "w") as f:
+                    f.write("\n".join(lines) + "\n")
+                os.replace(tmp, self.path)
+            except OSError:
+                logger.warning("PrometheusTextfile: failed to write %s", self.path, exc_info=True)
+
+
+def payload_size(payload: Union[str, bytes]) -> int:
+    """Size in bytes of a payload, which the model server may have decoded to a str."""
+    return len(payload.encode("utf-8")) if isinstance(payload, str) else len(payload)
+
+
+def timed_entries(metrics: Optional[RequestMetrics], entries: Iterable[Dict[str, Any]]) -> Iterable[Dict[str, Any]]:
+    """Attribute the lazy parsing of timeseries to the parse stage, and count the timeseries and their points."""
+    if metrics is None:
+        return entries
+    return _timed_entries(metrics, entries)
+
+
+def _timed_entries(metrics: RequestMetrics, entries: Iterable[Dict[str, Any]]) -> Iterator[Dict[str, Any]]:
+    for entry in metrics.timed_iter("parse", entries):
+        metrics.count("series")
+        metrics.count("points", len(entry.get("target", ())))
+        yield entry
+
+
+class TrainingMetrics:
+    """Per-epoch throughput of a gluonts Trainer, with the time of each epoch split into data loading and compute.
+
+    Data time is spent in next() of the training data loader, i.e., transforming and batching timeseries; compute time
+    is the rest of the training loop, i.e., forward, backward, and optimizer step. Validation passes are timed as a
+    whole. Populated by TimedTrainer, and every epoch is logged as soon as its pass completes.
+    """
+
+    def __init__(self, prefix: str = ""):
+        self.prefix = prefix
+        self.epochs: List[Dict[str, Any]] = []
+        self.seconds = 0.0
+
+    def timed_batches(self, loader: Iterable[Dict[str, Any]], validation: bool = False) -> Iterator[Dict[str, Any]]:
+        """Iterate one pass of a data loader: a training pass starts a new epoch, a validation pass is of that epoch."""
+        if validation:
+            epoch = self.epochs[-1]
+        else:
+            epoch = {"epoch": len(self.epochs), "data_seconds": 0.0, "compute_seconds": 0.0, "batches": 0, "series": 0}
+            self.epochs.append(epoch)
+        start = tic = time.perf_counter()
+        try:
+            for batch in loader:
+                toc = time.perf_counter()
+                if not validation:
+                    epoch["data_seconds"] += toc - tic
+                    epoch["batches"] += 1
+                    epoch["series"] += _batch_len(batch)
+                yield batch
+                tic = time.perf_counter()
+                if not validation:
+                    epoch["compute_seconds"] += tic - toc
+        finally:
+            if validation:
+                epoch["validation_seconds"] = time.perf_counter() - start
+            self.log_epoch(epoch, validation)
+
+    def log_epoch(self, epoch: Dict[str, Any], validation: bool = False, to: logging.Logger = logger) -> None:
+        if validation:
+            metrics = {"train_epoch_validation_seconds": epoch["validation_seconds"]}
+        else:
+            seconds = epoch["data_seconds"] + epoch["compute_seconds"]
+            metrics = {
+                "train_epoch_seconds": seconds,
+                "train_epoch_data_seconds": epoch["data_seconds"],
+                "train_epoch_compute_seconds": epoch["compute_seconds"],
+                "train_epoch_series_per_second": epoch["series"] / seconds if seconds > 0 else 0.0,
+                "train_epoch_batches_per_second": epoch["batches"] / seconds if seconds > 0 else 0.0,
+            }
+        for name, value in metrics.items():
+            to.info(f"Epoch[{epoch['epoch']}] gluonts[metric-{self.prefix}{name}]: {value}")
+
+    def metrics(self) -> Dict[str, Any]:
+        """Summary over all epochs, with the peak RSS of this process and of its largest child (e.g., a worker)."""
+        data = sum(epoch["data_seconds"] for epoch in self.epochs)
+        compute = sum(epoch["compute_seconds"] for epoch in self.epochs)
+        series = sum(epoch["series"] for epoch in self.epochs)
+        batches = sum(epoch["batches"] for epoch in self.epochs)
+        return {
+            "train_seconds": self.seconds,
+            "train_epochs": len(self.epochs),
+            "train_data_seconds": data,
+            "train_compute_seconds": compute,
+            "train_validation_seconds": sum(epoch.get("validation_seconds", 0.0) for epoch in self.epochs),
+            "train_series": series,
+            "train_batches": batches,
+            "train_series_per_second": series / (data + compute) if data + compute > 0 else 0.0,
+            "train_batches_per_second": batches / (data + compute) if data + compute > 0 else 0.0,
+            "train_peak_rss_mb": peak_rss_mb(),
+            "train_peak_rss_children_mb": peak_rss_mb(children=True),
+        }
+
+    def log(self, to: logging.Logger = logger) -> None:
+        for name, value in self.metrics().items():
+            to.info(f"gluonts[metric-{self.prefix}{name}]: {value}")
+
+    def save(self, path: Path) -> None:
+        with open(path, "w") as f:
+            json.dump({"summary": self.metrics(), "epochs": self.epochs}, f, indent=2)
+
+
+class TimedTrainer:
+    """Proxy of a gluonts Trainer, which times each pass over its data loaders into a TrainingMetrics.
+
+    Other attributes (e.g., epochs, halt) are read from and written to the proxied trainer.
+    """
+
+    def __init__(self, trainer: Any, metrics: TrainingMetrics):
+        object.__setattr__(self, "trainer", trainer)
+        object.__setattr__(self, "training_metrics", metrics)
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self.trainer, name)
+
+    def __setattr__(self, name: str, value: Any) -> None:
+        setattr(self.trainer, name, value)
+
+    def __call__(self, net, input_names, train_iter, validation_iter=None) -> None:
+        tic = time.perf_counter()
+        try:
+            self.trainer(
+                net=net,
+                input_names=input_names,
+                train_iter=_TimedLoader(train_iter, self.training_metrics),
+                validation_iter=_TimedLoader(validation_iter, self.training_metrics, validation=True)
+                if validation_iter is not None
+                else None,
+            )
+        finally:
+            self.training_metrics.seconds += time.perf_counter() - tic
+
+
+@contextmanager
+def timed_training(estimator: Any, prefix: str = ""):
+    """Time the training of an estimator, by temporarily replacing its trainer with a TimedTrainer.
+
+    Yields None for estimators without a gluonts Trainer (e.g., NPTS), which train no network.
+    """
+    trainer = getattr(estimator, "trainer", None)
+    if trainer is None or not callable(trainer):
+        yield None
+        return
+    metrics = TrainingMetrics(prefix)
+    estimator.trainer = TimedTrainer(trainer, metrics)
+    try:
+        yield metrics
+    finally:
+        estimator.trainer = trainer
+
+
+def peak_rss_mb(children: bool = False) -> float:
+    """Peak resident set size in MiB of this process, or of its largest terminated child."""
+    import resource  # Unix only, and unneeded by inference.
+
+    maxrss = resource.getrusage(resource.RUSAGE_CHILDREN if children else resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, but bytes on macOS.
+    return maxrss / 2 ** 20 if sys.platform == "darwin" else maxrss / 2 ** 10
+
+
+class _TimedLoader:
+    """Data loader whose every pass (i.e., iter()) is timed, and which otherwise behaves as the loader (e.g.,
+    batch_size, len())."""
+
+    def __init__(self, loader: Iterable[Dict[str, Any]], metrics: TrainingMetrics, validation: bool = False):
+        self.loader = loader
+        self.metrics = metrics
+        self.validation = validation
+
+    def __iter__(self) -> Iterator[Dict[str, Any]]:
+        return self.metrics.timed_batches(self.loader, self.validation)
+
+    def __len__(self) -> int:
+        # Special methods are looked up on the type, hence not forwarded by __getattr__().
+        return len(self.loader)  # type: ignore
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self.loader, name)
+
+
+def _batch_len(batch: Dict[str, Any]) -> int:
+    # Every field of a batch is stacked along the first axis.
+    for value in batch.values():
+        return len(value)
+    return 0
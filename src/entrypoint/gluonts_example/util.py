@@ -1,12 +1,14 @@
 import logging
 import os
 from pathlib import Path
-from typing import Any, Dict, Union
+from typing import TYPE_CHECKING, Any, Callable, Dict, Iterable, Iterator, Union
 
 import numpy as np
-from gluonts.dataset.common import ListDataset, MetaData, TrainDatasets
-from pandas.tseries import offsets
-from pandas.tseries.frequencies import to_offset
+
+if TYPE_CHECKING:
+    # Imported where needed instead, so that the inference entrypoint (which needs only the y transformations of this
+    # module) does not load gluonts and pandas on import.
+    from gluonts.dataset.common import DataEntry, ListDataset, MetaData, TrainDatasets
 
 
 def mkdir(path: Union[str, os.PathLike]):
@@ -15,7 +17,7 @@ def mkdir(path: Union[str, os.PathLike]):
     return path
 
 
-def override_hp(hp: Dict[str, Any], metadata: MetaData) -> Dict[str, Any]:
+def override_hp(hp: Dict[str, Any], metadata: "MetaData") -> Dict[str, Any]:
     """Resolve values to inject to the estimator: is it the hp or the one from metadata.
 
     This function:
@@ -47,6 +49,9 @@ def freq_name(s):
     This implementation uses only frequency string, hence 7D still becomes daily. It's not smart enough yet to know
     that 7D equals to week.
     """
+    from pandas.tseries import offsets
+    from pandas.tseries.frequencies import to_offset
+
     offset = to_offset(s)
     if isinstance(offset, offsets.Day):
         return "daily"
@@ -60,17 +65,15 @@ def freq_name(s):
 ################################################################################
 
 
-def log1p_tds(dataset: TrainDatasets) -> TrainDatasets:
-    """Create a new train datasets with targets log-transformed."""
-    # Implementation note: currently, the only way is to eagerly load all timeseries in memory, and do the transform.
-    train = ListDataset(dataset.train, freq=dataset.metadata.freq)
-    log1p(train)
+def log1p_tds(dataset: "TrainDatasets") -> "TrainDatasets":
+    """Create a new train datasets with targets log-transformed.
+
+    The transformation is lazy (see TransformedDataset), hence timeseries are never all loaded in memory.
+    """
+    from gluonts.dataset.common import TrainDatasets
 
-    if dataset.test is not None:
-        test = ListDataset(dataset.test, freq=dataset.metadata.freq)
-        log1p(test)
-    else:
-        test = None
+    train = TransformedDataset(dataset.train, np.log1p)
+    test = TransformedDataset(dataset.test, np.log1p) if dataset.test is not None else None
 
     # fmt: off
     return TrainDatasets(
@@ -81,7 +84,29 @@ def log1p_tds(dataset: TrainDatasets) -> TrainDatasets:
     # fmt: on
 
 
-def log1p(ds: ListDataset):
+class TransformedDataset:
+    """A dataset whose targets are transformed on the fly, every time the underlying dataset is iterated.
+
+    Iterating yields shallow copies of the underlying timeseries with a new target, so the underlying dataset (e.g.,
+    the list_data of a ListDataset) is never modified. The trade-off is to redo the transformation on every pass, e.g.,
+    on every training epoch, which is cheap compared to a forward-backward pass.
+    """
+
+    def __init__(self, dataset: Iterable["DataEntry"], fn: Callable[[np.ndarray], np.ndarray]):
+        self.dataset = dataset
+        self.fn = fn
+
+    def __iter__(self) -> Iterator["DataEntry"]:
+        for data_entry in self.dataset:
+            data_entry = data_entry.copy()
+            data_entry["target"] = self.fn(data_entry["target"])
+            yield data_entry
+
+    def __len__(self) -> int:
+        return len(self.dataset)  # type: ignore
+
+
+def log1p(ds: "ListDataset"):
     """In-place log transformation."""
     for data_entry in ds.list_data:
         data_entry["target"] = np.log1p(data_entry["target"])
@@ -1,55 +1,161 @@
 import smepu
 
 import argparse
-import io
-import json
 import os
-import warnings
+import sys
+import threading
+import time
+from collections import deque
+from itertools import islice
 from pathlib import Path
-from typing import List, Tuple, Union
+from typing import TYPE_CHECKING, Dict, Iterable, Iterator, List, Optional, Tuple, Union
 
-import matplotlib.cbook
 import numpy as np
-from gluonts.dataset.common import DataEntry, ListDataset
-from gluonts.model.forecast import Config, Forecast
-from gluonts.model.predictor import Predictor
-from gluonts_example.util import clip_to_zero, expm1_and_clip_to_zero, log1p
-
-warnings.filterwarnings("ignore", category=matplotlib.cbook.mplDeprecation)
+from gluonts_example.cache import ForecastCache
+from gluonts_example.forecast import QuantileTable
+from gluonts_example.parallel import WORKER_CHUNK_SIZE, InferencePool
+from gluonts_example.serde import (
+    NPZ,
+    Payload,
+    compress,
+    concat_tables,
+    content_encoding,
+    decompress,
+    forecasts_to_json_lines,
+    iter_json_lines,
+    iter_npz,
+    parse_media_type,
+    request_config,
+    split_header,
+    table_spec,
+    table_to_json_lines,
+    table_to_npz,
+)
+from gluonts_example.serving import load_predictor, model_fingerprint, predict, predict_chunk, synthetic_request
+from gluonts_example.telemetry import PrometheusTextfile, RequestMetrics, payload_size, timed_entries
+
+if TYPE_CHECKING:
+    # Imported on first use otherwise, to keep the startup of the model server short: loading a model artifact (see
+    # gluonts_example.artifact) needs none of gluonts, mxnet, and pandas. See test/benchmark_startup.py.
+    from gluonts.dataset.common import DataEntry
+    from gluonts.model.forecast import Config, Forecast
+    from gluonts.model.predictor import Predictor
 
 # Setup logger must be done in the entrypoint script.
 logger = smepu.setup_opinionated_logger(__name__)
 
+# Default output configuration, i.e., what _output_fn() serializes; created by output_config() on first use.
+OUTPUT_QUANTILES = ["0.1", "0.2", "0.3", "0.4", "0.5", "0.6", "0.7", "0.8", "0.9"]
+OUTPUT_CONFIG: Optional["Config"] = None
+
+# Number of timeseries that transform_fn() parses, predicts, and serializes at a time. Peak memory is bounded by this
+# chunk size rather than the payload size. Set to 0 to process the whole payload in one go.
+CHUNK_SIZE = int(os.environ.get("INFERENCE_CHUNK_SIZE", 1024))
+
+# Whether model_fn() runs a synthetic request through a newly loaded predictor before returning it, and its number of
+# forecast paths (the default of transform_fn()).
+WARMUP = bool(int(os.environ.get("INFERENCE_WARMUP", 1)))
+WARMUP_NUM_SAMPLES = 1000
+
+# Number of worker processes that share the timeseries of each request: "0" runs inference in this process, while
+# "auto" plans the number of workers (and threads per worker) from the cpu cores. See gluonts_example.parallel.
+WORKERS = os.environ.get("INFERENCE_WORKERS", "0")
+THREADS_PER_WORKER = int(os.environ.get("INFERENCE_THREADS_PER_WORKER", 0))
+
+# Seed of the random generators before sampling each chunk of timeseries; unset means unseeded.
+SEED = int(os.environ["INFERENCE_SEED"]) if os.environ.get("INFERENCE_SEED") else None
+
+# Optional cache of forecast quantiles, keyed by the content of each timeseries, so that re-submitted timeseries are
+# not predicted again. INFERENCE_CACHE_SIZE is the max. number of timeseries kept in memory (0 disables the cache),
+# and INFERENCE_CACHE_DIR (if set) adds an on-disk tier. See gluonts_example.cache.
+CACHE_SIZE = int(os.environ.get("INFERENCE_CACHE_SIZE", 0))
+CACHE = ForecastCache(CACHE_SIZE, os.environ.get("INFERENCE_CACHE_DIR")) if CACHE_SIZE > 0 else None
+
+# Whether transform_fn() logs per-request metrics as "gluonts[metric-inference_...]: value" lines, and optionally
+# also accumulates them into a Prometheus text file. See gluonts_example.telemetry. The bytes_in and bytes_out metrics
+# are the sizes in bytes of the payloads as transferred, i.e., compressed when they have a content encoding.
+METRICS = bool(int(os.environ.get("INFERENCE_METRICS", 0)))
+PROMETHEUS = (
+    PrometheusTextfile(os.environ["INFERENCE_METRICS_PROM"]) if os.environ.get("INFERENCE_METRICS_PROM") else None
+)
+
+# Process-level cache of loaded predictors, keyed by (model_dir, model_fingerprint(model_dir)).
+_PREDICTORS: Dict[Tuple[str, str], "Predictor"] = {}
+_PREDICTORS_LOCK = threading.Lock()
+
+# Worker pools (if any), keyed by model_dir.
+_POOLS: Dict[str, InferencePool] = {}
 
-def model_fn(model_dir: Union[str, Path]) -> Predictor:
+
+def output_config() -> "Config":
+    """The default output configuration, i.e., OUTPUT_CONFIG, created on first call."""
+    global OUTPUT_CONFIG
+    if OUTPUT_CONFIG is None:
+        from gluonts.model.forecast import Config
+
+        OUTPUT_CONFIG = Config(quantiles=OUTPUT_QUANTILES)
+    return OUTPUT_CONFIG
+
+
+def model_fn(model_dir: Union[str, Path]) -> "Predictor":
     """Load a glounts model from a directory.
 
+    Loaded predictors are memoized per process, keyed by model_dir and a fingerprint of its files. Hence, calling this
+    function again returns the same predictor without deserializing it again, unless the model artifacts changed.
+
     Args:
         model_dir (Union[str, Path]): a directory where model is saved.
 
     Returns:
         Predictor: A gluonts predictor.
     """
-    predictor = Predictor.deserialize(Path(model_dir))
-
-    # If model was trained on log-space, then forecast must be inverted before metrics etc.
-    with open(os.path.join(model_dir, "y_transform.json"), "r") as f:
-        y_transform = json.load(f)
-        logger.info("model_fn: custom transformations = %s", y_transform)
+    model_dir = os.path.abspath(model_dir)
+    key = (model_dir, model_fingerprint(model_dir))
+    with _PREDICTORS_LOCK:
+        if key in _PREDICTORS:
+            logger.info("model_fn() done; reuse cached predictor %s", _PREDICTORS[key])
+            return _PREDICTORS[key]
+
+        predictor = load_predictor(model_dir)
+        logger.info("predictor.pre_input_transform: %s", predictor.pre_input_transform)
+        logger.info("predictor.output_transform: %s", predictor.output_transform)
+
+        # Evict the stale predictor (if any) of the same model_dir, since its artifacts have changed. Its workers are
+        # closed first, so that the warm-up below runs on the new predictor.
+        for stale_key in [k for k in _PREDICTORS if k[0] == model_dir]:
+            del _PREDICTORS[stale_key]
+        if model_dir in _POOLS:
+            _POOLS.pop(model_dir).close()
+
+        if WARMUP:
+            _warmup(predictor)
+        _PREDICTORS[key] = predictor
+
+        # Custom field, to key the forecast cache.
+        predictor.fingerprint = key[1]
+
+        if WORKERS != "0":
+            num_workers = 0 if WORKERS == "auto" else int(WORKERS)
+            _POOLS[model_dir] = InferencePool(model_dir, num_workers, THREADS_PER_WORKER, warmup=WARMUP)
 
-        if y_transform["inverse_transform"] == "expm1":
-            predictor.output_transform = expm1_and_clip_to_zero
-        else:
-            predictor.output_transform = clip_to_zero
+    logger.info("model_fn() done; loaded predictor %s", predictor)
+    return predictor
 
-        # Custom field
-        predictor.pre_input_transform = log1p if y_transform["transform"] == "log1p" else None
 
-    logger.info("predictor.pre_input_transform: %s", predictor.pre_input_transform)
-    logger.info("predictor.output_transform: %s", predictor.output_transform)
-    logger.info("model_fn() done; loaded predictor %s", predictor)
+def _warmup(predictor: "Predictor") -> None:
+    """Run a synthetic request, so that the first real request does not pay the one-time graph setup cost.
 
-    return predictor
+    The request is predicted and serialized in this process, and bypasses transform_fn(), hence is neither recorded by
+    the request metrics nor sent to a worker pool.
+    """
+    num_series = getattr(predictor, "batch_size", 1)
+    tic = time.perf_counter()
+    try:
+        predict_chunk(synthetic_request(predictor, num_series), predictor, WARMUP_NUM_SAMPLES, output_config())
+    except Exception:
+        logger.warning("model_fn: warm-up request failed, so first request will be slower.", exc_info=True)
+        return
+    logger.info("model_fn: warm-up request of %d timeseries took %.3fs", num_series, time.perf_counter() - tic)
 
 
 # See https://sagemaker.readthedocs.io/en/stable/using_mxnet.html#use-transform-fn
@@ -65,66 +171,229 @@ def model_fn(model_dir: Union[str, Path]) -> Predictor:
 #     /src/sagemaker_mxnet_serving_container/handler_service.py
 # [2] https://sagemaker.readthedocs.io/en/stable/using_mxnet.html#load-a-model
 def transform_fn(
-    model: Predictor,
+    model: "Predictor",
     request_body: Union[str, bytes],
     content_type: str = "application/json",
     accept_type: str = "application/json",
     num_samples: int = 1000,
 ) -> Union[bytes, Tuple[bytes, str]]:
-    deser_input: List[DataEntry] = _input_fn(request_body, content_type)
-    fcast: List[Forecast] = _predict_fn(deser_input, model, num_samples=num_samples)
-    ser_output: Union[bytes, Tuple[bytes, str]] = _output_fn(fcast, accept_type)
-    return ser_output
+    metrics = RequestMetrics() if METRICS or PROMETHEUS is not None else None
+    if metrics is not None:
+        tic = time.perf_counter()
+        metrics.count("bytes_in", payload_size(request_body))
+
+    # Request and response may be compressed, e.g., "application/json; encoding=gzip". See content_encoding().
+    request_body = decompress(request_body, content_encoding(content_type))
+    response_encoding = content_encoding(accept_type)
+
+    # The forward transformation of the targets (if any) is fused into parsing. See serde.transform_target().
+    target_ufunc = getattr(model, "pre_input_ufunc", None)
+    pre_transformed = target_ufunc is not None
+
+    # Callers may override num_samples and what to output, per request. See request_config().
+    header, entries = split_header(_iter_input(request_body, content_type, target_ufunc))
+    num_samples, config = request_config(output_config(), num_samples, (content_type, accept_type), header)
+    accept_type = parse_media_type(accept_type)[0] or accept_type
+    entries = timed_entries(metrics, entries)
+
+    chunks: Iterable[bytes]
+    if accept_type == NPZ:
+        tables = list(_iter_results(model, entries, num_samples, config, CHUNK_SIZE, True, metrics, pre_transformed))
+        chunks = [table_to_npz(concat_tables(tables, config, model.prediction_length))]
+    elif CHUNK_SIZE > 0 or getattr(model, "model_dir", None) in _POOLS or CACHE is not None or metrics is not None:
+        chunks = transform_stream(model, entries, num_samples, CHUNK_SIZE, config, metrics, pre_transformed)
+    else:
+        deser_input: List["DataEntry"] = list(entries)
+        fcast: List["Forecast"] = _predict_fn(deser_input, model, num_samples, pre_transformed)
+        chunks = [_output_fn(fcast, accept_type, config)[0]]
+
+    if response_encoding != "identity":
+        chunks = compress(chunks, response_encoding)
+        accept_type = f"{accept_type}; encoding={response_encoding}"
+    response_body = b"".join(chunks)
+
+    if CACHE is not None:
+        logger.info("transform_fn: forecast cache %s", CACHE.stats())
+    if metrics is not None:
+        metrics.count("bytes_out", len(response_body))
+        metrics.seconds["total"] = time.perf_counter() - tic
+        if METRICS:
+            metrics.log(logger)
+        if PROMETHEUS is not None:
+            PROMETHEUS.update(metrics)
+    return response_body, accept_type
+
+
+def transform_stream(
+    model: "Predictor",
+    entries: Iterable["DataEntry"],
+    num_samples: int = 1000,
+    chunk_size: int = 1024,
+    config: Optional["Config"] = None,
+    metrics: Optional[RequestMetrics] = None,
+    pre_transformed: bool = False,
+) -> Iterator[bytes]:
+    """Streaming counterpart of transform_fn(): parse, predict, and serialize a chunk of timeseries at a time.
+
+    Only one chunk of timeseries and their forecast paths are alive at any time, hence peak memory is bounded by
+    chunk_size * num_samples * prediction_length, regardless of the number of timeseries in the payload. Concatenating
+    the yielded chunks gives exactly the same bytes as the non-streaming transform_fn().
+
+    Args:
+        model (Predictor): A gluonts predictor.
+        entries (Iterable[DataEntry]): Lazily deserialized timeseries, e.g., from iter_json_lines().
+        num_samples (int, optional): Number of forecast paths for each timeseries. Defaults to 1000.
+        chunk_size (int, optional): Number of timeseries per chunk. Defaults to 1024.
+        config (Optional[Config], optional): What to serialize. Defaults to None, i.e., OUTPUT_CONFIG.
+        metrics (Optional[RequestMetrics], optional): Where to record the stage timings. Defaults to None.
+        pre_transformed (bool, optional): Whether entries were parsed with `model.pre_input_ufunc`. Defaults to False.
+
+    Yields:
+        bytes: JSON lines of a chunk of timeseries.
+    """
+    config = output_config() if config is None else config
+    results = _iter_results(model, entries, num_samples, config, chunk_size, False, metrics, pre_transformed)
+    sep = b""
+    for result in results:
+        yield sep + result.encode()
+        sep = b"\n"
+
+
+def _iter_results(
+    model: "Predictor",
+    entries: Iterable["DataEntry"],
+    num_samples: int,
+    config: "Config",
+    chunk_size: int,
+    tabulate: bool = False,
+    metrics: Optional[RequestMetrics] = None,
+    pre_transformed: bool = False,
+) -> Iterator[Union[str, QuantileTable]]:
+    """Predict and serialize a chunk of timeseries at a time; see gluonts_example.serving.predict_chunk()."""
+    from gluonts.model.forecast import OutputType
+
+    entries = iter(entries)
+
+    # With a worker pool, the chunks are spread across (and predicted concurrently by) the workers.
+    pool = _POOLS.get(getattr(model, "model_dir", None))
+    if pool is not None:
+        chunk_size = min(chunk_size, WORKER_CHUNK_SIZE) if chunk_size > 0 else WORKER_CHUNK_SIZE
+    elif chunk_size <= 0:
+        chunk_size = sys.maxsize
+    chunks = iter(lambda: list(islice(entries, chunk_size)), [])
+
+    # With the forecast cache, only the cache misses of each chunk are predicted.
+    cache = CACHE if getattr(model, "fingerprint", None) and OutputType.samples not in config.output_types else None
+    if cache is not None:
+        pending: deque = deque()
+        chunks = _cache_misses(cache, chunks, pending, model.fingerprint, num_samples, config)
+
+    results: Iterator[Union[str, QuantileTable]]
+    tabulate_chunks = tabulate or cache is not None
+    if pool is not None:
+        results = pool.imap(chunks, num_samples, config, tabulate_chunks, SEED, metrics, pre_transformed)
+    else:
+        results = (
+            predict_chunk(chunk, model, num_samples, config, tabulate_chunks, SEED, metrics, pre_transformed)
+            for chunk in chunks
+        )
+
+    if cache is not None:
+        results = _cache_merge(cache, results, pending, config, tabulate, metrics)
+    return results
+
+
+def _cache_misses(
+    cache: ForecastCache,
+    chunks: Iterator[List["DataEntry"]],
+    pending: deque,
+    fingerprint: str,
+    num_samples: int,
+    config: "Config",
+) -> Iterator[List["DataEntry"]]:
+    """Look up each chunk in the cache, record (keys, cached forecasts) in pending, and yield its cache misses."""
+    levels, want_mean = table_spec(config)
+    for chunk in chunks:
+        keys = [cache.key(fingerprint, entry, num_samples, levels, want_mean, SEED) for entry in chunk]
+        found = [cache.get(key) for key in keys]
+        pending.append((keys, found))
+        yield [entry for entry, value in zip(chunk, found) if value is None]
+
+
+def _cache_merge(
+    cache: ForecastCache,
+    tables: Iterator[QuantileTable],
+    pending: deque,
+    config: "Config",
+    tabulate: bool,
+    metrics: Optional[RequestMetrics] = None,
+) -> Iterator[Union[str, QuantileTable]]:
+    """Merge the forecasts of the cache misses of each chunk with its cached forecasts, in input order."""
+    from gluonts.model.forecast import OutputType
+
+    for table in tables:
+        keys, found = pending.popleft()
+        table = cache.merge(keys, found, table)
+        if tabulate:
+            yield table
+        elif metrics is None:
+            yield "\n".join(table_to_json_lines(table, quantiles=OutputType.quantiles in config.output_types))
+        else:
+            with metrics.timer("serialize"):
+                result = "\n".join(table_to_json_lines(table, quantiles=OutputType.quantiles in config.output_types))
+            yield result
+
+
+def _iter_input(
+    request_body: Payload, request_content_type: str, target_ufunc: Optional[np.ufunc] = None
+) -> Iterator["DataEntry"]:
+    """Lazily deserialize timeseries from JSON lines, or from columnar .npz, optionally transforming the targets."""
+    if parse_media_type(request_content_type)[0] == NPZ:
+        return iter_npz(request_body, target_ufunc)
+    return iter_json_lines(request_body, target_ufunc)
 
 
 # Because we use transform_fn(), make sure this entrypoint does not contain input_fn() during inference.
-def _input_fn(request_body: Union[str, bytes], request_content_type: str = "application/json") -> List[DataEntry]:
-    """Deserialize JSON-lines into Python objects.
+def _input_fn(request_body: Union[str, bytes], request_content_type: str = "application/json") -> List["DataEntry"]:
+    """Deserialize JSON-lines (or columnar .npz) into Python objects.
 
     Args:
         request_body (str): Incoming payload.
-        request_content_type (str, optional): Ignored. Defaults to "".
+        request_content_type (str, optional): "application/x-npz" for .npz, otherwise JSON lines. Defaults to
+            "application/json".
 
     Returns:
         List[DataEntry]: List of gluonts timeseries.
     """
 
     # [20200508] I swear: two days ago request_body was bytes, today's string!!!
-    if isinstance(request_body, bytes):
-        request_body = request_body.decode("utf-8")
-    return [json.loads(line) for line in io.StringIO(request_body)]
+    return list(_iter_input(request_body, request_content_type))
 
 
 # Because we use transform_fn(), make sure this entrypoint does not contain predict_fn() during inference.
-def _predict_fn(input_object: List[DataEntry], model: Predictor, num_samples=1000) -> List[Forecast]:
+def _predict_fn(
+    input_object: List["DataEntry"], model: "Predictor", num_samples=1000, pre_transformed: bool = False
+) -> List["Forecast"]:
     """Take the deserialized JSON-lines, then perform inference against the loaded model.
 
     Args:
         input_object (List[DataEntry]): List of gluonts timeseries.
         model (Predictor): A gluonts predictor.
         num_samples (int, optional): Number of forecast paths for each timeseries. Defaults to 1000.
+        pre_transformed (bool, optional): Whether the targets were already forward-transformed while parsed.
+            Defaults to False.
 
     Returns:
         List[Forecast]: List of forecast results.
     """
-    # Create ListDataset here, because we need to match their freq with model's freq.
-    X = ListDataset(input_object, freq=model.freq)
-
-    # Apply forward transformation to input data, before injecting it to the predictor.
-    if model.pre_input_transform is not None:
-        logger.debug("Before model.pre_input_transform: %s", X.list_data)
-        model.pre_input_transform(X)
-        logger.debug("After model.pre_input_transform: %s", X.list_data)
-
-    it = model.predict(X, num_samples=num_samples)
-    return list(it)
+    return list(predict(input_object, model, num_samples=num_samples, pre_transformed=pre_transformed))
 
 
 # Because we use transform_fn(), make sure this entrypoint does not contain output_fn() during inference.
 def _output_fn(
-    forecasts: List[Forecast],
+    forecasts: List["Forecast"],
     content_type: str = "application/json",
-    config: Config = Config(quantiles=["0.1", "0.2", "0.3", "0.4", "0.5", "0.6", "0.7", "0.8", "0.9"]),
+    config: Optional["Config"] = None,
 ) -> Union[bytes, Tuple[bytes, str]]:
     """Take the prediction result and serializes it according to the response content type.
 
@@ -135,33 +404,9 @@ def _output_fn(
     Returns:
         List[str]: List of JSON-lines, each denotes forecast results in quantiles.
     """
+    config = output_config() if config is None else config
 
-    # jsonify_floats is taken from gluonts/shell/serve/util.py
-    #
-    # The module depends on flask, and we may not want to import when testing in our own dev env.
-    def jsonify_floats(json_object):
-        """Traverse through the JSON object and converts non JSON-spec compliant floats(nan, -inf, inf) to string.
-
-        Parameters
-        ----------
-        json_object
-            JSON object
-        """
-        if isinstance(json_object, dict):
-            return {k: jsonify_floats(v) for k, v in json_object.items()}
-        elif isinstance(json_object, list):
-            return [jsonify_floats(item) for item in json_object]
-        elif isinstance(json_object, float):
-            if np.isnan(json_object):
-                return "NaN"
-            elif np.isposinf(json_object):
-                return "Infinity"
-            elif np.isneginf(json_object):
-                return "-Infinity"
-            return json_object
-        return json_object
-
-    str_results = "\n".join((json.dumps(jsonify_floats(forecast.as_json_dict(config))) for forecast in forecasts))
+    str_results = "\n".join(forecasts_to_json_lines(forecasts, config))
     bytes_results = str.encode(str_results)
     return bytes_results, content_type
 
@@ -183,7 +428,7 @@ if __name__ == "__main__":
     # {"start": "2020-01-13 00:00:00", "target": [256, 123, 125, 150, 127, 20, 205], "item_id": "B|2"}
     # """
 
-    model: Predictor = model_fn(args.model_dir)
+    model: "Predictor" = model_fn(args.model_dir)
 
     with args.input_file.open("r") as f:
         for request_body in f:
@@ -0,0 +1,310 @@
+"""Local hyperparameter sweep: grid or random search of an estimator, on one multi-core machine.
+
+The dataset is loaded (and transformed) once into shared memory, then each trial trains and backtests the estimator in
+its own forked process, exactly as train.py does. Weak trials are stopped early by successive halving over their
+validation loss at increasing epoch budgets (see SuccessiveHalving). The agg_metrics of the trials are written to
+output_data_dir/leaderboard.csv, from the best; each trial also writes its model and outputs to a subdirectory named
+after the trial, like train.py --algos.
+
+Example:
+    python sweep.py --s3_dataset refdata --algo gluonts.model.deepar.DeepAREstimator \\
+        --trainer.__class__ gluonts.trainer.Trainer --trainer.epochs 27 \\
+        --search_space '{"trainer.learning_rate": [1e-2, 1e-3], "num_cells": [20, 40, 80]}' --min_epochs 3 --eta 3
+"""
+import smepu
+
+import itertools
+import json
+import logging
+import multiprocessing
+import multiprocessing.connection
+import os
+import random
+import sys
+from argparse import ArgumentParser, Namespace
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+from gluonts.dataset.common import TrainDatasets
+
+from gluonts_example.mmap_dataset import shared_datasets
+from gluonts_example.parallel import plan_workers
+from gluonts_example.util import log1p_tds, override_hp
+from train import add_args as add_train_args
+from train import evaluate, fit, load_dataset, model_args, new_estimator, save_model
+
+# Setup logger must be done in the entrypoint script.
+logger = smepu.setup_opinionated_logger(__name__)
+
+# Log message of the gluonts Trainer at the end of each epoch, whose args are (epoch_no, metric, value).
+EPOCH_METRIC_MSG = "Epoch[%d] Evaluation metric '%s'=%f"
+
+# The trials are trained with the test split as validation data (see train.get_train_kwargs()).
+VALIDATION_LOSS = "validation_epoch_loss"
+
+
+class SuccessiveHalving:
+    """Asynchronous successive halving over epoch budgets.
+
+    Rungs are at min_epochs * eta**k epochs. A trial reaching a rung continues only if its loss ranks among the best
+    max(1, n // eta) of the n losses reported at that rung so far. Hence, about 1/eta of the trials survive each rung,
+    without waiting for the slower trials to reach it.
+
+    Args:
+        min_epochs (int, optional): epochs of the first rung. Defaults to 1.
+        eta (int, optional): reduction factor between rungs, at least 2. Defaults to 3.
+    """
+
+    def __init__(self, min_epochs: int = 1, eta: int = 3):
+        if min_epochs < 1 or eta < 2:
+            raise ValueError(f"Invalid successive halving: min_epochs={min_epochs}, eta={eta}")
+        self.min_epochs = min_epochs
+        self.eta = eta
+        self.losses: Dict[int, List[float]] = {}
+
+    def is_rung(self, epochs: int) -> bool:
+        if epochs < self.min_epochs or epochs % self.min_epochs:
+            return False
+        q = epochs // self.min_epochs
+        while q % self.eta == 0:
+            q //= self.eta
+        return q == 1
+
+    def should_stop(self, epochs: int, loss: float) -> bool:
+        """Record the loss of a trial at a rung, and decide whether to stop the trial. A NaN loss is always stopped."""
+        losses = self.losses.setdefault(epochs, [])
+        losses.append(loss if not np.isnan(loss) else np.inf)
+        k = max(1, len(losses) // self.eta)
+        return not loss <= sorted(losses)[k - 1]
+
+
+class RungReporter(logging.Handler):
+    """Report the validation loss at each rung to the sweep driver, and halt the trainer when the trial is pruned.
+
+    Attached to the logger of the gluonts Trainer, hence runs in the training loop.
+    """
+
+    def __init__(self, conn, pruner: SuccessiveHalving, trainer: Optional[Any]):
+        super().__init__()
+        self.conn = conn
+        self.pruner = pruner
+        self.trainer = trainer
+        self.pruned = False
+
+    def emit(self, record: logging.LogRecord) -> None:
+        if record.msg != EPOCH_METRIC_MSG or record.args[1] != VALIDATION_LOSS:  # type: ignore
+            return
+        epochs = record.args[0] + 1  # type: ignore
+        if self.pruned or not self.pruner.is_rung(epochs):
+            return
+        self.conn.send(("rung", epochs, float(record.args[2])))  # type: ignore
+        if self.conn.recv():
+            self.pruned = True
+            # Stops before the next epoch (or batch), then the trainer loads the best parameters so far.
+            self.trainer.halt = True
+
+
+def sweep(args: Namespace, hp_args: List[str]) -> None:
+    """Run the trials of the search space, then write the leaderboard."""
+    dataset = load_dataset(args)
+    if args.y_transform == "log1p":
+        dataset = log1p_tds(dataset)
+
+    trials = make_trials(json.loads(args.search_space), args.num_trials, args.sweep_seed)
+    logger.info("Sweeping %d trials", len(trials))
+    pruner = SuccessiveHalving(args.min_epochs, args.eta)
+    max_running = args.sweep_workers if args.sweep_workers > 0 else plan_workers()[0]
+    with shared_datasets(dataset) as dataset:
+        runner = SweepRunner(args, hp_args, dataset, pruner)
+        runner.run(trials, max_running)
+
+    df = leaderboard(runner.records, args.sweep_metric)
+    df.to_csv(Path(args.output_data_dir) / "leaderboard.csv", index=False)
+    logger.info("Leaderboard:\n%s", df.to_string(index=False))
+
+
+def make_trials(search_space: Dict[str, List[Any]], num_trials: int = 0, seed: int = 0) -> List[Dict[str, Any]]:
+    """Hyperparameters of each trial: the full grid of search_space, or num_trials random picks from it."""
+    if num_trials <= 0:
+        return [dict(zip(search_space, values)) for values in itertools.product(*search_space.values())]
+    rng = random.Random(seed)
+    return [{name: rng.choice(values) for name, values in search_space.items()} for _ in range(num_trials)]
+
+
+def trial_hp_args(hp_args: List[str], overrides: Dict[str, Any]) -> List[str]:
+    """CLI hyperparameters of a trial, i.e., those given to this script (as "--name value" pairs) with overrides."""
+    flags = {f"--{name}" for name in overrides}
+    trial_args = []
+    skip = False
+    for arg in hp_args:
+        if skip:
+            skip = False
+        elif arg in flags:
+            skip = True
+        else:
+            trial_args.append(arg)
+    for name, value in overrides.items():
+        trial_args += [f"--{name}", value if isinstance(value, str) else json.dumps(value)]
+    return trial_args
+
+
+class SweepRunner:
+    """Run trials in forked processes, and prune them as they report their rung losses.
+
+    Processes are not daemonic, hence may fork their own processes (e.g., evaluation workers, and plot renderer).
+    """
+
+    def __init__(self, args: Namespace, hp_args: List[str], dataset: TrainDatasets, pruner: SuccessiveHalving):
+        self.args = args
+        self.hp_args = hp_args
+        self.dataset = dataset
+        self.pruner = pruner
+        self.ctx = multiprocessing.get_context("fork")
+        self.running: Dict[Any, Any] = {}
+        self.records: List[Dict[str, Any]] = []
+
+    def run(self, trials: List[Dict[str, Any]], max_running: int) -> None:
+        pending = list(enumerate(trials))
+        while pending or self.running:
+            while pending and len(self.running) < max_running:
+                self.start(*pending.pop(0))
+            for conn in multiprocessing.connection.wait(list(self.running)):
+                self.receive(conn)
+
+    def start(self, i: int, overrides: Dict[str, Any]) -> None:
+        name = f"trial-{i:03d}"
+        record = {"trial": name, "status": "running", **overrides}
+        conn, child_conn = self.ctx.Pipe()
+        process = self.ctx.Process(
+            target=run_trial,
+            args=(
+                child_conn,
+                name,
+                model_args(self.args, name),
+                trial_hp_args(self.hp_args, overrides),
+                self.dataset,
+                self.pruner,
+            ),
+            name=name,
+        )
+        process.start()
+        child_conn.close()
+        self.running[conn] = process, record
+        self.records.append(record)
+
+    def receive(self, conn) -> None:
+        process, record = self.running[conn]
+        try:
+            kind, *payload = conn.recv()
+        except EOFError:
+            # The trial process has exited.
+            process.join()
+            conn.close()
+            del self.running[conn]
+            if process.exitcode != 0:
+                logger.error("Trial %s failed with exit code %s", record["trial"], process.exitcode)
+                record["status"] = "failed"
+            elif record["status"] == "running":
+                record["status"] = "completed"
+            return
+
+        if kind == "rung":
+            epochs, loss = payload
+            record[f"loss@{epochs}"] = loss
+            stop = self.pruner.should_stop(epochs, loss)
+            conn.send(stop)
+            if stop:
+                logger.info("Pruned %s at epoch %d: %s=%f", record["trial"], epochs, VALIDATION_LOSS, loss)
+                record["status"] = "pruned"
+        elif kind == "done":
+            record.update(payload[0])
+
+
+def run_trial(
+    conn, name: str, args: Namespace, hp_args: List[str], dataset: TrainDatasets, pruner: SuccessiveHalving
+) -> None:
+    """Trial process: train the estimator while reporting its rung losses, then backtest it unless pruned."""
+    algo_args = override_hp(smepu.argparse.to_kwargs(hp_args), dataset.metadata)
+    estimator = new_estimator(args.algo, kwargs=algo_args)
+
+    # Estimators without a gluonts Trainer (e.g., NPTS) have no epochs, hence are never pruned.
+    reporter = RungReporter(conn, pruner, getattr(estimator, "trainer", None))
+    trainer_logger = logging.getLogger("gluonts.trainer")
+    trainer_logger.addHandler(reporter)
+    if not trainer_logger.isEnabledFor(logging.INFO):
+        trainer_logger.setLevel(logging.INFO)
+    predictor = fit(args, estimator, dataset, metric_prefix=f"{name}.")
+    trainer_logger.removeHandler(reporter)
+    if reporter.pruned:
+        return
+
+    save_model(predictor, args)
+    if args.stop_before == "eval":
+        logger.info("Early termination: before %s", args.stop_before)
+        return
+    conn.send(("done", evaluate(args, predictor, dataset, metric_prefix=f"{name}.")))
+
+
+def leaderboard(records: List[Dict[str, Any]], metric: str) -> pd.DataFrame:
+    """Trials from the best, i.e., by ascending metric, then the trials without agg_metrics (e.g., pruned)."""
+    df = pd.DataFrame(records)
+    if metric in df.columns:
+        df = df.sort_values(metric, na_position="last", kind="mergesort")
+    return df
+
+
+def add_args(parser: ArgumentParser):
+    """Configure the sweep, in addition to the hyperparameters of train.py."""
+    add_train_args(parser)
+    parser.add_argument(
+        "--search_space",
+        type=str,
+        help='JSON object of hyperparameter to its candidate values, e.g., {"trainer.learning_rate": [1e-2, 1e-3]}.',
+        default=os.environ.get("SM_HP_SEARCH_SPACE", "{}"),
+    )
+    parser.add_argument(
+        "--num_trials",
+        type=int,
+        help="Number of random trials; 0 runs the full grid of the search space.",
+        default=os.environ.get("SM_HP_NUM_TRIALS", 0),
+    )
+    parser.add_argument(
+        "--sweep_seed", type=int, help="Seed of the random trials.", default=os.environ.get("SM_HP_SWEEP_SEED", 0)
+    )
+    parser.add_argument(
+        "--min_epochs",
+        type=int,
+        help="Epochs of the first rung of successive halving.",
+        default=os.environ.get("SM_HP_MIN_EPOCHS", 1),
+    )
+    parser.add_argument(
+        "--eta",
+        type=int,
+        help="Reduction factor of successive halving, i.e., about 1/eta of the trials survive each rung.",
+        default=os.environ.get("SM_HP_ETA", 3),
+    )
+    parser.add_argument(
+        "--sweep_workers",
+        type=int,
+        help="Number of concurrent trials; 0 plans one trial per one or two physical cores.",
+        default=os.environ.get("SM_HP_SWEEP_WORKERS", 0),
+    )
+    parser.add_argument(
+        "--sweep_metric",
+        type=str,
+        help="Metric of agg_metrics to rank the trials, the lower the better.",
+        default=os.environ.get("SM_HP_SWEEP_METRIC", "wMAPE"),
+    )
+
+
+if __name__ == "__main__":
+    # Minimal argparser for SageMaker protocols
+    parser = smepu.argparse.sm_protocol(channels=["s3_dataset"])
+    add_args(parser)
+
+    logger.info("CLI args to sweep script: %s", sys.argv)
+    args, hp_args = parser.parse_known_args()
+
+    sweep(args, hp_args)
@@ -2,21 +2,33 @@ import smepu
 
 import inspect
 import json
+import multiprocessing
+import multiprocessing.connection
 import os
+import shlex
+import shutil
 import sys
 import warnings
 from argparse import ArgumentParser, Namespace
+from functools import partial
 from pathlib import Path
 from pydoc import locate
-from typing import Any, Dict
+from typing import Any, Callable, Dict, List, Tuple
 
 import matplotlib.cbook
 import numpy as np
 from gluonts.dataset.common import TrainDatasets, load_datasets
 from gluonts.dataset.repository import datasets
 from gluonts.evaluation import backtest
+from gluonts.model.predictor import Predictor
 
+from gluonts_example.aggregator import ItemMetricsWriter
+from gluonts_example.artifact import ARTIFACT, export_artifact
+from gluonts_example.checkpoint import EvalCheckpoint
 from gluonts_example.evaluator import MyEvaluator
+from gluonts_example.mmap_dataset import load_cached_datasets, shared_datasets
+from gluonts_example.results import RESULTS_FORMATS
+from gluonts_example.telemetry import timed_training
 from gluonts_example.util import clip_to_zero, expm1_and_clip_to_zero, freq_name, log1p_tds, mkdir, override_hp
 
 warnings.filterwarnings("ignore", category=matplotlib.cbook.mplDeprecation)
@@ -31,10 +43,40 @@ INVERSE = {
 
 
 def train(args: Namespace, algo_args: Dict[str, Any]) -> None:
-    """Train a specified estimator on a specified dataset."""
+    """Train a specified estimator (or several, see --algos) on a specified dataset."""
     dataset = load_dataset(args)
+    if args.y_transform == "log1p":
+        dataset = log1p_tds(dataset)
+
+    if args.algos:
+        train_many(args, algo_args, dataset)
+    else:
+        fit_and_backtest(args, args.algo, algo_args, dataset)
+
+
+def train_many(args: Namespace, algo_args: Dict[str, Any], dataset: TrainDatasets) -> None:
+    """Train and backtest several estimators concurrently, each in its own forked process.
+
+    The (transformed) dataset is materialized once into shared memory, which the processes inherit. Each estimator
+    writes to its own subdirectory of model_dir, output_data_dir, and eval_checkpoint_dir, named after the estimator.
+    """
+    specs = parse_algos(args.algos, algo_args)
+    with shared_datasets(dataset) as dataset:
+        targets = {
+            name: partial(fit_and_backtest, model_args(args, name), algo, kwargs, dataset, metric_prefix=f"{name}.")
+            for name, (algo, kwargs) in specs.items()
+        }
+        failed = run_processes(targets, args.algo_workers if args.algo_workers > 0 else len(targets))
+    if failed:
+        raise RuntimeError(f"Failed estimators: {failed}")
+
+
+def fit_and_backtest(
+    args: Namespace, algo: str, algo_args: Dict[str, Any], dataset: TrainDatasets, metric_prefix: str = ""
+) -> None:
+    """Train an estimator on a (transformed) dataset, then backtest it."""
     algo_args = override_hp(algo_args, dataset.metadata)
-    estimator = new_estimator(args.algo, kwargs=algo_args)
+    estimator = new_estimator(algo, kwargs=algo_args)
 
     # Debug/dev/test milestone
     if args.stop_before == "train":
@@ -42,12 +84,7 @@ def train(args: Namespace, algo_args: Dict[str, Any]) -> None:
         return
 
     # Train & save model
-    logger.info("Starting model training.")
-    if args.y_transform == "log1p":
-        dataset = log1p_tds(dataset)
-    train_kwargs = get_train_kwargs(estimator, dataset)
-    predictor = estimator.train(**train_kwargs)
-    predictor.output_transform = INVERSE[args.y_transform]
+    predictor = fit(args, estimator, dataset, metric_prefix)
     save_model(predictor, args)
 
     # Debug/dev/test milestone
@@ -55,46 +92,151 @@ def train(args: Namespace, algo_args: Dict[str, Any]) -> None:
         logger.info("Early termination: before %s", args.stop_before)
         return
 
-    # Backtesting
+    evaluate(args, predictor, dataset, metric_prefix)
+
+
+def fit(args: Namespace, estimator, dataset: TrainDatasets, metric_prefix: str = "") -> Predictor:
+    """Train an estimator on a (transformed) dataset, and return its predictor of the original (i.e., inverse
+    transformed) target.
+
+    The training throughput and peak memory are logged as metrics, and saved to output_data_dir/training_metrics.json.
+    With a checkpoint directory, a restarted job (e.g., after a spot interruption) reuses the checkpointed model rather
+    than retraining, so that the resumed evaluation is of the same model.
+    """
+    logger.info("Starting model training.")
+    checkpoint_dir = Path(args.eval_checkpoint_dir) if args.eval_checkpoint_dir else None
+    if checkpoint_dir is not None and (checkpoint_dir / "model").exists():
+        logger.info("Reusing the model checkpointed at %s", checkpoint_dir / "model")
+        predictor = Predictor.deserialize(checkpoint_dir / "model")
+    else:
+        train_kwargs = get_train_kwargs(estimator, dataset)
+        with timed_training(estimator, metric_prefix) as training_metrics:
+            predictor = estimator.train(**train_kwargs)
+        if training_metrics is not None:
+            training_metrics.log(logger)
+            training_metrics.save(mkdir(args.output_data_dir) / "training_metrics.json")
+        if checkpoint_dir is not None:
+            checkpoint_model(predictor, checkpoint_dir)
+    predictor.output_transform = INVERSE[args.y_transform]
+    return predictor
+
+
+def evaluate(args: Namespace, predictor: Predictor, dataset: TrainDatasets, metric_prefix: str = "") -> Dict[str, Any]:
+    """Backtest a predictor on the test split, write its outputs to output_data_dir, and return the agg_metrics.
+
+    With a checkpoint directory, outputs are written there, and timeseries evaluated before a restart are neither
+    predicted nor evaluated again.
+    """
     logger.info("Starting model evaluation.")
+    checkpoint_dir = Path(args.eval_checkpoint_dir) if args.eval_checkpoint_dir else None
+    metrics_output_dir = Path(args.output_data_dir)
+    checkpoint = EvalCheckpoint(checkpoint_dir / "eval") if checkpoint_dir is not None else None
+    if checkpoint is not None:
+        logger.info("Resuming evaluation after %d timeseries", checkpoint.num_series)
+        eval_output_dir, test_dataset = checkpoint.path, checkpoint.skip_evaluated(dataset.test)
+    else:
+        eval_output_dir, test_dataset = metrics_output_dir, dataset.test
     forecast_it, ts_it = backtest.make_evaluation_predictions(
-        dataset=dataset.test, predictor=predictor, num_samples=args.num_samples,
+        dataset=test_dataset, predictor=predictor, num_samples=args.num_samples,
     )
 
     # Compute standard metrics over all samples or quantiles, and plot each timeseries, all in one go!
     # Remember to specify gt_inverse_transform when computing metrics.
     logger.info("MyEvaluator: assume non-negative ground truths, hence no clip_to_zero performed on them.")
     gt_inverse_transform = np.expm1 if args.y_transform == "log1p" else None
+
+    # Item metrics are appended to their files as soon as they are computed.
+    # Specific requirement: output wmape to a separate file.
+    warnings.warn(
+        "wmape csv uses daily or weekly according to frequency string, "
+        "hence 7D still results in daily rather than weekly."
+    )
+    item_writers = [
+        ItemMetricsWriter(eval_output_dir / f"item_metrics.{args.item_metrics_format}"),
+        ItemMetricsWriter(
+            eval_output_dir / f"{freq_name(dataset.metadata.freq)}-wmapes.csv",
+            columns={"item_id": "category", "wMAPE": "test_wMAPE"},
+        ),
+    ]
+
     evaluator = MyEvaluator(
-        out_dir=Path(args.output_data_dir),
+        out_dir=eval_output_dir,
         quantiles=args.quantiles,
         plot_transparent=bool(args.plot_transparent),
         gt_inverse_transform=gt_inverse_transform,
         clip_at_zero=True,
+        num_workers=args.eval_workers,
+        batch_size=args.eval_batch_size,
+        plot=args.plot,
+        item_writers=item_writers,
+        results_format=args.results_format,
+        checkpoint=checkpoint,
     )
-    agg_metrics, item_metrics = evaluator(ts_it, forecast_it, num_series=len(dataset.test))
+    agg_metrics, _ = evaluator(ts_it, forecast_it, num_series=len(test_dataset))
+    if checkpoint is not None:
+        checkpoint.export(metrics_output_dir)
 
     # required for metric tracking.
     for name, value in agg_metrics.items():
-        logger.info(f"gluonts[metric-{name}]: {value}")
+        logger.info(f"gluonts[metric-{metric_prefix}{name}]: {value}")
 
     # save the evaluation results
-    metrics_output_dir = Path(args.output_data_dir)
     with open(metrics_output_dir / "agg_metrics.json", "w") as f:
         json.dump(agg_metrics, f)
-    with open(metrics_output_dir / "item_metrics.csv", "w") as f:
-        item_metrics.to_csv(f, index=False)
+    return agg_metrics
 
-    # Specific requirement: output wmape to a separate file.
-    with open(metrics_output_dir / f"{freq_name(dataset.metadata.freq)}-wmapes.csv", "w") as f:
-        warnings.warn(
-            "wmape csv uses daily or weekly according to frequency string, "
-            "hence 7D still results in daily rather than weekly."
-        )
-        wmape_metrics = item_metrics[["item_id", "wMAPE"]].rename(
-            {"item_id": "category", "wMAPE": "test_wMAPE"}, axis=1
-        )
-        wmape_metrics.to_csv(f, index=False)
+
+def parse_algos(algos: str, algo_args: Dict[str, Any]) -> Dict[str, Tuple[str, Dict[str, Any]]]:
+    """Parse --algos to {name: (estimator class, hyperparameters)}.
+
+    --algos is a JSON object of name to the CLI arguments of an estimator, e.g., '{"deepar": "--algo
+    gluonts.model.deepar.DeepAREstimator --trainer.epochs 10", "npts": "--algo gluonts.model.npts.NPTSEstimator"}'. The
+    hyperparameters given to this script (i.e., algo_args) are common to all estimators, unless overridden.
+    """
+    parser = ArgumentParser()
+    parser.add_argument("--algo", type=str, required=True)
+    specs = {}
+    for name, cli_args in json.loads(algos).items():
+        if not name or os.sep in name:
+            raise ValueError(f"Invalid estimator name: {name!r}")
+        spec, hp_args = parser.parse_known_args(shlex.split(cli_args))
+        specs[name] = spec.algo, {**algo_args, **smepu.argparse.to_kwargs(hp_args)}
+    return specs
+
+
+def model_args(args: Namespace, name: str) -> Namespace:
+    """Args of one of several estimators, i.e., with output directories specific to the estimator."""
+    overrides = {
+        "model_dir": os.path.join(args.model_dir, name),
+        "output_data_dir": os.path.join(args.output_data_dir, name),
+    }
+    if args.eval_checkpoint_dir:
+        overrides["eval_checkpoint_dir"] = os.path.join(args.eval_checkpoint_dir, name)
+    return Namespace(**{**vars(args), **overrides})
+
+
+def run_processes(targets: Dict[str, Callable[[], Any]], max_running: int) -> List[str]:
+    """Run each target in a forked process, at most max_running at a time, then return the names of failed targets.
+
+    Processes are not daemonic, hence may fork their own processes (e.g., evaluation workers, and plot renderer).
+    """
+    ctx = multiprocessing.get_context("fork")
+    pending = list(targets.items())
+    running: Dict[str, Any] = {}
+    failed = []
+    while pending or running:
+        while pending and len(running) < max_running:
+            name, target = pending.pop(0)
+            running[name] = ctx.Process(target=target, name=name)
+            running[name].start()
+        multiprocessing.connection.wait([p.sentinel for p in running.values()])
+        for name, p in list(running.items()):
+            if p.exitcode is not None:
+                del running[name]
+                if p.exitcode != 0:
+                    logger.error("Estimator %s failed with exit code %s", name, p.exitcode)
+                    failed.append(name)
+    return failed
 
 
 def load_dataset(args: Namespace) -> TrainDatasets:
@@ -107,9 +249,15 @@ def load_dataset(args: Namespace) -> TrainDatasets:
         # load custom dataset
         logger.info("Loading dataset from %s", args.s3_dataset)
         s3_dataset_dir = Path(args.s3_dataset)
-        dataset = load_datasets(
-            metadata=s3_dataset_dir / "metadata", train=s3_dataset_dir / "train", test=s3_dataset_dir / "test",
-        )
+        if args.dataset_cache:
+            # Parse the JSON lines only once across jobs that share the cache directory.
+            dataset = load_cached_datasets(
+                s3_dataset_dir / "metadata", s3_dataset_dir / "train", s3_dataset_dir / "test", args.dataset_cache,
+            )
+        else:
+            dataset = load_datasets(
+                metadata=s3_dataset_dir / "metadata", train=s3_dataset_dir / "train", test=s3_dataset_dir / "test",
+            )
     return dataset
 
 
@@ -144,6 +292,20 @@ def save_model(predictor, args: Namespace):
         inverse = INVERSE[args.y_transform]
         f.write('{"transform": "%s", "inverse_transform": "%s"}\n' % (args.y_transform, inverse.__name__))
 
+    # Optional single-file artifact, which model_fn() prefers as it loads faster.
+    if args.export_artifact:
+        y_transform = {"transform": args.y_transform, "inverse_transform": inverse.__name__}
+        export_artifact(predictor, os.path.join(args.model_dir, ARTIFACT), y_transform)
+
+
+def checkpoint_model(predictor, checkpoint_dir: Path) -> None:
+    """Atomically save the trained model to checkpoint_dir/model, and discard the evaluation of any previous model."""
+    shutil.rmtree(checkpoint_dir / "eval", ignore_errors=True)
+    tmp = checkpoint_dir / ".model.tmp"
+    shutil.rmtree(tmp, ignore_errors=True)
+    predictor.serialize(mkdir(tmp))
+    os.replace(tmp, checkpoint_dir / "model")
+
 
 def add_args(parser: ArgumentParser):
     """Configure hyperparameters captured by this entrypoint script."""
@@ -159,6 +321,12 @@ def add_args(parser: ArgumentParser):
         help="When s3_dataset channel not specified, fallback to this public dataset.",
         default=os.environ.get("SM_HP_DATASET", ""),
     )
+    parser.add_argument(
+        "--dataset_cache",
+        type=str,
+        help="Directory to cache s3_dataset as memory-mapped binary arrays; empty to disable.",
+        default=os.environ.get("SM_HP_DATASET_CACHE", ""),
+    )
     parser.add_argument(
         "--y_transform",
         type=str,
@@ -177,12 +345,70 @@ def add_args(parser: ArgumentParser):
         help="Quantiles for backtesting",
         default=os.environ.get("SM_HP_QUANTILES", [0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.9]),
     )
+    parser.add_argument(
+        "--export_artifact",
+        type=int,
+        help="Whether to also save the model as a single file, which the inference entrypoint loads faster.",
+        default=os.environ.get("SM_HP_EXPORT_ARTIFACT", 0),
+    )
     parser.add_argument(
         "--plot_transparent",
         type=int,
         help="Whether plots use transparent background.",
         default=os.environ.get("SM_HP_PLOT_TRANSPARENT", 0),
     )
+    parser.add_argument(
+        "--plot",
+        type=str,
+        help='Which timeseries to plot: "all", "none", "random:N", or "worst:N" (by wMAPE).',
+        default=os.environ.get("SM_HP_PLOT", "all"),
+    )
+    parser.add_argument(
+        "--results_format",
+        type=str,
+        help="Format of the forecast results.",
+        default=os.environ.get("SM_HP_RESULTS_FORMAT", "jsonl"),
+        choices=list(RESULTS_FORMATS),
+    )
+    parser.add_argument(
+        "--item_metrics_format",
+        type=str,
+        help="Format of item_metrics.",
+        default=os.environ.get("SM_HP_ITEM_METRICS_FORMAT", "csv"),
+        choices=["csv", "parquet"],
+    )
+    parser.add_argument(
+        "--eval_workers",
+        type=int,
+        help="Number of processes to compute backtest metrics; 0 computes them in the main process.",
+        default=os.environ.get("SM_HP_EVAL_WORKERS", 0),
+    )
+    parser.add_argument(
+        "--eval_batch_size",
+        type=int,
+        help="Number of timeseries per vectorized computation of backtest metrics; 0 computes them one at a time.",
+        default=os.environ.get("SM_HP_EVAL_BATCH_SIZE", 0),
+    )
+    parser.add_argument(
+        "--eval_checkpoint_dir",
+        type=str,
+        help="Directory to checkpoint the model and backtest (e.g., /opt/ml/checkpoints), so that a restarted job "
+        "resumes the backtest; empty to disable. Requires csv item_metrics, and jsonl or jsonl.gz results.",
+        default=os.environ.get("SM_HP_EVAL_CHECKPOINT_DIR", ""),
+    )
+    parser.add_argument(
+        "--algos",
+        type=str,
+        help="JSON object of name to CLI arguments of an estimator, to train and backtest several estimators "
+        "concurrently (see parse_algos()); empty to train --algo only.",
+        default=os.environ.get("SM_HP_ALGOS", ""),
+    )
+    parser.add_argument(
+        "--algo_workers",
+        type=int,
+        help="Number of estimators of --algos to train concurrently; 0 trains all of them concurrently.",
+        default=os.environ.get("SM_HP_ALGO_WORKERS", 0),
+    )
     parser.add_argument("--stop_before", type=str, help="For debug/dev/test", default="", choices=["", "train", "eval"])
 
 
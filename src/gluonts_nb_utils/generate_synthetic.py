@@ -1,4 +1,5 @@
 import csv
+import json
 from pathlib import Path
 from typing import Any, Dict, List, Optional, Sequence, TextIO, Union
 
@@ -117,3 +118,21 @@ def _write_timeseries(
             csv_writer.writerow(row)
 
         timestamp += time_delta
+
+
+def generate_json_lines(artificial_dataset: ArtificialDataset, ts_prefix: str = "") -> str:
+    """Serialize the test split of `artifical_dataset` to JSON lines, i.e., a request body of the inference endpoint.
+
+    Handy to build synthetic payloads of any number of timeseries and length, e.g., to benchmark the endpoint.
+    """
+    lines = []
+    for timeseries in artificial_dataset.test:
+        d = {
+            FieldName.START: str(timeseries[FieldName.START]),
+            FieldName.TARGET: [float(v) for v in timeseries[FieldName.TARGET]],
+        }
+        if FieldName.FEAT_STATIC_CAT in timeseries:
+            d[FieldName.FEAT_STATIC_CAT] = [int(v) for v in timeseries[FieldName.FEAT_STATIC_CAT]]
+        d[FieldName.ITEM_ID] = f"{ts_prefix}{timeseries[FieldName.ITEM_ID]}"
+        lines.append(json.dumps(d))
+    return "\n".join(lines)
@@ -0,0 +1,198 @@
+"""Micro-benchmark of the inference entrypoint, stage by stage.
+
+Time _input_fn(), _predict_fn(), _output_fn(), and the end-to-end transform_fn() of src/entrypoint/inference.py on a
+synthetic payload, then report the throughput (timeseries/s) and peak traced memory of each stage.
+
+Sample usage:
+    # Benchmark a NPTS model on 1000 timeseries, then save the results as the baseline.
+    python test/benchmark_inference.py --num_series 1000 --length 200 --num_samples 100 --output baseline.json
+
+    # Compare the input stage of a log1p model, with and without the y-transform fused into parsing.
+    python test/benchmark_inference.py --y_transform log1p --num_series 1000 --length 200
+
+    # Later on, fail (i.e., exit code 1) when a stage is >20% slower or uses >20% more memory than the baseline.
+    python test/benchmark_inference.py --num_series 1000 --length 200 --num_samples 100 --baseline baseline.json
+
+Numbers are only comparable across runs with the same arguments on the same kind of host.
+"""
+import argparse
+import importlib.util
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+from typing import Any, Callable, Dict, List
+
+ROOT_DIR = Path(__file__).resolve().parent.parent
+sys.path[:0] = [str(ROOT_DIR / "src" / "entrypoint"), str(ROOT_DIR / "src")]
+
+from gluonts.dataset.artificial import ComplexSeasonalTimeSeries  # noqa: E402
+from gluonts.dataset.common import ListDataset  # noqa: E402
+from gluonts.model.npts import NPTSPredictor  # noqa: E402
+
+from gluonts_example.serde import iter_json_lines  # noqa: E402
+from gluonts_nb_utils.generate_synthetic import generate_json_lines  # noqa: E402
+
+STAGES = ("input_fn", "predict_fn", "output_fn", "transform_fn")
+
+# Only for models with a forward y-transform: the input stage up to the predictor-ready timeseries, with the transform
+# applied as a separate pass over a ListDataset, versus fused into parsing.
+PRE_TRANSFORM_STAGES = ("input_then_pre_transform", "input_fused_pre_transform")
+
+
+def import_inference() -> Any:
+    """Import the inference entrypoint as a module, the same way test_inference.py does."""
+    spec = importlib.util.spec_from_file_location("gluonts_inference", ROOT_DIR / "src" / "entrypoint" / "inference.py")
+    mod = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(mod)  # type: ignore
+    return mod
+
+
+def new_npts_model(model_dir: str, prediction_length: int, freq: str, y_transform: str = "noop") -> None:
+    """Save an (untrained) NPTS predictor in the layout that the train script produces."""
+    NPTSPredictor(prediction_length=prediction_length, freq=freq).serialize(Path(model_dir))
+    inverse = "expm1_and_clip_to_zero" if y_transform == "log1p" else "clip_to_zero"
+    with open(os.path.join(model_dir, "y_transform.json"), "w") as f:
+        f.write('{"transform": "%s", "inverse_transform": "%s"}\n' % (y_transform, inverse))
+
+
+def synthetic_payload(num_series: int, length: int, prediction_length: int, freq: str) -> str:
+    dataset = ComplexSeasonalTimeSeries(
+        num_series=num_series,
+        prediction_length=prediction_length,
+        freq_str=freq,
+        length_low=length,
+        length_high=length + 1,
+        min_val=0,
+        max_val=1000,
+    )
+    return generate_json_lines(dataset)
+
+
+def measure(fn: Callable[[], Any], num_series: int, repeat: int) -> Dict[str, float]:
+    """Median wall time over repeat runs, and peak traced memory (total and per timeseries) of one more run."""
+    seconds: List[float] = []
+    for _ in range(repeat):
+        tic = time.perf_counter()
+        fn()
+        seconds.append(time.perf_counter() - tic)
+
+    tracemalloc.start()
+    fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    median = statistics.median(seconds)
+    return {
+        "seconds": median,
+        "series_per_s": num_series / median,
+        "peak_mb": peak / 2**20,
+        "peak_kb_per_series": peak / 2**10 / num_series,
+    }
+
+
+def benchmark(args: argparse.Namespace) -> Dict[str, Any]:
+    inference = import_inference()
+    model = inference.model_fn(args.model_dir)
+    prediction_length = model.prediction_length
+    body = synthetic_payload(args.num_series, args.length, prediction_length, model.freq).encode("utf-8")
+
+    # Inputs of each stage are prepared once, outside of the timed runs.
+    entries = inference._input_fn(body)
+    forecasts = inference._predict_fn(entries, model, num_samples=args.num_samples)
+    stage_fns = {
+        "input_fn": lambda: inference._input_fn(body),
+        "predict_fn": lambda: inference._predict_fn(entries, model, num_samples=args.num_samples),
+        "output_fn": lambda: inference._output_fn(forecasts),
+        "transform_fn": lambda: inference.transform_fn(model, body, num_samples=args.num_samples),
+    }
+    if model.pre_input_transform is not None:
+        stage_fns["input_then_pre_transform"] = lambda: separate_pre_transform(inference, model, body)
+        stage_fns["input_fused_pre_transform"] = lambda: list(
+            ListDataset(iter_json_lines(body, model.pre_input_ufunc), freq=model.freq)
+        )
+
+    stages = {}
+    for stage in [stage for stage in STAGES + PRE_TRANSFORM_STAGES if stage in stage_fns]:
+        stages[stage] = measure(stage_fns[stage], args.num_series, args.repeat)
+        print(
+            f"{stage:>12}: {stages[stage]['seconds']:.4f}s, {stages[stage]['series_per_s']:.1f} series/s, "
+            f"peak {stages[stage]['peak_mb']:.1f} MiB ({stages[stage]['peak_kb_per_series']:.2f} KiB/series)"
+        )
+
+    return {
+        "config": {
+            "num_series": args.num_series,
+            "length": args.length,
+            "num_samples": args.num_samples,
+            "y_transform": args.y_transform,
+            "prediction_length": prediction_length,
+            "payload_bytes": len(body),
+        },
+        "stages": stages,
+    }
+
+
+def separate_pre_transform(inference: Any, model: Any, body: bytes) -> List[Dict[str, Any]]:
+    X = ListDataset(inference._input_fn(body), freq=model.freq)
+    model.pre_input_transform(X)
+    return list(X)
+
+
+def compare(results: Dict[str, Any], baseline: Dict[str, Any], tolerance: float) -> List[str]:
+    """Describe every stage that is slower, or uses more memory, than the baseline by more than tolerance."""
+    if results["config"] != baseline["config"]:
+        print("WARNING: benchmark config differs from the baseline:", baseline["config"])
+
+    regressions = []
+    for stage, base in baseline["stages"].items():
+        if stage not in results["stages"]:
+            continue
+        for metric in ("seconds", "peak_mb"):
+            value, limit = results["stages"][stage][metric], base[metric] * (1 + tolerance)
+            if value > limit:
+                regressions.append(f"{stage} {metric}: {value:.4f} > {base[metric]:.4f} (+{tolerance:.0%})")
+    return regressions
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--model_dir", type=str, default="", help="Default to an untrained NPTS model.")
+    parser.add_argument("--prediction_length", type=int, default=14, help="Prediction length of the NPTS model.")
+    parser.add_argument("--freq", type=str, default="D", help="Frequency of the NPTS model.")
+    parser.add_argument("--y_transform", type=str, default="noop", choices=["noop", "log1p"], help="Of the NPTS model.")
+    parser.add_argument("--num_series", type=int, default=1000)
+    parser.add_argument("--length", type=int, default=200, help="Length of each timeseries.")
+    parser.add_argument("--num_samples", type=int, default=100)
+    parser.add_argument("--repeat", type=int, default=3, help="Number of timed runs per stage.")
+    parser.add_argument("--output", type=str, default="", help="Save results to this JSON file.")
+    parser.add_argument("--baseline", type=str, default="", help="Compare results to this JSON file.")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed relative regression.")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        if not args.model_dir:
+            args.model_dir = tmp_dir
+            new_npts_model(tmp_dir, args.prediction_length, args.freq, args.y_transform)
+        results = benchmark(args)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for regression in regressions:
+            print("REGRESSION:", regression)
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,138 @@
+"""Benchmark the cold start of the inference entrypoint: serialized predictor directory vs single-file artifact.
+
+Each timed run is a fresh Python process, which imports the inference entrypoint, then loads the model with model_fn()
+and forecasts one synthetic timeseries. The load and first-forecast time of the model directory as the train script
+saves it (i.e., Predictor.deserialize()) are compared with those of the same model exported as a single-file artifact
+(see src/entrypoint/gluonts_example/artifact.py). As the artifact loads its network on first use, the first-forecast
+time is the one to compare.
+
+Sample usage:
+    # Benchmark a small DeepAR model, trained for one batch on synthetic data.
+    python test/benchmark_model_load.py
+
+    # Benchmark a model saved by the train script, with 10 runs per variant.
+    python test/benchmark_model_load.py --model_dir test/refdata/model --repeat 10 --output load.json
+
+Numbers are only comparable across runs with the same arguments on the same kind of host.
+"""
+import argparse
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Any, Dict, List
+
+ROOT_DIR = Path(__file__).resolve().parent.parent
+sys.path[:0] = [str(ROOT_DIR / "src" / "entrypoint"), str(ROOT_DIR / "src")]
+
+from gluonts.dataset.artificial import ComplexSeasonalTimeSeries  # noqa: E402
+from gluonts.model.deepar import DeepAREstimator  # noqa: E402
+from gluonts.model.predictor import Predictor  # noqa: E402
+from gluonts.trainer import Trainer  # noqa: E402
+
+from gluonts_example.artifact import ARTIFACT, export_artifact  # noqa: E402
+
+# Run in each fresh process. The inference entrypoint is imported by file, the same way test_inference.py does.
+CHILD = """
+import json, sys, time
+tic = time.perf_counter()
+import importlib.util
+sys.path[:0] = [{entrypoint!r}]
+spec = importlib.util.spec_from_file_location("gluonts_inference", {inference!r})
+inference = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(inference)
+from gluonts_example.serving import predict, synthetic_request
+imported = time.perf_counter()
+model = inference.model_fn({model_dir!r})
+loaded = time.perf_counter()
+list(predict(synthetic_request(model), model, num_samples=1))
+forecasted = time.perf_counter()
+print(json.dumps({{"import": imported - tic, "load": loaded - imported, "first_forecast": forecasted - imported}}))
+"""
+
+
+def new_deepar_model(model_dir: str, prediction_length: int, freq: str) -> None:
+    """Save a DeepAR predictor (trained on one batch of synthetic data) in the layout that the train script produces."""
+    dataset = ComplexSeasonalTimeSeries(num_series=8, prediction_length=prediction_length, freq_str=freq).generate()
+    estimator = DeepAREstimator(
+        freq=freq, prediction_length=prediction_length, trainer=Trainer(epochs=1, num_batches_per_epoch=1)
+    )
+    estimator.train(dataset.train).serialize(Path(model_dir))
+    with open(os.path.join(model_dir, "y_transform.json"), "w") as f:
+        f.write('{"transform": "noop", "inverse_transform": "clip_to_zero"}\n')
+
+
+def new_artifact_model(model_dir: str, artifact_dir: str) -> None:
+    """Copy y_transform.json of model_dir to artifact_dir, with model_dir's predictor exported as an artifact."""
+    os.makedirs(artifact_dir)
+    shutil.copy(os.path.join(model_dir, "y_transform.json"), artifact_dir)
+    with open(os.path.join(model_dir, "y_transform.json")) as f:
+        y_transform = json.load(f)
+    export_artifact(Predictor.deserialize(Path(model_dir)), os.path.join(artifact_dir, ARTIFACT), y_transform)
+
+
+def cold_start(model_dir: str) -> Dict[str, float]:
+    """Seconds to import the entrypoint, to load the model, and to load then forecast, in a fresh process."""
+    code = CHILD.format(
+        entrypoint=str(ROOT_DIR / "src" / "entrypoint"),
+        inference=str(ROOT_DIR / "src" / "entrypoint" / "inference.py"),
+        model_dir=model_dir,
+    )
+    # No warm-up request, which would load the network of the artifact within model_fn().
+    env = {**os.environ, "INFERENCE_WARMUP": "0"}
+    out = subprocess.run([sys.executable, "-c", code], env=env, check=True, stdout=subprocess.PIPE).stdout
+    return json.loads(out.decode().strip().splitlines()[-1])
+
+
+def benchmark(model_dirs: Dict[str, str], repeat: int) -> Dict[str, Any]:
+    results: Dict[str, Any] = {}
+    for variant, model_dir in model_dirs.items():
+        runs: List[Dict[str, float]] = [cold_start(model_dir) for _ in range(repeat)]
+        results[variant] = {k: statistics.median(run[k] for run in runs) for k in runs[0]}
+        print(
+            f"{variant:>9}: import {results[variant]['import']:.3f}s, load {results[variant]['load']:.3f}s, "
+            f"first forecast {results[variant]['first_forecast']:.3f}s (median of {repeat})"
+        )
+
+    base, new = results["directory"]["first_forecast"], results["artifact"]["first_forecast"]
+    results["speedup"] = base / new
+    print(f"Artifact saves {base - new:.3f}s of the first forecast, i.e., {base / new:.2f}x faster.")
+    return results
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--model_dir", type=str, default="", help="Default to a DeepAR trained on synthetic data.")
+    parser.add_argument("--prediction_length", type=int, default=14, help="Prediction length of the DeepAR model.")
+    parser.add_argument("--freq", type=str, default="D", help="Frequency of the DeepAR model.")
+    parser.add_argument("--repeat", type=int, default=5, help="Number of fresh processes per variant.")
+    parser.add_argument("--output", type=str, default="", help="Save results to this JSON file.")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        # Without any artifact, so that model_fn() deserializes the directory.
+        model_dir = os.path.join(tmp_dir, "directory")
+        if args.model_dir:
+            shutil.copytree(args.model_dir, model_dir, ignore=shutil.ignore_patterns(ARTIFACT))
+        else:
+            os.makedirs(model_dir)
+            new_deepar_model(model_dir, args.prediction_length, args.freq)
+        artifact_dir = os.path.join(tmp_dir, "artifact")
+        tic = time.perf_counter()
+        new_artifact_model(model_dir, artifact_dir)
+        print(f"Exported the artifact in {time.perf_counter() - tic:.3f}s")
+        results = benchmark({"directory": model_dir, "artifact": artifact_dir}, args.repeat)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
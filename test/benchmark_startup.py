@@ -0,0 +1,158 @@
+"""Benchmark the startup of the inference entrypoint: the import of src/entrypoint/inference.py, then model_fn().
+
+Each timed run is a fresh Python process, as the model server starts one, so nothing is already imported or cached. The
+heavy modules (gluonts, mxnet, pandas, matplotlib, ...) loaded by each step are reported too, as lazily importing them
+is what keeps the startup short: importing the entrypoint loads none of them, nor does model_fn() of a single-file
+artifact without warm-up (see src/entrypoint/gluonts_example/artifact.py), whose predictor loads on the first request.
+
+Sample usage:
+    # Benchmark a NPTS model, then save the results as the baseline.
+    python test/benchmark_startup.py --repeat 10 --output baseline.json
+
+    # Benchmark the same model exported as an artifact, without the warm-up request in model_fn().
+    python test/benchmark_startup.py --artifact --warmup 0
+
+    # Later on, fail (i.e., exit code 1) when a step is >20% slower than the baseline, or loads more heavy modules.
+    python test/benchmark_startup.py --repeat 10 --baseline baseline.json
+
+Numbers are only comparable across runs with the same arguments on the same kind of host.
+"""
+import argparse
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+from typing import Any, Dict, List
+
+ROOT_DIR = Path(__file__).resolve().parent.parent
+STEPS = ("import", "model_fn")
+
+# Top-level packages whose import dominates the startup time.
+HEAVY_MODULES = ("gluonts", "mxnet", "pandas", "scipy", "matplotlib", "pydantic")
+
+# Run in each fresh process. The inference entrypoint is imported by file, the same way test_inference.py does.
+CHILD = """
+import json, sys, time
+heavy = {heavy!r}
+def loaded():
+    return sorted({{name.split(".")[0] for name in sys.modules}} & set(heavy))
+tic = time.perf_counter()
+import importlib.util
+sys.path[:0] = [{entrypoint!r}]
+spec = importlib.util.spec_from_file_location("gluonts_inference", {inference!r})
+inference = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(inference)
+imported = time.perf_counter()
+modules = {{"import": loaded()}}
+inference.model_fn({model_dir!r})
+modules["model_fn"] = loaded()
+seconds = {{"import": imported - tic, "model_fn": time.perf_counter() - imported}}
+print(json.dumps({{"seconds": seconds, "modules": modules}}))
+"""
+
+
+def cold_start(model_dir: str, warmup: bool) -> Dict[str, Any]:
+    """Seconds to import the entrypoint and to run model_fn() in a fresh process, and the heavy modules each loads."""
+    code = CHILD.format(
+        heavy=HEAVY_MODULES,
+        entrypoint=str(ROOT_DIR / "src" / "entrypoint"),
+        inference=str(ROOT_DIR / "src" / "entrypoint" / "inference.py"),
+        model_dir=model_dir,
+    )
+    env = {**os.environ, "INFERENCE_WARMUP": str(int(warmup))}
+    out = subprocess.run([sys.executable, "-c", code], env=env, check=True, stdout=subprocess.PIPE).stdout
+    return json.loads(out.decode().strip().splitlines()[-1])
+
+
+def new_model(model_dir: str, args: argparse.Namespace) -> None:
+    """Copy args.model_dir (default to a NPTS model) to model_dir, with or without a single-file artifact."""
+    sys.path[:0] = [str(ROOT_DIR / "test"), str(ROOT_DIR / "src" / "entrypoint"), str(ROOT_DIR / "src")]
+    from gluonts_example.artifact import ARTIFACT, export_artifact
+
+    if args.model_dir:
+        shutil.copytree(args.model_dir, model_dir, ignore=shutil.ignore_patterns(ARTIFACT))
+    else:
+        from benchmark_inference import new_npts_model
+
+        os.makedirs(model_dir)
+        new_npts_model(model_dir, args.prediction_length, args.freq)
+
+    if args.artifact:
+        from gluonts.model.predictor import Predictor
+
+        with open(os.path.join(model_dir, "y_transform.json")) as f:
+            y_transform = json.load(f)
+        export_artifact(Predictor.deserialize(Path(model_dir)), os.path.join(model_dir, ARTIFACT), y_transform)
+
+
+def benchmark(model_dir: str, args: argparse.Namespace) -> Dict[str, Any]:
+    runs: List[Dict[str, Any]] = [cold_start(model_dir, bool(args.warmup)) for _ in range(args.repeat)]
+    results: Dict[str, Any] = {
+        "config": {k: v for k, v in vars(args).items() if k not in ("output", "baseline", "tolerance")},
+        "steps": {step: {"seconds": statistics.median(run["seconds"][step] for run in runs)} for step in STEPS},
+    }
+    for step in STEPS:
+        results["steps"][step]["modules"] = runs[-1]["modules"][step]
+        print(
+            f"{step:>8}: {results['steps'][step]['seconds']:.3f}s (median of {args.repeat}), "
+            f"heavy modules loaded: {', '.join(results['steps'][step]['modules']) or '-'}"
+        )
+    return results
+
+
+def compare(results: Dict[str, Any], baseline: Dict[str, Any], tolerance: float) -> List[str]:
+    """Describe every step that is slower than the baseline by more than tolerance, or that loads more heavy modules."""
+    if results["config"] != baseline["config"]:
+        print("WARNING: benchmark config differs from the baseline:", baseline["config"])
+
+    regressions = []
+    for step, base in baseline["steps"].items():
+        if step not in results["steps"]:
+            continue
+        value, limit = results["steps"][step]["seconds"], base["seconds"] * (1 + tolerance)
+        if value > limit:
+            regressions.append(f"{step} seconds: {value:.4f} > {base['seconds']:.4f} (+{tolerance:.0%})")
+        extra = sorted(set(results["steps"][step]["modules"]) - set(base["modules"]))
+        if extra:
+            regressions.append(f"{step} modules: now also loads {', '.join(extra)}")
+    return regressions
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--model_dir", type=str, default="", help="Default to an untrained NPTS model.")
+    parser.add_argument("--prediction_length", type=int, default=14, help="Prediction length of the NPTS model.")
+    parser.add_argument("--freq", type=str, default="D", help="Frequency of the NPTS model.")
+    parser.add_argument("--artifact", action="store_true", help="Export the model as a single-file artifact.")
+    parser.add_argument("--warmup", type=int, default=1, help="INFERENCE_WARMUP of the entrypoint.")
+    parser.add_argument("--repeat", type=int, default=5, help="Number of fresh processes.")
+    parser.add_argument("--output", type=str, default="", help="Save results to this JSON file.")
+    parser.add_argument("--baseline", type=str, default="", help="Compare results to this JSON file.")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed relative regression.")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        model_dir = os.path.join(tmp_dir, "model")
+        new_model(model_dir, args)
+        results = benchmark(model_dir, args)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for regression in regressions:
+            print("REGRESSION:", regression)
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
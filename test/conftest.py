@@ -8,6 +8,12 @@ def root_dir(request):
     return Path(request.config.rootdir)
 
 
+@pytest.fixture
+def entrypoint_path(root_dir, monkeypatch):
+    """Make the modules of the entrypoint (e.g., gluonts_example) importable."""
+    monkeypatch.syspath_prepend(root_dir / "src" / "entrypoint")
+
+
 class Helpers:
     @staticmethod
     def import_from_file(name, fname):
@@ -18,6 +24,29 @@ class Helpers:
         spec.loader.exec_module(mod)
         return mod
 
+    @staticmethod
+    def forecast_pairs(num_series, prediction_length=7, lengths=(30,), nan=False, freq="D", seed=0):
+        """Ground-truth timeseries (with len in lengths, cyclically) and sample forecasts of their last points.
+
+        With nan, some timeseries have missing values in their past or forecast horizon.
+        """
+        import numpy as np
+        import pandas as pd
+        from gluonts.model.forecast import SampleForecast
+
+        rng = np.random.default_rng(seed)
+        pairs = []
+        for i in range(num_series):
+            length = lengths[i % len(lengths)]
+            y = rng.gamma(2, 3, length).astype(np.float32)
+            if nan and i % 3 == 0:
+                y[rng.integers(0, length, 2)] = np.nan
+            index = pd.date_range("2020-01-01", periods=length, freq=freq)
+            samples = rng.gamma(2, 3, (100, prediction_length)).astype(np.float32)
+            forecast = SampleForecast(samples, start_date=index[-prediction_length], freq=freq, item_id=f"ts{i}")
+            pairs.append((pd.DataFrame(y, index=index), forecast))
+        return pairs
+
 
 @pytest.fixture
 def helpers():
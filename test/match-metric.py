@@ -7,6 +7,9 @@ regex = [
     r"gluonts\[metric-abs_error\]: (\S+)",
     r"gluonts\[metric-RMSE\]: (\S+)",
     r"gluonts\[metric-wMAPE\]: (\S+)",
+    r"gluonts\[metric-train_epoch_data_seconds\]: (\S+)",
+    r"gluonts\[metric-train_series_per_second\]: (\S+)",
+    r"gluonts\[metric-train_peak_rss_mb\]: (\S+)",
     r"asdf",
 ]
 
@@ -14,6 +17,9 @@ regex = [
 text = """[2020-04-23 09:26:06] [INFO] root Epoch[1] Evaluation metric 'epoch_loss'=6.790306
 [2020-05-06 14:52:09] [INFO] root Epoch[2] Evaluation metric 'validation_epoch_loss'=0.874746
 [2020-04-23 09:26:06] [INFO] root Epoch[2] Learning rate is 0.001
+[2020-04-23 09:26:08] [INFO] gluonts_example.telemetry Epoch[2] gluonts[metric-train_epoch_data_seconds]: 0.513
+[2020-04-23 09:26:08] [INFO] __main__ gluonts[metric-train_series_per_second]: 1187.2
+[2020-04-23 09:26:08] [INFO] __main__ gluonts[metric-train_peak_rss_mb]: 912.5
 [2020-04-23 09:26:10] [INFO] __main__ gluonts[metric-RMSE]: 47143.54635620117
 [2020-04-23 09:26:10] [INFO] __main__ gluonts[metric-abs_error]: 685.4429550170898
 [2020-04-23 09:26:10] [INFO] __main__ gluonts[metric-wMAPE]: 0.130905881524086
@@ -0,0 +1,28 @@
+#!/usr/bin/env bash
+
+set -o pipefail
+
+SRC=src/entrypoint
+INPUT=refdata
+OUTPUT=$(mktemp -d)
+trap "rm -fr $OUTPUT" EXIT
+
+echo -e '\nDeepAR and NPTS, from one dataset load...'
+python $SRC/train.py --s3_dataset $INPUT \
+    --model_dir $OUTPUT/model \
+    --output_data_dir $OUTPUT/output \
+    --algos '{
+        "deepar": "--algo gluonts.model.deepar.DeepAREstimator --trainer.__class__ gluonts.trainer.Trainer --trainer.epochs 3 --use_feat_static_cat True --cardinality [5]",
+        "npts": "--algo gluonts.model.npts.NPTSEstimator"
+    }' \
+    --algo_workers 2 \
+    --prediction_length 3 \
+    2>&1 | egrep --color=always -i 'prediction_length|freq|epochs|\.[a-zA-Z]+Estimator|gluonts\[metric-|$' || exit 1
+
+# Each estimator saves its own model and backtest results.
+for algo in deepar npts; do
+    for f in $OUTPUT/model/$algo/y_transform.json $OUTPUT/output/$algo/agg_metrics.json; do
+        [[ -f $f ]] || { echo "Missing $f"; exit 1; }
+    done
+done
+echo "Found the model and agg_metrics.json of every estimator."
@@ -0,0 +1,18 @@
+#!/usr/bin/env bash
+
+SRC=src/entrypoint
+INPUT=refdata
+
+echo -e '\nSweep DeepAR with successive halving...'
+python $SRC/sweep.py --s3_dataset $INPUT \
+    --algo gluonts.model.deepar.DeepAREstimator \
+    --trainer.__class__ gluonts.trainer.Trainer \
+    --trainer.epochs 9 \
+    --use_feat_static_cat True \
+    --cardinality [5] \
+    --prediction_length 3 \
+    --search_space '{"trainer.learning_rate": [1e-2, 1e-3], "num_cells": [10, 20]}' \
+    --min_epochs 1 \
+    --eta 3 \
+    --sweep_workers 2 \
+    2>&1 | egrep --color=always -i 'prediction_length|epochs|Pruned|Leaderboard|trial-|$'
@@ -0,0 +1,56 @@
+import numpy as np
+import pandas as pd
+import pytest
+from gluonts.evaluation import Evaluator
+
+pytestmark = pytest.mark.usefixtures("entrypoint_path")
+
+
+@pytest.fixture
+def item_metrics(helpers):
+    """Item metrics with NaN and None values, e.g., MASE of short timeseries, MSE of forecasts without mean."""
+    evaluator = Evaluator(quantiles=[0.1, 0.5, 0.9], num_workers=0)
+    pairs = helpers.forecast_pairs(40, lengths=(30, 8, 7, 12), nan=True)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        rows = [evaluator.get_metrics_per_ts(ts, forecast) for ts, forecast in pairs]
+    for i, row in enumerate(rows):
+        del row["item_id"]
+        if i % 4 == 1:
+            row["MSE"] = None
+        if i % 5 == 0:
+            row["MASE"] = np.nan
+        if i >= 20:
+            row["OWA"] = 0.5 * i
+    return evaluator, rows
+
+
+@pytest.mark.parametrize("batch_size", [1, 7, 40])
+def test_metrics_aggregator(item_metrics, batch_size):
+    from gluonts_example.aggregator import MetricsAggregator, base_agg_funs
+
+    evaluator, rows = item_metrics
+    aggregator = MetricsAggregator(base_agg_funs(evaluator.quantiles))
+    for i in range(0, len(rows), batch_size):
+        aggregator.update(rows[i : i + batch_size])
+    assert aggregator.num_series == len(rows)
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        expected, _ = evaluator.get_aggregate_metrics(pd.DataFrame(rows, dtype=np.float64))
+        actual, _ = evaluator.get_aggregate_metrics(aggregator.summary())
+    assert actual.keys() == expected.keys()
+    for key in expected:
+        np.testing.assert_allclose(actual[key], expected[key], rtol=1e-9, equal_nan=True, err_msg=key)
+
+
+def test_metrics_aggregator_all_missing(item_metrics):
+    from gluonts_example.aggregator import MetricsAggregator, base_agg_funs
+
+    # Like pandas: the sum of no values is 0, and their mean is NaN.
+    evaluator, rows = item_metrics
+    rows = [{**row, "MSE": None, "abs_error": np.nan} for row in rows]
+    aggregator = MetricsAggregator(base_agg_funs(evaluator.quantiles))
+    aggregator.update(rows)
+    summary = aggregator.summary()
+    expected = pd.DataFrame(rows, dtype=np.float64)
+    assert np.isnan(summary["MSE"][0]) and np.isnan(expected["MSE"].mean())
+    assert summary["abs_error"][0] == expected["abs_error"].sum() == 0
@@ -0,0 +1,36 @@
+import numpy as np
+import pandas as pd
+import pytest
+from gluonts.evaluation import Evaluator
+
+pytestmark = pytest.mark.usefixtures("entrypoint_path")
+
+
+@pytest.mark.parametrize(
+    "freq,lengths,nan",
+    [
+        ("D", (30,), False),
+        # Missing values in the past data and in the forecast horizon.
+        ("D", (30, 12, 8), True),
+        # Past data shorter than the seasonality (5), hence the seasonal error falls back to lag 1.
+        ("B", (40, 9, 20, 10, 11), True),
+    ],
+)
+def test_metrics_batch(helpers, freq, lengths, nan):
+    from gluonts_example.batch_metrics import MetricsBatch
+
+    pairs = helpers.forecast_pairs(30, lengths=lengths, nan=nan, freq=freq)
+    evaluator = Evaluator(quantiles=[0.1, 0.5, 0.9], num_workers=0)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        expected = pd.DataFrame([evaluator.get_metrics_per_ts(ts, forecast) for ts, forecast in pairs])
+        batch = MetricsBatch(evaluator, pairs)
+        actual = pd.DataFrame(batch.rows(batch.metrics()))
+
+    assert list(actual.columns) == list(expected.columns)
+    for column in ("MSIS", "Coverage[0.1]", "QuantileLoss[0.9]", "seasonal_error", "MASE"):
+        assert column in actual.columns
+    assert list(actual["item_id"]) == list(expected["item_id"])
+    for column in expected.columns.drop("item_id"):
+        np.testing.assert_allclose(
+            actual[column].astype(float), expected[column].astype(float), rtol=1e-5, equal_nan=True, err_msg=column
+        )
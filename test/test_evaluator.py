@@ -0,0 +1,151 @@
+import gzip
+import json
+
+import numpy as np
+import pandas as pd
+import pytest
+
+pytestmark = pytest.mark.usefixtures("entrypoint_path")
+
+
+def evaluate(out_dir, pairs, **kwargs):
+    from gluonts_example.evaluator import MyEvaluator
+
+    evaluator = MyEvaluator(out_dir, plot="none", **kwargs)
+    return evaluator(iter([ts for ts, _ in pairs]), iter([f for _, f in pairs]), num_series=len(pairs))
+
+
+@pytest.mark.parametrize("num_workers,batch_size", [(2, 3), (3, 1), (2, 0)])
+def test_parallel_evaluation(helpers, tmp_path, num_workers, batch_size):
+    pairs = helpers.forecast_pairs(50, lengths=(20, 31, 9), nan=True)
+    expected_totals, expected = evaluate(tmp_path / "serial", pairs, num_workers=1, batch_size=batch_size)
+    totals, item_metrics = evaluate(tmp_path / "parallel", pairs, num_workers=num_workers, batch_size=batch_size)
+
+    # Same item metrics, in the order of the timeseries, and same outputs.
+    assert list(item_metrics["item_id"]) == [f"ts{i}" for i in range(50)]
+    pd.testing.assert_frame_equal(item_metrics, expected)
+    assert totals.keys() == expected_totals.keys()
+    np.testing.assert_allclose([totals[k] for k in totals], [expected_totals[k] for k in totals], equal_nan=True)
+    results = (tmp_path / "parallel" / "results.jsonl").read_text()
+    assert results == (tmp_path / "serial" / "results.jsonl").read_text()
+    assert len(results.splitlines()) == 50
+
+
+class Interrupted(Exception):
+    pass
+
+
+def read_output(path):
+    return gzip.open(path, "rt").read() if path.suffix == ".gz" else path.read_text()
+
+
+def evaluate_checkpointed(out_dir, pairs, results_format, stop_after=None):
+    """Evaluate the timeseries not evaluated yet as of the checkpoint in out_dir, and checkpoint every other window.
+
+    With stop_after, raise Interrupted when plotting that many timeseries, after the outputs of the last window are
+    written to disk, i.e., beyond the checkpoint.
+    """
+    from gluonts_example.aggregator import ItemMetricsWriter
+    from gluonts_example.checkpoint import EvalCheckpoint
+    from gluonts_example.evaluator import MyEvaluator
+
+    checkpoint = EvalCheckpoint(out_dir, interval=0)
+    windows = iter(range(1, len(pairs) + 1))
+    checkpoint.due = lambda: next(windows) % 2 == 0
+    todo = pairs[len(pairs) - len(checkpoint.skip_evaluated([{"item_id": f.item_id} for _, f in pairs])) :]
+
+    item_writers = [ItemMetricsWriter(out_dir / "item_metrics.csv")]
+    evaluator = MyEvaluator(
+        out_dir,
+        plot="none",
+        batch_size=4,
+        item_writers=item_writers,
+        results_format=results_format,
+        checkpoint=checkpoint,
+    )
+    if stop_after is not None:
+        num_added = iter(range(1, len(pairs) + 1))
+
+        def add(*args):
+            if next(num_added) == stop_after:
+                evaluator.results.close()
+                evaluator.evaluated.close()
+                raise Interrupted
+
+        evaluator.plotter.add = add
+    totals, _ = evaluator(iter([ts for ts, _ in todo]), iter([f for _, f in todo]), num_series=len(todo))
+    return totals
+
+
+@pytest.mark.parametrize("results_format", ["jsonl", "jsonl.gz"])
+def test_resumed_evaluation(helpers, tmp_path, results_format):
+    from gluonts_example.aggregator import ItemMetricsWriter
+    from gluonts_example.checkpoint import EvalCheckpoint
+    from gluonts_example.evaluator import MyEvaluator
+
+    pairs = helpers.forecast_pairs(50, lengths=(20, 31, 9), nan=True)
+    item_writers = [ItemMetricsWriter(tmp_path / "straight" / "item_metrics.csv")]
+    evaluator = MyEvaluator(
+        tmp_path / "straight", plot="none", batch_size=4, item_writers=item_writers, results_format=results_format
+    )
+    expected, _ = evaluator(iter([ts for ts, _ in pairs]), iter([f for _, f in pairs]), num_series=len(pairs))
+
+    # Interrupted twice, each time with outputs partially written after the last checkpoint.
+    checkpoint_dir = tmp_path / "checkpoint"
+    for stop_after in (23, 15):
+        with pytest.raises(Interrupted):
+            evaluate_checkpointed(checkpoint_dir, pairs, results_format, stop_after)
+        sizes = EvalCheckpoint(checkpoint_dir).state["sizes"]
+        assert (checkpoint_dir / "item_metrics.csv").stat().st_size > sizes["item_metrics.csv"]
+        assert (checkpoint_dir / f"results.{results_format}").stat().st_size > sizes[f"results.{results_format}"]
+    totals = evaluate_checkpointed(checkpoint_dir, pairs, results_format)
+
+    assert json.dumps(totals, sort_keys=True) == json.dumps(expected, sort_keys=True)
+    for name in (f"results.{results_format}", "item_metrics.csv"):
+        assert read_output(checkpoint_dir / name) == read_output(tmp_path / "straight" / name), name
+
+
+@pytest.mark.parametrize("quantiles", [None, ["0.025", "0.5", "0.975"]])
+def test_tabulated_forecasts(helpers, tmp_path, quantiles):
+    from gluonts_example.evaluator import MyEvaluator
+    from gluonts_example.forecast import tabulate_forecasts
+    from gluonts_example.plotting import PlotForecast
+
+    # Default quantiles of the Evaluator, i.e., np.linspace() floats, or a custom set where MSIS uses the exact levels.
+    kwargs = {} if quantiles is None else {"quantiles": quantiles}
+    evaluator = MyEvaluator(tmp_path, plot="none", **kwargs)
+    pairs = helpers.forecast_pairs(20, lengths=(20, 31, 9), nan=True)
+    forecasts = [forecast for _, forecast in pairs]
+    tabulated = list(tabulate_forecasts(forecasts, evaluator.quantile_levels(), batch_size=8))
+
+    for (time_series, forecast), quantile_forecast in zip(pairs, tabulated):
+        assert quantile_forecast.item_id == forecast.item_id
+        time_series = evaluator.ground_truth(time_series)
+        expected_metrics, expected_result = evaluator.evaluate_ts(time_series, forecast)
+        metrics, result = evaluator.evaluate_ts(time_series, quantile_forecast)
+
+        # Metrics (including MSIS, from the quantiles closest to alpha / 2 and 1 - alpha / 2), within float32.
+        assert metrics.keys() == expected_metrics.keys()
+        assert metrics.pop("item_id") == expected_metrics.pop("item_id")
+        assert np.isfinite(metrics["MSIS"])
+        np.testing.assert_allclose(
+            [metrics[k] for k in metrics], [expected_metrics[k] for k in metrics], rtol=1e-5, equal_nan=True
+        )
+
+        # Forecast results, i.e., results.jsonl.
+        assert result.item_id == expected_result.item_id
+        np.testing.assert_allclose(result.mean, expected_result.mean, rtol=1e-6)
+        np.testing.assert_array_equal(result.quantiles, expected_result.quantiles)
+
+        # Plot inputs.
+        plot_forecast = PlotForecast(quantile_forecast, evaluator.plot_ci)
+        expected_plot_forecast = PlotForecast(forecast, evaluator.plot_ci)
+        assert plot_forecast.quantiles.keys() == expected_plot_forecast.quantiles.keys()
+        for q, values in plot_forecast.quantiles.items():
+            assert not np.isnan(values).any()
+            np.testing.assert_array_equal(values, expected_plot_forecast.quantiles[q])
+
+        # A level that no consumer asked for is NaN, rather than derived from the (released) samples.
+        assert "0.33" not in evaluator.quantile_levels()
+        assert np.isnan(quantile_forecast.quantile(0.33)).all()
+        assert not np.isnan(forecast.quantile(0.33)).any()
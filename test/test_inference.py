@@ -1,8 +1,14 @@
+import gzip
 import io
 import json
+import subprocess
+import sys
 from typing import List
 
+import numpy as np
+import pandas as pd
 import pytest
+from gluonts.model.forecast import Config, SampleForecast
 from gluonts.model.predictor import Predictor
 
 
@@ -13,8 +19,8 @@ def gluonts_inference(root_dir, monkeypatch, helpers):
     See https://github.com/verdimrc/python-project-skeleton/tree/master/test for
     the reason behind importing this way (as opposed import statement.
     """
-    monkeypatch.syspath_prepend(root_dir / "src")
-    inference = helpers.import_from_file("gluonts_inference", root_dir / "src" / "inference.py")
+    monkeypatch.syspath_prepend(root_dir / "src" / "entrypoint")
+    inference = helpers.import_from_file("gluonts_inference", root_dir / "src" / "entrypoint" / "inference.py")
     return inference
 
 
@@ -65,3 +71,359 @@ def test_predict_fn(
     for result in results:
         assert result.samples.shape == (num_samples, predictor.prediction_length)
         print(result.samples.shape)
+
+
+@pytest.fixture
+def forecasts():
+    rng = np.random.RandomState(42)
+    samples = rng.normal(loc=100.0, scale=30.0, size=(4, 25, 3)).astype(np.float32)
+    samples[1, :, 2] = np.nan
+    samples[2, :, 0] = np.inf
+    return [
+        SampleForecast(samples=s, start_date=pd.Timestamp("2019-10-06", freq="W"), freq="W", item_id=f"ts{i}")
+        for i, s in enumerate(samples)
+    ]
+
+
+@pytest.mark.parametrize(
+    "config",
+    [
+        Config(quantiles=["0.1", "0.2", "0.3", "0.4", "0.5", "0.6", "0.7", "0.8", "0.9"]),
+        Config(quantiles=["0.5"], output_types={"quantiles"}),
+        Config(output_types={"mean"}),
+    ],
+)
+def test_output_fn_byte_compatible(gluonts_inference, forecasts, config):
+    from gluonts_example.serde import jsonify_floats
+
+    expected = "\n".join(json.dumps(jsonify_floats(f.as_json_dict(config))) for f in forecasts).encode()
+    results_bytes, _ = gluonts_inference._output_fn(forecasts, "application/json", config)
+    assert results_bytes == expected
+
+
+@pytest.mark.parametrize("chunk_size", [1, 2, 1024])
+def test_transform_stream(gluonts_inference, predictor: Predictor, request_body: bytes, chunk_size: int):
+    from gluonts_example.serde import iter_json_lines
+
+    entries = iter_json_lines(request_body)
+    chunks = list(gluonts_inference.transform_stream(predictor, entries, num_samples=5, chunk_size=chunk_size))
+    assert len(chunks) == -(-2 // chunk_size)
+
+    # Concatenated chunks must be the same JSON lines as the non-streaming output.
+    lines = b"".join(chunks).decode("utf-8").split("\n")
+    assert len(lines) == 2
+    for line in lines:
+        d = json.loads(line)
+        assert set(d) == {"mean", "quantiles"}
+        assert len(d["quantiles"]["0.5"]) == predictor.prediction_length
+
+
+def test_model_fn_memoized(gluonts_inference, predictor: Predictor):
+    assert gluonts_inference.model_fn("test/refdata/model") is predictor
+
+
+def test_model_fn_reload(gluonts_inference, monkeypatch, tmp_path, caplog):
+    import os
+    import shutil
+
+    model_dir = tmp_path / "model"
+    shutil.copytree("test/refdata/model", model_dir)
+
+    class FakePool:
+        def __init__(self, model_dir, *args, **kwargs):
+            self.closed = False
+            pools.append(self)
+
+        def close(self):
+            self.closed = True
+
+    class FakePrometheus:
+        def update(self, metrics):
+            raise AssertionError("warm-up request recorded in the request metrics")
+
+    pools: List[FakePool] = []
+    warmed = []
+    predict_chunk = gluonts_inference.predict_chunk
+
+    def warmup_chunk(chunk, predictor, *args, **kwargs):
+        warmed.append((predictor, [pool.closed for pool in pools]))
+        return predict_chunk(chunk, predictor, *args, **kwargs)
+
+    monkeypatch.setattr(gluonts_inference, "InferencePool", FakePool)
+    monkeypatch.setattr(gluonts_inference, "WORKERS", "2")
+    monkeypatch.setattr(gluonts_inference, "WARMUP", True)
+    monkeypatch.setattr(gluonts_inference, "METRICS", True)
+    monkeypatch.setattr(gluonts_inference, "PROMETHEUS", FakePrometheus())
+    monkeypatch.setattr(gluonts_inference, "predict_chunk", warmup_chunk)
+
+    old = gluonts_inference.model_fn(model_dir)
+    assert gluonts_inference.model_fn(model_dir) is old
+
+    # Re-deployed model: a new predictor, warmed up in-process after the stale predictor and its pool are gone.
+    y_transform = model_dir / "y_transform.json"
+    y_transform.write_text(y_transform.read_text() + "\n")
+    new = gluonts_inference.model_fn(model_dir)
+    assert new is not old and new.fingerprint != old.fingerprint
+    assert list(gluonts_inference._PREDICTORS) == [(os.path.abspath(model_dir), new.fingerprint)]
+    assert [pool.closed for pool in pools] == [True, False]
+    assert gluonts_inference._POOLS == {os.path.abspath(model_dir): pools[1]}
+    assert warmed == [(old, []), (new, [True])]
+    assert not any("metric-inference_" in message for message in caplog.messages)
+
+
+@pytest.mark.parametrize(
+    "num_workers,threads_per_worker,cores,expected",
+    [(0, 0, 4, (4, 1)), (0, 0, 48, (24, 2)), (0, 4, 48, (12, 4)), (3, 0, 48, (3, 2)), (0, 0, 1, (1, 1))],
+)
+def test_plan_workers(num_workers, threads_per_worker, cores, expected):
+    from gluonts_example.parallel import plan_workers
+
+    assert plan_workers(num_workers, threads_per_worker, cores) == expected
+
+
+def test_transform_fn_pool(gluonts_inference, predictor: Predictor, monkeypatch):
+    from gluonts_example.parallel import InferencePool
+
+    # Timeseries of increasing levels, hence of increasing forecasts, spread over the workers 2 at a time.
+    levels = [10.0 * 2 ** i for i in range(12)]
+    request_body = "\n".join(
+        json.dumps({"start": "2019-09-29", "target": [level] * 12, "feat_static_cat": [0], "item_id": f"ts{i}"})
+        for i, level in enumerate(levels)
+    )
+    monkeypatch.setattr(gluonts_inference, "WORKER_CHUNK_SIZE", 2)
+    pool = InferencePool(predictor.model_dir, num_workers=2, threads_per_worker=1, warmup=False)
+    monkeypatch.setitem(gluonts_inference._POOLS, predictor.model_dir, pool)
+    try:
+        results_bytes, _ = gluonts_inference.transform_fn(predictor, request_body, num_samples=20)
+    finally:
+        pool.close()
+
+    # Results are in input order.
+    means = [np.mean(json.loads(line)["mean"]) for line in results_bytes.split(b"\n")]
+    assert len(means) == len(levels)
+    assert np.all(np.diff(means) > 0)
+
+
+def test_inference_pool_lazy(gluonts_inference, predictor: Predictor):
+    from gluonts_example.parallel import MAX_PENDING_PER_WORKER, InferencePool
+    from gluonts_example.serving import synthetic_request
+
+    pulled = []
+
+    def chunks():
+        for i in range(10):
+            pulled.append(i)
+            yield synthetic_request(predictor, 2)
+
+    pool = InferencePool(predictor.model_dir, num_workers=2, threads_per_worker=1, warmup=False)
+    try:
+        results = pool.imap(chunks(), 5, gluonts_inference.output_config())
+        # Only a few chunks per worker are pulled ahead of the yielded results.
+        next(results)
+        assert len(pulled) == MAX_PENDING_PER_WORKER * 2
+        next(results)
+        assert len(pulled) == MAX_PENDING_PER_WORKER * 2 + 1
+        assert len(list(results)) == 8
+        assert len(pulled) == 10
+    finally:
+        pool.close()
+
+
+@pytest.mark.parametrize(
+    "content_type,header,expected_keys,expected_quantiles",
+    [
+        ("application/json; quantiles=0.5; output_types=quantiles", None, {"quantiles"}, ["0.5"]),
+        ("application/json; num_samples=10; output_types=mean", None, {"mean"}, []),
+        ("application/json", {"quantiles": [0.1, 0.9]}, {"mean", "quantiles"}, ["0.1", "0.9"]),
+    ],
+)
+def test_transform_fn_request_config(
+    gluonts_inference,
+    predictor: Predictor,
+    request_body: bytes,
+    content_type,
+    header,
+    expected_keys,
+    expected_quantiles,
+):
+    if header is not None:
+        request_body = json.dumps({"configuration": header}).encode() + b"\n" + request_body
+    results_bytes, accept_type = gluonts_inference.transform_fn(predictor, request_body, content_type, content_type, 3)
+    assert accept_type == "application/json"
+
+    lines = results_bytes.decode("utf-8").split("\n")
+    assert len(lines) == 2
+    for line in lines:
+        d = json.loads(line)
+        assert set(d) == expected_keys
+        assert list(d.get("quantiles", {})) == expected_quantiles
+
+
+@pytest.mark.parametrize(
+    "media_type",
+    ["application/json; num_samples=0", "application/json; quantiles=abc", "application/json; output_types=x"],
+)
+def test_request_config_invalid(media_type):
+    from gluonts_example.serde import request_config
+
+    with pytest.raises(ValueError):
+        request_config(Config(), 100, [media_type])
+
+
+def test_transform_fn_npz(gluonts_inference, predictor: Predictor, request_body: bytes):
+    from gluonts_example.serde import NPZ, entries_to_npz, iter_json_lines
+
+    npz_body = entries_to_npz(iter_json_lines(request_body))
+    results_bytes, accept_type = gluonts_inference.transform_fn(predictor, npz_body, NPZ, f"{NPZ}; quantiles=0.1,0.5")
+    assert accept_type == NPZ
+
+    results = np.load(io.BytesIO(results_bytes))
+    assert results["quantiles"].shape == (2, 2, predictor.prediction_length)
+    assert results["quantiles"].dtype == np.float32
+    assert list(results["quantile_levels"]) == ["0.1", "0.5"]
+    assert results["mean"].shape == (2, predictor.prediction_length)
+
+
+def test_transform_fn_gzip(gluonts_inference, predictor: Predictor, request_body: bytes):
+    content_type = "application/json; encoding=gzip"
+    results_bytes, accept_type = gluonts_inference.transform_fn(
+        predictor, gzip.compress(request_body), content_type, content_type, 3
+    )
+    assert accept_type == content_type
+
+    lines = gzip.decompress(results_bytes).decode("utf-8").split("\n")
+    assert len(lines) == 2
+    for line in lines:
+        assert len(json.loads(line)["mean"]) == predictor.prediction_length
+
+
+def test_transform_fn_cache(gluonts_inference, predictor: Predictor, request_body: bytes, monkeypatch, tmp_path):
+    from gluonts_example.cache import ForecastCache
+
+    cache = ForecastCache(100, tmp_path)
+    monkeypatch.setattr(gluonts_inference, "CACHE", cache)
+    first, _ = gluonts_inference.transform_fn(predictor, request_body, "application/json", "application/json", 3)
+    assert cache.stats()["misses"] == 2
+
+    # Same timeseries under a different item_id, followed by a new timeseries.
+    lines = request_body.decode("utf-8").strip().split("\n")
+    new_ts = json.dumps({"start": "2019-10-02", "target": [1, 2, 3, 4, 5, 6], "feat_static_cat": [0]})
+    second, _ = gluonts_inference.transform_fn(
+        predictor, "\n".join([lines[1].replace("EF", "GH"), new_ts]), "application/json", "application/json", 3
+    )
+    assert cache.stats()["hits"] == 1 and cache.stats()["misses"] == 3
+    assert second.split(b"\n")[0] == first.split(b"\n")[1]
+
+
+def test_transform_fn_metrics(gluonts_inference, predictor: Predictor, request_body: bytes, monkeypatch, tmp_path):
+    from gluonts_example.telemetry import PrometheusTextfile
+
+    prom_file = tmp_path / "inference.prom"
+    monkeypatch.setattr(gluonts_inference, "PROMETHEUS", PrometheusTextfile(str(prom_file)))
+    results_bytes, _ = gluonts_inference.transform_fn(
+        predictor, request_body, "application/json", "application/json", 3
+    )
+    assert len(results_bytes.split(b"\n")) == 2
+
+    totals = dict(line.split(" ") for line in prom_file.read_text().splitlines() if not line.startswith("#"))
+    assert float(totals["gluonts_inference_series_total"]) == 2
+    assert float(totals["gluonts_inference_points_total"]) == 12
+    assert float(totals["gluonts_inference_bytes_out_total"]) == len(results_bytes)
+    assert float(totals["gluonts_inference_predict_seconds_total"]) > 0
+
+
+def test_transform_fn_metrics_bytes(
+    gluonts_inference, predictor: Predictor, request_body: bytes, monkeypatch, tmp_path
+):
+    from gluonts_example.telemetry import PrometheusTextfile
+
+    prom_file = tmp_path / "inference.prom"
+    monkeypatch.setattr(gluonts_inference, "PROMETHEUS", PrometheusTextfile(str(prom_file)))
+
+    # A payload decoded to str by the model server counts its utf-8 bytes, not its characters.
+    str_body = request_body.decode("utf-8").replace("name:AB", "name:Zürich")
+    plain, _ = gluonts_inference.transform_fn(predictor, str_body, "application/json", "application/json", 3)
+    totals = dict(line.split(" ") for line in prom_file.read_text().splitlines() if not line.startswith("#"))
+    assert float(totals["gluonts_inference_bytes_in_total"]) == len(str_body.encode("utf-8")) > len(str_body)
+    assert float(totals["gluonts_inference_bytes_out_total"]) == len(plain)
+
+    # Compressed payloads count their compressed size, both in and out.
+    content_type = "application/json; encoding=gzip"
+    gzip_body = gzip.compress(request_body)
+    compressed, _ = gluonts_inference.transform_fn(predictor, gzip_body, content_type, content_type, 3)
+    totals = dict(line.split(" ") for line in prom_file.read_text().splitlines() if not line.startswith("#"))
+    assert float(totals["gluonts_inference_bytes_in_total"]) == len(str_body.encode("utf-8")) + len(gzip_body)
+    assert float(totals["gluonts_inference_bytes_out_total"]) == len(plain) + len(compressed)
+
+
+def test_iter_input_fused_log1p(gluonts_inference, request_body: bytes):
+    from gluonts_example.serde import NPZ, entries_to_npz, iter_json_lines
+
+    expected = [
+        np.log1p(np.asarray(d["target"], dtype=np.float64)).astype(np.float32) for d in iter_json_lines(request_body)
+    ]
+    npz_body = entries_to_npz(iter_json_lines(request_body))
+    for content_type, body in (("application/json", request_body), (NPZ, npz_body)):
+        entries = list(gluonts_inference._iter_input(body, content_type, np.log1p))
+        for entry, target in zip(entries, expected):
+            assert entry["target"].dtype == np.float32 and entry["target"].flags.c_contiguous
+            np.testing.assert_allclose(entry["target"], target, rtol=1e-6)
+
+
+def test_transform_fn_header_log1p(gluonts_inference, predictor: Predictor, request_body: bytes, monkeypatch):
+    from gluonts_example.serde import iter_json_lines, split_header
+    from gluonts_example.util import log1p
+
+    # The fused forward transform skips the header record, which has no target.
+    header = json.dumps({"configuration": {"quantiles": ["0.5"], "output_types": ["quantiles"]}}).encode()
+    request_body = header + b"\n" + request_body
+    config, entries = split_header(iter_json_lines(request_body, np.log1p))
+    assert config == {"quantiles": ["0.5"], "output_types": ["quantiles"]}
+    assert [entry["target"].dtype for entry in entries] == [np.float32, np.float32]
+
+    monkeypatch.setattr(predictor, "pre_input_transform", log1p, raising=False)
+    monkeypatch.setattr(predictor, "pre_input_ufunc", np.log1p, raising=False)
+    results_bytes, _ = gluonts_inference.transform_fn(predictor, request_body, num_samples=3)
+    lines = results_bytes.decode("utf-8").split("\n")
+    assert len(lines) == 2
+    for line in lines:
+        assert list(json.loads(line)) == ["quantiles"]
+        assert list(json.loads(line)["quantiles"]) == ["0.5"]
+
+
+def test_model_fn_artifact(gluonts_inference, predictor: Predictor, request_body: bytes, monkeypatch, tmp_path):
+    import shutil
+
+    from gluonts_example.artifact import ARTIFACT, LazyPredictor, export_artifact
+
+    model_dir = tmp_path / "model"
+    shutil.copytree("test/refdata/model", model_dir)
+    y_transform = json.loads((model_dir / "y_transform.json").read_text())
+    export_artifact(predictor, model_dir / ARTIFACT, y_transform)
+
+    # The artifact is preferred, and its network is loaded on first use.
+    monkeypatch.setattr(gluonts_inference, "WARMUP", False)
+    monkeypatch.setattr(gluonts_inference, "SEED", 0)
+    lazy = gluonts_inference.model_fn(model_dir)
+    assert isinstance(lazy, LazyPredictor) and lazy._predictor is None
+    assert lazy.prediction_length == predictor.prediction_length and lazy.freq == predictor.freq
+
+    expected, _ = gluonts_inference.transform_fn(predictor, request_body, "application/json", "application/json", 5)
+    results, _ = gluonts_inference.transform_fn(lazy, request_body, "application/json", "application/json", 5)
+    assert lazy._predictor is not None
+    for line, expected_line in zip(results.split(b"\n"), expected.split(b"\n")):
+        np.testing.assert_allclose(json.loads(line)["mean"], json.loads(expected_line)["mean"], rtol=1e-5)
+
+
+def test_import_is_lean(root_dir):
+    # In a fresh process, as this test module has already imported gluonts.
+    entrypoint = root_dir / "src" / "entrypoint"
+    code = f"""
+import importlib.util, sys
+sys.path.insert(0, {str(entrypoint)!r})
+spec = importlib.util.spec_from_file_location("gluonts_inference", {str(entrypoint / "inference.py")!r})
+spec.loader.exec_module(importlib.util.module_from_spec(spec))
+print(sorted({{name.split(".")[0] for name in sys.modules}} & {{"gluonts", "mxnet", "pandas", "matplotlib"}}))
+"""
+    out = subprocess.run([sys.executable, "-c", code], check=True, stdout=subprocess.PIPE).stdout
+    assert out.decode().strip().splitlines()[-1] == "[]"
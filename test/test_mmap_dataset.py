@@ -0,0 +1,67 @@
+import json
+
+import numpy as np
+import pandas as pd
+import pytest
+from gluonts.dataset.common import FileDataset
+from gluonts.transform import AddObservedValuesIndicator
+
+pytestmark = pytest.mark.usefixtures("entrypoint_path")
+
+
+@pytest.fixture
+def split_dir(tmp_path):
+    """A JSON-lines dataset split, with NaN targets and every cached field."""
+    split_dir = tmp_path / "train"
+    split_dir.mkdir()
+    with (split_dir / "data.json").open("w") as f:
+        for i in range(5):
+            target = [float(v) for v in range(i + 3)]
+            target[1] = "NaN"
+            entry = {"start": f"2020-01-0{i + 1}", "target": target, "item_id": f"ts{i}"}
+            entry.update(feat_static_cat=[i, 0], feat_static_real=[0.5 * i])
+            f.write(json.dumps(entry) + "\n")
+    return split_dir
+
+
+def assert_same_entries(actual, expected):
+    assert len(actual) == len(expected)
+    for a, e in zip(actual, expected):
+        assert set(a) == set(e) - {"source"}
+        assert isinstance(a["start"], pd.Timestamp) and a["start"] == e["start"]
+        for field in a:
+            if isinstance(e[field], np.ndarray):
+                assert a[field].dtype == e[field].dtype
+                np.testing.assert_array_equal(a[field], e[field])
+            else:
+                assert a[field] == e[field]
+
+
+def test_cached_dataset(split_dir, tmp_path):
+    from gluonts_example.mmap_dataset import MmapDataset, cached_dataset
+
+    expected = list(FileDataset(split_dir, freq="D"))
+    cache_dir = tmp_path / "cache"
+    ds = cached_dataset(FileDataset(split_dir, freq="D"), split_dir, "D", cache_dir)
+    assert isinstance(ds, MmapDataset)
+    assert_same_entries(list(ds), expected)
+
+    # Served from the existing cache.
+    ds = cached_dataset(FileDataset(split_dir, freq="D"), split_dir, "D", cache_dir)
+    assert len(list(cache_dir.iterdir())) == 1
+    assert_same_entries(list(ds), expected)
+
+
+def test_mmap_dataset_writable(split_dir, tmp_path):
+    from gluonts_example.mmap_dataset import cached_dataset
+
+    ds = cached_dataset(FileDataset(split_dir, freq="D"), split_dir, "D", tmp_path / "cache")
+
+    # Transformations may write to the target in place, yet every pass sees the original targets.
+    transform = AddObservedValuesIndicator(target_field="target", output_field="observed_values")
+    for _ in range(2):
+        entries = [transform.transform(entry) for entry in ds]
+        for entry in entries:
+            assert entry["target"].flags.writeable
+            assert entry["observed_values"][1] == 0 and entry["target"][1] == 0
+    assert np.isnan(next(iter(ds))["target"][1])
@@ -0,0 +1,128 @@
+import logging
+import pickle
+
+import numpy as np
+import pytest
+
+pytestmark = pytest.mark.usefixtures("entrypoint_path")
+
+
+@pytest.mark.parametrize(
+    "policy,expected",
+    [("all", ("all", 0)), ("none", ("none", 0)), ("random:5", ("random", 5)), ("worst:10", ("worst", 10))],
+)
+def test_parse_plot_policy(policy, expected):
+    from gluonts_example.plotting import parse_plot_policy
+
+    assert parse_plot_policy(policy) == expected
+
+
+@pytest.mark.parametrize("policy", ["", "best:5", "random", "worst:", "worst:x", "all:5", "none:1"])
+def test_parse_plot_policy_invalid(policy):
+    from gluonts_example.plotting import parse_plot_policy
+
+    with pytest.raises(ValueError):
+        parse_plot_policy(policy)
+
+
+def submitted_items(renderer, monkeypatch):
+    """Capture what the renderer submits, instead of rendering it."""
+    items = []
+    monkeypatch.setattr(renderer, "_submit", items.append)
+    return items
+
+
+def add_all(renderer, pairs, wmapes):
+    for (time_series, forecast), wmape in zip(pairs, wmapes):
+        renderer.add(time_series, forecast, wmape)
+    renderer.close()
+
+
+def test_plot_random(helpers, tmp_path, monkeypatch):
+    from gluonts_example.plotting import PlotRenderer
+
+    pairs = helpers.forecast_pairs(50)
+    selections = []
+    for seed in (0, 0, 1):
+        renderer = PlotRenderer(tmp_path, "random:5", seed=seed)
+        items = submitted_items(renderer, monkeypatch)
+        add_all(renderer, pairs, [np.nan] * 50)
+        selections.append([forecast.item_id for _, forecast in items])
+
+    # N timeseries, in the order they were added, and reproducible by seed.
+    order = [f"ts{i}" for i in range(50)]
+    for selection in selections:
+        assert len(selection) == len(set(selection)) == 5
+        assert selection == sorted(selection, key=order.index)
+    assert selections[0] == selections[1] != selections[2]
+
+    # Fewer timeseries than N: all of them.
+    renderer = PlotRenderer(tmp_path, "random:5")
+    items = submitted_items(renderer, monkeypatch)
+    add_all(renderer, pairs[:3], [np.nan] * 3)
+    assert [forecast.item_id for _, forecast in items] == ["ts0", "ts1", "ts2"]
+
+
+def test_plot_random_uniform(helpers, tmp_path, monkeypatch):
+    from gluonts_example.plotting import PlotRenderer
+
+    # Reservoir sampling selects each timeseries with probability N / num_series.
+    pairs = helpers.forecast_pairs(10)
+    counts = np.zeros(10)
+    for seed in range(400):
+        renderer = PlotRenderer(tmp_path, "random:2", seed=seed)
+        items = submitted_items(renderer, monkeypatch)
+        add_all(renderer, pairs, [np.nan] * 10)
+        for _, forecast in items:
+            counts[int(forecast.item_id[2:])] += 1
+    np.testing.assert_allclose(counts / 400, 0.2, atol=0.08)
+
+
+def test_plot_worst(helpers, tmp_path, monkeypatch):
+    from gluonts_example.plotting import PlotRenderer
+
+    pairs = helpers.forecast_pairs(6)
+    wmapes = [0.5, np.nan, 0.9, np.ma.masked, 0.5, 0.1]
+
+    # From the worst; ties in the order they were added; NaN (or masked) is never the worst.
+    renderer = PlotRenderer(tmp_path, "worst:3")
+    items = submitted_items(renderer, monkeypatch)
+    add_all(renderer, pairs, wmapes)
+    assert [forecast.item_id for _, forecast in items] == ["ts2", "ts0", "ts4"]
+
+    # Unless there are not enough timeseries with a wMAPE.
+    renderer = PlotRenderer(tmp_path, "worst:5")
+    items = submitted_items(renderer, monkeypatch)
+    add_all(renderer, pairs[:4], wmapes[:4])
+    assert [forecast.item_id for _, forecast in items][:2] == ["ts2", "ts0"]
+    assert len(items) == 4
+
+
+def _fail(*args):
+    raise RuntimeError("renderer failed")
+
+
+def test_plot_renderer_failure(helpers, tmp_path, monkeypatch, caplog):
+    import gluonts_example.plotting as plotting
+
+    monkeypatch.setattr(plotting, "_render", _fail)
+    monkeypatch.setattr(plotting, "QUEUE_SIZE", 2)
+    monkeypatch.setattr(plotting, "QUEUE_TIMEOUT", 0.1)
+
+    # The bounded queue fills up, yet adding never blocks on the failed renderer, and the failure is logged.
+    renderer = plotting.PlotRenderer(tmp_path, "all")
+    with caplog.at_level(logging.ERROR, logger=plotting.__name__):
+        add_all(renderer, helpers.forecast_pairs(10), [np.nan] * 10)
+    assert renderer.failed and renderer.process is None
+    assert "Plot renderer exited with code 1" in caplog.text
+
+
+def test_plot_renderer_unpicklable(helpers, tmp_path):
+    from gluonts_example.plotting import PlotRenderer
+
+    time_series, forecast = helpers.forecast_pairs(1)[0]
+    forecast.item_id = lambda: None
+    renderer = PlotRenderer(tmp_path, "all")
+    with pytest.raises((pickle.PicklingError, AttributeError)):
+        renderer.add(time_series, forecast)
+    renderer.close()
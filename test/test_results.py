@@ -0,0 +1,69 @@
+import gzip
+import json
+
+import numpy as np
+import pytest
+from gluonts.model.forecast import Config, Quantile
+
+pytestmark = pytest.mark.usefixtures("entrypoint_path")
+
+LEVELS = ["0.1", "0.5", "0.9"]
+
+
+@pytest.fixture
+def forecasts(helpers):
+    """Forecasts with NaN and inf, and of two prediction lengths."""
+    pairs = helpers.forecast_pairs(7) + helpers.forecast_pairs(3, prediction_length=4)
+    forecasts = [forecast for _, forecast in pairs]
+    forecasts[1].samples[:, 2] = np.nan
+    forecasts[2].samples[:, 0] = np.inf
+    forecasts[8].samples[:, :] = np.nan
+    return forecasts
+
+
+def forecast_result(forecast):
+    """Same as MyEvaluator.evaluate_ts()."""
+    from gluonts_example.results import ForecastResult
+
+    quantiles = np.stack([forecast.quantile(Quantile.parse(q).value) for q in LEVELS])
+    return ForecastResult(str(forecast.item_id), forecast.mean, quantiles)
+
+
+def expected_json_lines(forecasts):
+    """What MyEvaluator wrote before ResultsWriter, i.e., json.dump() of each forecast."""
+    config = Config(quantiles=LEVELS)
+    return "".join(json.dumps({"item_id": str(f.item_id), **f.as_json_dict(config)}) + "\n" for f in forecasts)
+
+
+@pytest.mark.parametrize("buffer_size", [1, 3, 1024])
+def test_results_writer_byte_compatible(forecasts, tmp_path, buffer_size):
+    from gluonts_example.results import ResultsWriter
+
+    writer = ResultsWriter(tmp_path, LEVELS, buffer_size=buffer_size)
+    for forecast in forecasts:
+        writer.write(forecast_result(forecast))
+    writer.close()
+    assert (tmp_path / "results.jsonl").read_text() == expected_json_lines(forecasts)
+
+
+def test_results_writer_gzip_sync(forecasts, tmp_path):
+    from gluonts_example.results import ResultsWriter
+
+    # Each sync() ends a gzip member, and the concatenated members decompress to the whole results.
+    writer = ResultsWriter(tmp_path, LEVELS, fmt="jsonl.gz", buffer_size=2)
+    for i, forecast in enumerate(forecasts):
+        writer.write(forecast_result(forecast))
+        if i % 3 == 2:
+            writer.sync()
+    writer.close()
+    with gzip.open(tmp_path / "results.jsonl.gz", "rt") as f:
+        assert f.read() == expected_json_lines(forecasts)
+
+    # Appending after a sync(), e.g., on resume.
+    size = (tmp_path / "results.jsonl.gz").stat().st_size
+    writer = ResultsWriter(tmp_path, LEVELS, fmt="jsonl.gz", append=True)
+    writer.write(forecast_result(forecasts[0]))
+    writer.close()
+    assert (tmp_path / "results.jsonl.gz").stat().st_size > size
+    with gzip.open(tmp_path / "results.jsonl.gz", "rt") as f:
+        assert f.read() == expected_json_lines(forecasts + forecasts[:1])
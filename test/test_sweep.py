@@ -0,0 +1,84 @@
+import pytest
+
+pytestmark = pytest.mark.usefixtures("entrypoint_path")
+
+
+@pytest.fixture
+def sweep():
+    import sweep
+
+    return sweep
+
+
+@pytest.mark.parametrize(
+    "min_epochs,eta,rungs",
+    [(1, 3, [1, 3, 9, 27]), (1, 2, [1, 2, 4, 8, 16]), (3, 3, [3, 9, 27]), (2, 4, [2, 8])],
+)
+def test_is_rung(sweep, min_epochs, eta, rungs):
+    pruner = sweep.SuccessiveHalving(min_epochs, eta)
+    assert [epochs for epochs in range(1, 30) if pruner.is_rung(epochs)] == rungs
+
+
+@pytest.mark.parametrize("min_epochs,eta", [(0, 3), (1, 1), (-1, 2)])
+def test_invalid_successive_halving(sweep, min_epochs, eta):
+    with pytest.raises(ValueError):
+        sweep.SuccessiveHalving(min_epochs, eta)
+
+
+def test_should_stop(sweep):
+    pruner = sweep.SuccessiveHalving(1, 3)
+    nan = float("nan")
+
+    # A trial continues when its loss ranks among the best max(1, n // 3) losses reported so far at the rung. A tie
+    # with the last surviving rank continues, and a NaN loss always stops yet counts as reported.
+    losses = [5.0, 4.0, 6.0, 4.0, 4.5, 1.0, nan, 4.0, 3.0]
+    expected = [False, False, True, False, True, False, True, False, False]
+    assert [pruner.should_stop(3, loss) for loss in losses] == expected
+    assert [pruner.should_stop(1, nan), pruner.should_stop(1, 7.0)] == [True, False]
+
+    # Each rung ranks its own losses.
+    assert pruner.should_stop(9, 100.0) is False
+    assert len(pruner.losses[3]) == len(losses)
+
+
+def test_make_trials_grid(sweep):
+    search_space = {"num_cells": [20, 40], "trainer.learning_rate": [1e-2, 1e-3, 1e-4]}
+    trials = sweep.make_trials(search_space)
+    assert len(trials) == 6
+    assert trials[0] == {"num_cells": 20, "trainer.learning_rate": 1e-2}
+    assert trials[-1] == {"num_cells": 40, "trainer.learning_rate": 1e-4}
+    assert len({tuple(trial.items()) for trial in trials}) == 6
+    assert sweep.make_trials({}) == [{}]
+
+
+def test_make_trials_random(sweep):
+    search_space = {"num_cells": [20, 40], "trainer.learning_rate": [1e-2, 1e-3, 1e-4]}
+    trials = sweep.make_trials(search_space, num_trials=20, seed=1)
+    assert len(trials) == 20
+    assert all(trial.keys() == search_space.keys() for trial in trials)
+    assert all(trial[name] in search_space[name] for trial in trials for name in search_space)
+    assert trials == sweep.make_trials(search_space, num_trials=20, seed=1)
+    assert trials != sweep.make_trials(search_space, num_trials=20, seed=2)
+
+
+def test_trial_hp_args(sweep):
+    hp_args = ["--num_cells", "10", "--trainer.epochs", "27", "--use_feat_static_cat", "True"]
+    overrides = {"num_cells": 40, "trainer.learning_rate": 1e-3, "cardinality": [5], "distr_output": "gluonts.Student"}
+    assert sweep.trial_hp_args(hp_args, overrides) == [
+        "--trainer.epochs",
+        "27",
+        "--use_feat_static_cat",
+        "True",
+        "--num_cells",
+        "40",
+        "--trainer.learning_rate",
+        "0.001",
+        "--cardinality",
+        "[5]",
+        "--distr_output",
+        "gluonts.Student",
+    ]
+
+    # The script's own hyperparameters are left as-is.
+    assert sweep.trial_hp_args(hp_args, {}) == hp_args
+    assert hp_args[1] == "10"
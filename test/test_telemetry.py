@@ -0,0 +1,132 @@
+import logging
+
+import numpy as np
+import pytest
+
+pytestmark = pytest.mark.usefixtures("entrypoint_path")
+
+# Fake seconds per batch.
+DATA_SECONDS = 0.25
+COMPUTE_SECONDS = 1.0
+VALIDATION_SECONDS = 0.5
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class FakeLoader:
+    """Yields num_batches batches of batch_size timeseries, each taking DATA_SECONDS to load."""
+
+    def __init__(self, clock, num_batches, batch_size=4):
+        self.clock = clock
+        self.num_batches = num_batches
+        self.batch_size = batch_size
+
+    def __iter__(self):
+        for _ in range(self.num_batches):
+            self.clock.now += DATA_SECONDS
+            yield {"past_target": np.zeros((self.batch_size, 10)), "future_target": np.zeros((self.batch_size, 3))}
+
+    def __len__(self):
+        return self.num_batches
+
+
+class FakeTrainer:
+    """Trains epochs passes over the loader, like gluonts' Trainer, and validates after each."""
+
+    def __init__(self, clock, epochs=2):
+        self.clock = clock
+        self.epochs = epochs
+        self.halt = False
+        self.lengths = []
+
+    def __call__(self, net, input_names, train_iter, validation_iter=None):
+        self.lengths.append(len(train_iter))
+        assert train_iter.batch_size == 4
+        for _ in range(self.epochs):
+            for _ in train_iter:
+                self.clock.now += COMPUTE_SECONDS
+            if validation_iter is not None:
+                for _ in validation_iter:
+                    self.clock.now += VALIDATION_SECONDS
+
+
+class FakeEstimator:
+    def __init__(self, trainer):
+        self.trainer = trainer
+
+
+def test_timed_training(monkeypatch, caplog):
+    from gluonts_example import telemetry
+
+    clock = Clock()
+    monkeypatch.setattr(telemetry.time, "perf_counter", clock)
+    trainer = FakeTrainer(clock, epochs=2)
+    estimator = FakeEstimator(trainer)
+
+    caplog.set_level(logging.INFO, logger=telemetry.__name__)
+    with telemetry.timed_training(estimator, prefix="deepar.") as metrics:
+        # The proxy reads and writes the attributes of the trainer.
+        assert isinstance(estimator.trainer, telemetry.TimedTrainer)
+        assert estimator.trainer.epochs == 2
+        estimator.trainer.halt = True
+        assert trainer.halt is True
+        estimator.trainer(None, [], FakeLoader(clock, num_batches=5), FakeLoader(clock, num_batches=2))
+    assert estimator.trainer is trainer
+    assert trainer.lengths == [5]
+
+    assert len(metrics.epochs) == 2
+    for i, epoch in enumerate(metrics.epochs):
+        assert epoch["epoch"] == i
+        assert epoch["batches"] == 5
+        assert epoch["series"] == 20
+        assert epoch["data_seconds"] == pytest.approx(5 * DATA_SECONDS)
+        assert epoch["compute_seconds"] == pytest.approx(5 * COMPUTE_SECONDS)
+        # Validation batches are loaded and computed within the validation pass.
+        assert epoch["validation_seconds"] == pytest.approx(2 * (DATA_SECONDS + VALIDATION_SECONDS))
+
+    summary = metrics.metrics()
+    epoch_seconds = 5 * (DATA_SECONDS + COMPUTE_SECONDS)
+    validation_seconds = 2 * (DATA_SECONDS + VALIDATION_SECONDS)
+    assert summary["train_seconds"] == pytest.approx(2 * (epoch_seconds + validation_seconds))
+    assert summary["train_epochs"] == 2
+    assert summary["train_data_seconds"] == pytest.approx(10 * DATA_SECONDS)
+    assert summary["train_compute_seconds"] == pytest.approx(10 * COMPUTE_SECONDS)
+    assert summary["train_validation_seconds"] == pytest.approx(2 * validation_seconds)
+    assert summary["train_series"] == 40
+    assert summary["train_batches"] == 10
+    assert summary["train_series_per_second"] == pytest.approx(40 / (2 * epoch_seconds))
+    assert summary["train_batches_per_second"] == pytest.approx(10 / (2 * epoch_seconds))
+
+    # Each epoch is logged when its pass completes, then its validation pass.
+    assert f"Epoch[1] gluonts[metric-deepar.train_epoch_seconds]: {epoch_seconds}" in caplog.messages
+    assert f"Epoch[0] gluonts[metric-deepar.train_epoch_series_per_second]: {20 / epoch_seconds}" in caplog.messages
+    assert f"Epoch[0] gluonts[metric-deepar.train_epoch_validation_seconds]: {validation_seconds}" in caplog.messages
+
+
+def test_timed_training_without_trainer():
+    from gluonts_example import telemetry
+
+    estimator = FakeEstimator(None)
+    with telemetry.timed_training(estimator) as metrics:
+        assert metrics is None
+    assert estimator.trainer is None
+
+
+def test_timed_training_interrupted(monkeypatch):
+    from gluonts_example import telemetry
+
+    clock = Clock()
+    monkeypatch.setattr(telemetry.time, "perf_counter", clock)
+    trainer = FakeTrainer(clock, epochs=2)
+    estimator = FakeEstimator(trainer)
+    with pytest.raises(RuntimeError):
+        with telemetry.timed_training(estimator) as metrics:
+            raise RuntimeError
+    assert estimator.trainer is trainer
+    assert metrics.epochs == []
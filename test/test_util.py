@@ -0,0 +1,63 @@
+import numpy as np
+import pytest
+from gluonts.dataset.common import ListDataset, MetaData, TrainDatasets
+
+pytestmark = pytest.mark.usefixtures("entrypoint_path")
+
+
+class CountingDataset:
+    """A list of timeseries that counts how many times it has been iterated."""
+
+    def __init__(self, entries):
+        self.entries = entries
+        self.passes = 0
+
+    def __iter__(self):
+        self.passes += 1
+        return iter(self.entries)
+
+    def __len__(self):
+        return len(self.entries)
+
+
+def test_transformed_dataset():
+    from gluonts_example.util import TransformedDataset
+
+    entries = [
+        {"start": "2020-01-01", "target": np.arange(i + 3, dtype=np.float32), "item_id": str(i)} for i in range(3)
+    ]
+    source = CountingDataset(entries)
+    ds = TransformedDataset(source, np.log1p)
+
+    # Lazy: nothing is transformed until iterated, and every pass transforms again.
+    assert source.passes == 0
+    assert len(ds) == 3
+    for _ in range(2):
+        transformed = list(ds)
+        for entry, original in zip(transformed, entries):
+            np.testing.assert_allclose(entry["target"], np.log1p(original["target"]))
+            assert entry["item_id"] == original["item_id"] and entry["start"] == original["start"]
+            assert entry is not original
+    assert source.passes == 2
+
+    # The source timeseries are left unchanged.
+    for i, original in enumerate(entries):
+        np.testing.assert_array_equal(original["target"], np.arange(i + 3, dtype=np.float32))
+        assert set(original) == {"start", "target", "item_id"}
+
+
+def test_log1p_tds():
+    from gluonts_example.util import TransformedDataset, log1p_tds
+
+    data = [{"start": "2020-01-01", "target": np.arange(i + 3, dtype=np.float32)} for i in range(4)]
+    tds = TrainDatasets(MetaData(freq="D", prediction_length=2), ListDataset(data, freq="D"), None)
+    expected = [entry["target"].copy() for entry in tds.train]
+
+    log_tds = log1p_tds(tds)
+    assert isinstance(log_tds.train, TransformedDataset) and log_tds.test is None
+    assert len(log_tds.train) == len(tds.train)
+    assert log_tds.metadata == tds.metadata and log_tds.metadata is not tds.metadata
+    for entry, target in zip(log_tds.train, expected):
+        np.testing.assert_allclose(entry["target"], np.log1p(target))
+    for entry, target in zip(tds.train, expected):
+        np.testing.assert_array_equal(entry["target"], target)